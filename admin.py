@@ -1,31 +1,380 @@
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
 from import_export.admin import ImportExportModelAdmin
-from .models import Tally, TotSchoolSession
+from .models import (
+    METRIC_FIELDS,
+    LeaderboardSnapshot,
+    OutboundMessage,
+    ScoreFormula,
+    SessionMonthlyRollup,
+    SessionUserSummary,
+    Tally,
+    TallyChange,
+    TallyChangeCursor,
+    TallyFlag,
+    TallyIngestRequest,
+    TallyRecord,
+    Target,
+    TotSchoolSession,
+)
+from .pagination import EstimatedCountPaginator
+
+
+class SessionFilter(admin.SimpleListFilter):
+    title = "session"
+    parameter_name = "session"
+
+    def lookups(self, request, model_admin):
+        return [
+            (session.pk, session.name)
+            for session in TotSchoolSession.objects.order_by("-start")
+        ]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        session = TotSchoolSession.objects.filter(pk=self.value()).first()
+        if session is None:
+            return queryset.none()
+        return queryset.filter(date__gte=session.start, date__lte=session.end)
+
+
+class UserAutocompleteFilter(admin.SimpleListFilter):
+    """User filter backed by the admin autocomplete view instead of a full list."""
+
+    title = "user"
+    parameter_name = "user"
+    template = "admin/p_totschool_tally/autocomplete_filter.html"
+    widget_id = "tally-user-filter"
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        widget = get_user_autocomplete_widget(model_admin.admin_site)
+        self.widget_html = widget.render(
+            self.parameter_name, self.value(), attrs={"id": self.widget_id}
+        )
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def choices(self, changelist):
+        yield {
+            "selected": self.value() is None,
+            "query_string": changelist.get_query_string(
+                remove=[self.parameter_name]
+            ),
+            "display": "All",
+        }
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(user_id=self.value())
+        return queryset
+
+
+def get_user_autocomplete_widget(admin_site):
+    return AutocompleteSelect(Tally._meta.get_field("user"), admin_site)
 
 
 @admin.register(Tally)
 class TallyAdmin(ImportExportModelAdmin):
+    list_display = ("user", "date", *METRIC_FIELDS)
+    list_filter = (SessionFilter, UserAutocompleteFilter)
+    list_select_related = ("user",)
+    # Backed by the trigram indexes on the user table (migration 0005)
+    search_fields = ("user__name", "user__email", "user__phone")
+    autocomplete_fields = ("user",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        return super().media + get_user_autocomplete_widget(self.admin_site).media
+
+
+@admin.register(TotSchoolSession)
+class TotSchoolSessionAdmin(ImportExportModelAdmin):
+    list_display = ("name", "kind", "start", "end", "archived_at")
+    search_fields = ("name",)
+    list_filter = ("kind", "start", "end")
+    readonly_fields = ("archived_at",)
+
+
+@admin.register(SessionUserSummary)
+class SessionUserSummaryAdmin(admin.ModelAdmin):
     list_display = (
         "user",
-        "date",
+        "session",
+        "forms_filled",
         "visits",
-        "appointments",
-        "leads",
-        "calls",
         "demos",
-        "letters",
-        "follow_ups",
-        "proposals",
         "policies",
         "premium",
     )
-    list_filter = ("date", "user")
-    search_fields = ("user__name", "user__email", "user__phone")
-    date_hierarchy = "date"
+    list_filter = ("session",)
+    list_select_related = ("user", "session")
+    search_fields = ("user__name",)
 
 
-@admin.register(TotSchoolSession)
-class TotSchoolSessionAdmin(ImportExportModelAdmin):
-    list_display = ("name", "start", "end")
-    search_fields = ("name",)
-    list_filter = ("start", "end")
+@admin.register(SessionMonthlyRollup)
+class SessionMonthlyRollupAdmin(admin.ModelAdmin):
+    list_display = (
+        "user",
+        "session",
+        "month",
+        "forms_filled",
+        "visits",
+        "demos",
+        "policies",
+        "premium",
+    )
+    list_filter = ("session", "month")
+    list_select_related = ("user", "session")
+    search_fields = ("user__name",)
+
+
+@admin.register(TallyIngestRequest)
+class TallyIngestRequestAdmin(admin.ModelAdmin):
+    list_display = ("user", "key", "status", "created_at")
+    list_select_related = ("user",)
+    search_fields = ("key",)
+    readonly_fields = (
+        "user",
+        "key",
+        "request_hash",
+        "status",
+        "response",
+        "created_at",
+    )
+
+
+@admin.register(LeaderboardSnapshot)
+class LeaderboardSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("session", "metric", "date", "size")
+    list_filter = ("session", "metric")
+    list_select_related = ("session",)
+    exclude = ("user_ids", "values")
+    readonly_fields = ("session", "metric", "date", "size")
+
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        "user",
+        "kind",
+        "status",
+        "attempts",
+        "next_attempt_at",
+        "sent_at",
+    )
+    list_filter = ("status", "kind")
+    list_select_related = ("user",)
+    search_fields = ("user__name", "recipient", "dedup_key")
+    readonly_fields = (
+        "user",
+        "kind",
+        "recipient",
+        "body",
+        "dedup_key",
+        "attempts",
+        "claimed_at",
+        "provider_message_id",
+        "last_error",
+        "created_at",
+        "sent_at",
+    )
+    actions = ["retry_messages"]
+
+    @admin.action(description="Retry selected messages now")
+    def retry_messages(self, request, queryset):
+        from django.utils import timezone
+
+        updated = queryset.exclude(status=OutboundMessage.SENT).update(
+            status=OutboundMessage.PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} messages queued for retry.")
+
+
+@admin.register(TallyChange)
+class TallyChangeAdmin(admin.ModelAdmin):
+    list_display = ("id", "op", "user", "date", "delta", "created_at")
+    list_filter = ("op",)
+    list_select_related = ("user",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = (
+        "op",
+        "tally_id",
+        "user",
+        "date",
+        "before",
+        "after",
+        "delta",
+        "created_at",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TallyChangeCursor)
+class TallyChangeCursorAdmin(admin.ModelAdmin):
+    list_display = ("name", "position", "updated_at")
+
+
+@admin.register(TallyRecord)
+class TallyRecordAdmin(admin.ModelAdmin):
+    list_display = ("metric", "period", "holder", "is_org", "value", "period_start")
+    list_filter = ("is_org", "metric", "period")
+    list_select_related = ("holder",)
+    search_fields = ("holder__name", "holder__email")
+    readonly_fields = (
+        "holder",
+        "is_org",
+        "metric",
+        "period",
+        "period_start",
+        "value",
+        "updated_at",
+    )
+
+
+@admin.register(ScoreFormula)
+class ScoreFormulaAdmin(admin.ModelAdmin):
+    list_display = ("name", "weights", "normalize", "is_active", "order")
+    list_editable = ("is_active", "order")
+
+
+@admin.register(Target)
+class TargetAdmin(admin.ModelAdmin):
+    """Roster attainment, read from the maintained target rows."""
+
+    list_display = (
+        "user",
+        "session",
+        "metric",
+        "goal",
+        "achieved",
+        "attainment_display",
+        "projected_display",
+    )
+    list_filter = ("session", "metric")
+    list_select_related = ("user", "session")
+    search_fields = ("user__name", "user__email")
+    autocomplete_fields = ("user",)
+    readonly_fields = ("achieved", "updated_at")
+    actions = ["recount_achieved"]
+
+    def get_queryset(self, request):
+        from .targets import with_attainment
+
+        return with_attainment(super().get_queryset(request))
+
+    def get_ordering(self, request):
+        # An annotation, so it cannot be a static ``ordering``
+        return ["-attainment", "user__name"]
+
+    @admin.display(description="Attainment", ordering="attainment")
+    def attainment_display(self, obj):
+        return f"{obj.attainment:.1f}%"
+
+    # Within a session projections order like attainment
+    @admin.display(description="Projected", ordering="attainment")
+    def projected_display(self, obj):
+        from .targets import get_session_progress, project
+
+        projected = project(obj.achieved, *get_session_progress(obj.session))
+        attainment = projected * 100 / obj.goal if obj.goal else 0
+        return f"{projected} ({attainment:.1f}%)"
+
+    @admin.action(description="Recount achieved totals")
+    def recount_achieved(self, request, queryset):
+        from .targets import rebuild_targets
+
+        sessions = TotSchoolSession.objects.filter(pk__in=queryset.values("session"))
+        updated = rebuild_targets(sessions)
+        self.message_user(request, f"Recounted {updated} targets.")
+
+
+@admin.register(TallyFlag)
+class TallyFlagAdmin(admin.ModelAdmin):
+    """Review queue of the rows flagged by ``detect_tally_anomalies``."""
+
+    list_display = (
+        "agent",
+        "date",
+        "reason",
+        "metric",
+        "value",
+        "score",
+        "detail",
+        "status",
+    )
+    list_filter = ("status", "reason", "metric")
+    list_select_related = ("tally__user",)
+    search_fields = ("tally__user__name", "tally__user__email")
+    ordering = ("-tally__date", "-score")
+    readonly_fields = (
+        "tally",
+        "reason",
+        "metric",
+        "value",
+        "score",
+        "detail",
+        "created_at",
+        "reviewed_at",
+        "reviewed_by",
+    )
+    actions = ["confirm_flags", "dismiss_flags"]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="Agent", ordering="tally__user__name")
+    def agent(self, obj):
+        return obj.tally.user
+
+    @admin.display(description="Date", ordering="tally__date")
+    def date(self, obj):
+        return obj.tally.date
+
+    def review(self, request, queryset, status):
+        from django.utils import timezone
+
+        from .models import flagged_rows_excluded
+        from .singleflight import schedule_invalidation
+
+        updated = queryset.update(
+            status=status, reviewed_at=timezone.now(), reviewed_by=request.user
+        )
+        # update() sends no signals
+        if updated and flagged_rows_excluded():
+            schedule_invalidation()
+        return updated
+
+    @admin.action(description="Confirm selected flags as data errors")
+    def confirm_flags(self, request, queryset):
+        updated = self.review(request, queryset, TallyFlag.CONFIRMED)
+        self.message_user(request, f"{updated} flags confirmed.")
+
+    @admin.action(description="Dismiss selected flags")
+    def dismiss_flags(self, request, queryset):
+        updated = self.review(request, queryset, TallyFlag.DISMISSED)
+        self.message_user(request, f"{updated} flags dismissed.")
+
+    def save_model(self, request, obj, form, change):
+        if change and "status" in form.changed_data:
+            from django.utils import timezone
+
+            obj.reviewed_at = timezone.now()
+            obj.reviewed_by = request.user
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,158 @@
+"""Agent roster of a session and the search behind the tally agent pickers.
+
+The roster is every user with tallies in the session plus users with an
+agent role (TALLY_AGENT_ROLES). Rosters up to TALLY_AGENT_INDEX_LIMIT users
+are cached per process as a sorted name index and searched in memory;
+larger ones are searched in SQL, where ``icontains`` on the user name uses
+the trigram index of migration 0005. A shared version key drops the cached
+rosters in every process when an agent is added or renamed.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .singleflight import get_shared_cache
+
+VERSION_KEY = "tally:agents:version"
+
+# Per-process rosters by session, rebuilt when they expire or another
+# process bumps the shared version
+_rosters = {}
+_rosters_lock = threading.Lock()
+
+
+def get_agent_roles():
+    return getattr(settings, "TALLY_AGENT_ROLES", ["agent"])
+
+
+def get_roster_queryset(session):
+    from users.models import User
+
+    from .models import SessionUserSummary, Tally
+
+    if getattr(session, "archived_at", None):
+        with_tallies = SessionUserSummary.objects.filter(session=session)
+    else:
+        with_tallies = Tally.objects.filter(
+            date__gte=session.start, date__lte=session.end
+        )
+    return User.objects.filter(
+        Q(id__in=with_tallies.values("user")) | Q(role__in=get_agent_roles())
+    )
+
+
+def get_roster_version():
+    cache = get_shared_cache()
+    if cache is None:
+        return 0
+    return cache.get(VERSION_KEY) or 0
+
+
+def get_roster(session):
+    """``[(id, name, folded name)]`` sorted by name, or None for large rosters."""
+    ttl = getattr(settings, "TALLY_SESSION_CACHE_SECONDS", 300)
+    limit = getattr(settings, "TALLY_AGENT_INDEX_LIMIT", 5000)
+    version = get_roster_version()
+    now = time.monotonic()
+
+    current = _rosters.get(session.pk)
+    if current is not None and current[2] > now and current[3] == version:
+        return current[0]
+
+    rows = list(
+        get_roster_queryset(session)
+        .order_by("name", "id")
+        .values_list("id", "name")[: limit + 1]
+    )
+    roster, ids = None, frozenset()
+    if len(rows) <= limit:
+        roster = [(pk, name, (name or "").casefold()) for pk, name in rows]
+        ids = frozenset(pk for pk, _ in rows)
+    with _rosters_lock:
+        _rosters[session.pk] = (roster, ids, now + ttl, version)
+    return roster
+
+
+def _bump_roster_version():
+    _rosters.clear()
+    cache = get_shared_cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def clear_rosters():
+    """Drop the rosters now, and in every process once the change commits."""
+    _rosters.clear()
+    transaction.on_commit(_bump_roster_version)
+
+
+def note_agent_activity(user_id, date):
+    """Drop the rosters when a tally adds a user to one cached here.
+
+    Other processes pick the user up on the version bump, or when their
+    roster expires if this process had not loaded it.
+    """
+    from .intervals import sessions_for_date
+
+    for session in sessions_for_date(date):
+        current = _rosters.get(session.pk)
+        if current is not None and current[0] is not None and user_id not in current[1]:
+            clear_rosters()
+            return
+
+
+def match_roster(roster, query):
+    """Roster entries matching ``query``, word prefix matches first.
+
+    Both groups keep the roster's name order.
+    """
+    query = query.casefold().strip()
+    if not query:
+        return roster
+    prefix, contains = [], []
+    for entry in roster:
+        folded = entry[2]
+        if folded.startswith(query) or f" {query}" in folded:
+            prefix.append(entry)
+        elif query in folded:
+            contains.append(entry)
+    return prefix + contains
+
+
+def search_agents(session, query="", page=1, per_page=20):
+    """One page of the session's agents matching ``query``.
+
+    Returns ``(results, has_more)`` with results as ``{"id", "name"}``.
+    """
+    offset = (max(page, 1) - 1) * per_page
+    roster = get_roster(session)
+    if roster is not None:
+        matches = match_roster(roster, query)
+        rows = [(pk, name) for pk, name, _ in matches[offset : offset + per_page + 1]]
+    else:
+        queryset = get_roster_queryset(session)
+        if query.strip():
+            queryset = queryset.filter(name__icontains=query.strip())
+        rows = list(
+            queryset.order_by("name", "id").values_list("id", "name")[
+                offset : offset + per_page + 1
+            ]
+        )
+    results = [{"id": pk, "name": name} for pk, name in rows[:per_page]]
+    return results, len(rows) > per_page
+
+
+def restrict_to_roster(queryset, session):
+    """Limit a user queryset to the session's roster."""
+    roster = get_roster(session)
+    if roster is not None:
+        return queryset.filter(id__in=[pk for pk, _, _ in roster])
+    return queryset.filter(id__in=get_roster_queryset(session).values("id"))
@@ -0,0 +1,270 @@
+"""Batch detection of suspicious tally rows, for review in the admin.
+
+A session's rows are loaded into arrays, one row per tally sorted by agent
+and date and one column per metric, and checked in vectorised passes:
+
+- outliers: the z-score of a value against the agent's other entries, left
+  out of its own baseline so one huge value cannot hide itself
+- funnel: a stage above the stage it converts from (more policies than
+  demos, ...) and premium without policies
+- jumps: a value many times both the agent's previous entry and their
+  usual level, the typical extra zero
+
+Flags are unique per tally, reason and metric, so a rerun adds new
+findings and keeps the review state of earlier ones. A flag is resolved
+when its row is edited in a metric the finding depends on, and by a rerun
+that no longer finds it; a rerun that finds it again reopens it. Detection
+needs numpy.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import get_metric, get_ratios
+from .models import METRIC_FIELDS, Tally, TallyFlag
+
+DEFAULTS = {
+    # Leave-one-out z-score above which a value is an outlier
+    "z_threshold": 5.0,
+    # Other entries an agent needs before their values are z-scored
+    "min_entries": 5,
+    # Times the previous entry and the usual level that counts as a jump
+    "jump_factor": 10,
+    # Leave rows with open or confirmed flags out of leaderboards
+    "exclude_from_leaderboards": False,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "TALLY_ANOMALIES", {})}
+
+
+def numpy_available():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def load_session_arrays(session):
+    """``(ids, user_ids, values)`` of the session's rows, sorted by agent and date."""
+    import numpy as np
+
+    rows = (
+        Tally.objects.filter(date__gte=session.start, date__lte=session.end)
+        .order_by("user_id", "date")
+        .values_list("id", "user_id", *METRIC_FIELDS)
+    )
+    data = np.array(
+        [[value or 0 for value in row] for row in rows.iterator(chunk_size=5000)],
+        dtype=np.int64,
+    ).reshape(-1, 2 + len(METRIC_FIELDS))
+    return data[:, 0], data[:, 1], data[:, 2:]
+
+
+def detect(user_ids, values, config=None):
+    """Suspicious cells of ``values`` as ``(row, reason, field, score, detail)``.
+
+    ``user_ids`` and the rows of ``values`` must be sorted by agent and
+    date; the columns follow ``METRIC_FIELDS``.
+    """
+    import numpy as np
+
+    config = config or get_config()
+    if not len(user_ids):
+        return []
+    column = {field: index for index, field in enumerate(METRIC_FIELDS)}
+    x = values.astype(float)
+
+    # Sums of every agent's other entries, per row and metric
+    _, group = np.unique(user_ids, return_inverse=True)
+    sums = np.stack(
+        [np.bincount(group, weights=x[:, j]) for j in range(x.shape[1])], axis=1
+    )
+    squares = np.stack(
+        [np.bincount(group, weights=x[:, j] ** 2) for j in range(x.shape[1])], axis=1
+    )
+    others = (np.bincount(group)[group] - 1).astype(float)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(others > 0, (sums[group] - x) / others, 0.0)
+        variance = np.where(
+            others > 0, (squares[group] - x**2) / others - mean**2, 0.0
+        )
+    # Agents who always enter the same value still get a usable spread
+    std = np.maximum(np.sqrt(np.maximum(variance, 0.0)), np.maximum(1.0, mean * 0.1))
+    z = (x - mean) / std
+
+    hits = []
+    rows, cols = np.nonzero(
+        (others >= config["min_entries"]) & (z > config["z_threshold"])
+    )
+    for row, col in zip(rows, cols):
+        hits.append(
+            (
+                row,
+                TallyFlag.ZSCORE,
+                METRIC_FIELDS[col],
+                float(z[row, col]),
+                f"{z[row, col]:.1f} standard deviations above the agent's "
+                f"average of {mean[row, col]:.0f}",
+            )
+        )
+
+    for ratio in get_ratios():
+        numerator = values[:, column[ratio.numerator]]
+        denominator = values[:, column[ratio.denominator]]
+        numerator_label = get_metric(ratio.numerator).label
+        denominator_label = get_metric(ratio.denominator).label
+        for row in np.nonzero(numerator > denominator)[0]:
+            hits.append(
+                (
+                    row,
+                    TallyFlag.FUNNEL,
+                    ratio.numerator,
+                    float(numerator[row] - denominator[row]),
+                    f"{numerator_label} {numerator[row]} above "
+                    f"{denominator_label} {denominator[row]}",
+                )
+            )
+    premium = values[:, column["premium"]]
+    for row in np.nonzero((premium > 0) & (values[:, column["policies"]] == 0))[0]:
+        hits.append(
+            (
+                row,
+                TallyFlag.FUNNEL,
+                "premium",
+                float(premium[row]),
+                "Premium without policies",
+            )
+        )
+
+    # Previous entry of the same agent, 0 on their first row
+    same_agent = np.r_[False, user_ids[1:] == user_ids[:-1]]
+    previous = np.vstack([np.zeros((1, x.shape[1])), x[:-1]])
+    previous[~same_agent] = 0
+    baseline = np.maximum(np.maximum(previous, mean), 1.0)
+    jumps = (
+        same_agent[:, None]
+        & (np.maximum(previous, mean) > 0)
+        & (x >= config["jump_factor"] * baseline)
+    )
+    rows, cols = np.nonzero(jumps)
+    for row, col in zip(rows, cols):
+        hits.append(
+            (
+                row,
+                TallyFlag.JUMP,
+                METRIC_FIELDS[col],
+                float(x[row, col] / baseline[row, col]),
+                f"{x[row, col] / baseline[row, col]:.0f}x the previous entry "
+                f"of {previous[row, col]:.0f}",
+            )
+        )
+    return hits
+
+
+def get_affected_metrics(changed):
+    """Flag metrics whose findings depend on the ``changed`` metric fields.
+
+    A funnel flag is stored under the stage above its denominator, and
+    premium without policies under premium.
+    """
+    affected = set(changed)
+    for ratio in get_ratios():
+        if ratio.denominator in changed:
+            affected.add(ratio.numerator)
+    if "policies" in changed:
+        affected.add("premium")
+    return affected
+
+
+def resolve_changed(changes):
+    """Resolve the active flags of edited rows.
+
+    ``changes`` lists ``(tally_id, before, after)`` metric states. Rerunning
+    the detector reopens the findings that still hold.
+    """
+    affected = {}
+    for tally_id, before, after in changes:
+        if not before or not after:
+            continue
+        changed = {
+            field
+            for field in METRIC_FIELDS
+            if (before.get(field) or 0) != (after.get(field) or 0)
+        }
+        if changed:
+            affected[tally_id] = get_affected_metrics(changed)
+    if not affected:
+        return 0
+    flags = TallyFlag.objects.filter(
+        tally__in=list(affected), status__in=TallyFlag.ACTIVE
+    ).values_list("pk", "tally_id", "metric")
+    resolved = [pk for pk, tally_id, metric in flags if metric in affected[tally_id]]
+    if not resolved:
+        return 0
+    return TallyFlag.objects.filter(pk__in=resolved).update(
+        status=TallyFlag.RESOLVED, reviewed_at=timezone.now()
+    )
+
+
+def detect_session(session, config=None):
+    """Flag the session's suspicious rows and settle the existing flags.
+
+    New findings are added, resolved flags found again are reopened and
+    active flags no longer found are resolved. Dismissed flags keep their
+    review. Returns ``(rows, found, created, reopened, resolved)``.
+    """
+    from .singleflight import schedule_invalidation
+
+    config = config or get_config()
+    ids, user_ids, values = load_session_arrays(session)
+    hits = detect(user_ids, values, config)
+    findings = {
+        (int(ids[row]), reason, field): TallyFlag(
+            tally_id=int(ids[row]),
+            reason=reason,
+            metric=field,
+            value=int(values[row, METRIC_FIELDS.index(field)]),
+            score=round(score, 2),
+            detail=detail[:255],
+        )
+        for row, reason, field, score, detail in hits
+    }
+
+    with transaction.atomic():
+        existing = {
+            (flag.tally_id, flag.reason, flag.metric): flag
+            for flag in TallyFlag.objects.select_for_update(of=("self",)).filter(
+                tally__date__gte=session.start, tally__date__lte=session.end
+            )
+        }
+        new = [flag for key, flag in findings.items() if key not in existing]
+        TallyFlag.objects.bulk_create(new, batch_size=1000, ignore_conflicts=True)
+
+        now = timezone.now()
+        reopened, resolved = [], []
+        for key, flag in existing.items():
+            finding = findings.get(key)
+            if finding is not None and flag.status == TallyFlag.RESOLVED:
+                flag.status = TallyFlag.OPEN
+                flag.value = finding.value
+                flag.score = finding.score
+                flag.detail = finding.detail
+                flag.reviewed_at = flag.reviewed_by = None
+                reopened.append(flag)
+            elif finding is None and flag.status in TallyFlag.ACTIVE:
+                flag.status = TallyFlag.RESOLVED
+                flag.reviewed_at = now
+                resolved.append(flag)
+        TallyFlag.objects.bulk_update(
+            reopened + resolved,
+            ["status", "value", "score", "detail", "reviewed_at", "reviewed_by"],
+            batch_size=1000,
+        )
+
+    if (new or reopened or resolved) and config["exclude_from_leaderboards"]:
+        schedule_invalidation()
+    return len(ids), len(hits), len(new), len(reopened), len(resolved)
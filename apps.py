@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
 
 
 class TotschoolTallyConfig(AppConfig):
@@ -11,3 +13,13 @@ class TotschoolTallyConfig(AppConfig):
     def ready(self):
         from . import components, ui  # noqa: F401
         from . import signals  # noqa: F401
+        from .models import check_metric_columns
+
+        checks.register(check_metric_columns, checks.Tags.models)
+
+        ui.freeze_components()
+
+        if getattr(settings, "TALLY_WARM_ON_START", False):
+            from .warmup import schedule_warm_up_on_start
+
+            schedule_warm_up_on_start()
@@ -0,0 +1,155 @@
+import csv
+import gzip
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import (
+    METRIC_FIELDS,
+    SessionMonthlyRollup,
+    SessionUserSummary,
+    Tally,
+    TotSchoolSession,
+)
+
+
+def get_archive_dir():
+    archive_dir = getattr(settings, "TALLY_ARCHIVE_DIR", None)
+    if archive_dir:
+        return str(archive_dir)
+    return os.path.join(str(settings.BASE_DIR), "tally_archive")
+
+
+def get_archive_path(session, archive_dir=None):
+    filename = f"tally-{session.start:%Y%m%d}-{session.end:%Y%m%d}.csv.gz"
+    return os.path.join(archive_dir or get_archive_dir(), filename)
+
+
+def get_archived_session_for_date(date):
+    """Archived session containing ``date``, read from the database.
+
+    Guards writes, so it skips the per-process session index, which can miss
+    a session archived by another process for a while.
+    """
+    return (
+        TotSchoolSession.objects.filter(
+            archived_at__isnull=False, start__lte=date, end__gte=date
+        )
+        .order_by("start", "end", "pk")
+        .first()
+    )
+
+
+def get_archived_dates(dates):
+    """The ``dates`` that fall in an archived session, in one query."""
+    if not dates:
+        return set()
+    ranges = list(
+        TotSchoolSession.objects.filter(
+            archived_at__isnull=False, start__lte=max(dates), end__gte=min(dates)
+        ).values_list("start", "end")
+    )
+    return {date for date in dates if any(s <= date <= e for s, e in ranges)}
+
+
+def export_session_rows(session, archive_dir=None):
+    """Write the raw daily rows of a session to a gzipped CSV file."""
+    path = get_archive_path(session, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    header = ["id", "user_id", "date", *METRIC_FIELDS]
+    rows = (
+        Tally.objects.filter(date__gte=session.start, date__lte=session.end)
+        .order_by("date", "user_id")
+        .values_list(*header)
+    )
+
+    tmp_path = f"{path}.tmp"
+    count = 0
+    with gzip.open(tmp_path, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows.iterator(chunk_size=2000):
+            writer.writerow(row)
+            count += 1
+    os.replace(tmp_path, path)
+    return path, count
+
+
+def archive_session(session, prune=False, archive_dir=None, force=False):
+    """Freeze a closed session into summaries and export its daily rows.
+
+    Per-user session totals and per-user monthly rollups are rebuilt from
+    the hot table, the raw rows are exported to disk and, when ``prune`` is
+    set, deleted from the hot table. Once ``archived_at`` is set the manager
+    answers dashboard and leaderboard queries for the session from the
+    summaries.
+    """
+    if not session.is_closed and not force:
+        raise ValidationError(f"Session {session.name} has not ended yet.")
+
+    if prune:
+        from .intervals import sessions_overlapping
+
+        # Overlapping contests and campaigns still read these rows
+        open_sessions = [
+            s.name
+            for s in sessions_overlapping(session.start, session.end, archived=False)
+            if s.pk != session.pk
+        ]
+        if open_sessions:
+            raise ValidationError(
+                f"Cannot prune {session.name}, its rows are still used by "
+                f"{', '.join(open_sessions)}."
+            )
+
+    queryset = Tally.objects.filter(date__gte=session.start, date__lte=session.end)
+    sums = {field: Sum(field) for field in METRIC_FIELDS}
+
+    with transaction.atomic():
+        if session.archived_at and not queryset.exists():
+            # Already archived and pruned, the summaries are all that is left
+            return None, 0
+
+        path, count = export_session_rows(session, archive_dir)
+
+        SessionUserSummary.objects.filter(session=session).delete()
+        SessionUserSummary.objects.bulk_create(
+            SessionUserSummary(session=session, **row)
+            for row in queryset.order_by()
+            .values("user_id")
+            .annotate(forms_filled=Count("id"), **sums)
+        )
+
+        SessionMonthlyRollup.objects.filter(session=session).delete()
+        SessionMonthlyRollup.objects.bulk_create(
+            SessionMonthlyRollup(session=session, **row)
+            for row in queryset.order_by()
+            .annotate(month=TruncMonth("date"))
+            .values("user_id", "month")
+            .annotate(forms_filled=Count("id"), **sums)
+        )
+
+        session.archived_at = timezone.now()
+        session.save(update_fields=["archived_at"])
+
+        if prune:
+            queryset.delete()
+
+    return path, count
+
+
+def check_not_archived(instance):
+    """Reject writes to tallies that belong to an archived session."""
+    if not instance.date:
+        return
+    session = get_archived_session_for_date(instance.date)
+    if session:
+        raise ValidationError(
+            f"Session {session.name} is archived and can no longer be edited."
+        )
@@ -0,0 +1,197 @@
+"""Append-only change log of tally rows and its watermark-based export.
+
+Changes are written from post_save and post_delete, which ``Tally.save()``
+and ``Tally.delete()`` run inside their own atomic block, and from the
+``tallies_bulk_saved`` signal sent inside the ingest transaction. A change
+therefore commits or rolls back with its tally write. ``QuerySet.update()``
+bypasses model signals and is not logged, and neither are the rows pruned
+from archived sessions, whose results live on in the session summaries.
+"""
+
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    METRIC_FIELDS,
+    Tally,
+    TallyChange,
+    TallyChangeCursor,
+    get_tally_state,
+)
+
+
+def change_log_enabled():
+    return getattr(settings, "TALLY_CHANGE_LOG", True)
+
+
+def _serialize(state):
+    if state is None:
+        return None
+    return {**state, "date": state["date"].isoformat() if state["date"] else None}
+
+
+def diff(before, after):
+    before = before or {}
+    after = after or {}
+    delta = {}
+    for field in METRIC_FIELDS:
+        change = (after.get(field) or 0) - (before.get(field) or 0)
+        if change:
+            delta[field] = change
+    return delta
+
+
+def change_fields(op, tally_id, before, after):
+    state = after or before
+    return {
+        "op": op,
+        "tally_id": tally_id,
+        "user_id": state["user_id"],
+        "date": state["date"],
+        "before": _serialize(before),
+        "after": _serialize(after),
+        "delta": diff(before, after),
+    }
+
+
+def capture_before(instance):
+    """Make sure an update knows the stored row, called from pre_save."""
+    if instance._state.adding or instance.pk is None:
+        return
+    state = getattr(instance, "_loaded_state", None)
+    if state is None or None in state.values():
+        # Built by hand or loaded with deferred fields
+        stored = (
+            Tally.objects.filter(pk=instance.pk)
+            .values("user_id", "date", *METRIC_FIELDS)
+            .first()
+        )
+        instance._loaded_state = stored
+
+
+def record_save(instance, created):
+    after = get_tally_state(instance)
+    before = None if created else getattr(instance, "_loaded_state", None)
+    instance._loaded_state = after
+    if not created and before == after:
+        return None
+    op = TallyChange.INSERT if created or before is None else TallyChange.UPDATE
+    return TallyChange.objects.create(
+        **change_fields(op, instance.pk, before, after)
+    )
+
+
+def record_delete(instance):
+    before = getattr(instance, "_loaded_state", None) or get_tally_state(instance)
+    return TallyChange.objects.create(
+        **change_fields(TallyChange.DELETE, instance.pk, before, None)
+    )
+
+
+def record_bulk(instances, previous):
+    """Log a bulk upsert; ``previous`` maps (user_id, date) to prior metrics."""
+    changes = []
+    for instance in instances:
+        after = get_tally_state(instance)
+        prior = previous.get((instance.user_id, instance.date))
+        if prior is None:
+            fields = change_fields(TallyChange.INSERT, instance.pk, None, after)
+        else:
+            before = {"user_id": instance.user_id, "date": instance.date, **prior}
+            fields = change_fields(TallyChange.UPDATE, instance.pk, before, after)
+        changes.append(TallyChange(**fields))
+    return TallyChange.objects.bulk_create(changes)
+
+
+def serialize_change(change):
+    return {
+        "seq": change.id,
+        "op": change.op,
+        "tally_id": change.tally_id,
+        "user_id": change.user_id,
+        "date": change.date.isoformat(),
+        "before": change.before,
+        "after": change.after,
+        "delta": change.delta,
+        "created_at": change.created_at.isoformat(),
+    }
+
+
+def get_changes(after_seq=0, limit=1000, lag=None):
+    """Changes with a sequence above ``after_seq``, oldest first.
+
+    Sequences are assigned when a change is inserted but become visible when
+    its transaction commits, so a slow transaction can commit a lower
+    sequence after a higher one was read. ``lag`` seconds (default
+    TALLY_CHANGE_LOG_LAG) hold back recent changes to leave room for that.
+    """
+    if lag is None:
+        lag = getattr(settings, "TALLY_CHANGE_LOG_LAG", 5)
+    queryset = TallyChange.objects.filter(id__gt=after_seq)
+    if lag:
+        queryset = queryset.filter(
+            created_at__lte=timezone.now() - datetime.timedelta(seconds=lag)
+        )
+    return list(queryset.order_by("id")[:limit])
+
+
+CSV_COLUMNS = ["seq", "op", "tally_id", "user_id", "date", "created_at"]
+
+
+def write_changes(changes, stream, fmt="jsonl", header=True):
+    if fmt == "jsonl":
+        for change in changes:
+            stream.write(json.dumps(serialize_change(change), cls=DjangoJSONEncoder))
+            stream.write("\n")
+        return
+
+    writer = csv.writer(stream)
+    if header:
+        writer.writerow(
+            [
+                *CSV_COLUMNS,
+                *(f"{field}_before" for field in METRIC_FIELDS),
+                *(f"{field}_after" for field in METRIC_FIELDS),
+                *(f"{field}_delta" for field in METRIC_FIELDS),
+            ]
+        )
+    for change in changes:
+        row = serialize_change(change)
+        before = change.before or {}
+        after = change.after or {}
+        writer.writerow(
+            [
+                *(row[column] for column in CSV_COLUMNS),
+                *(before.get(field, "") for field in METRIC_FIELDS),
+                *(after.get(field, "") for field in METRIC_FIELDS),
+                *(change.delta.get(field, 0) for field in METRIC_FIELDS),
+            ]
+        )
+
+
+def export_changes(
+    consumer, stream, fmt="jsonl", limit=10000, lag=None, header=True
+):
+    """Write the changes past ``consumer``'s watermark and advance it.
+
+    The cursor row is locked for the export, so one consumer name cannot be
+    exported twice concurrently. Delivery is at least once: if advancing the
+    cursor fails after writing, the next export repeats those changes, and
+    consumers dedupe by ``seq``. Returns ``(count, position)``.
+    """
+    with transaction.atomic():
+        cursor, _ = TallyChangeCursor.objects.select_for_update().get_or_create(
+            name=consumer
+        )
+        changes = get_changes(cursor.position, limit, lag)
+        write_changes(changes, stream, fmt, header)
+        if changes:
+            cursor.position = changes[-1].id
+            cursor.save(update_fields=["position", "updated_at"])
+        return len(changes), cursor.position
@@ -1,21 +1,77 @@
 from typing import List
 from components.base import Component
 from components import *  # noqa
-
-
-def format_currency(amount):
-    """Format number in Indian currency style."""
-    if amount == 0:
-        return "₹0"
-    s = str(amount)
-    if len(s) <= 3:
-        return f"₹{s}"
-    result = s[-3:]
-    s = s[:-3]
-    while s:
-        result = s[-2:] + "," + result
-        s = s[:-2]
-    return f"₹{result}"
+from ..instrumentation import instrument_render
+from ..metrics import (
+    format_currency,
+    get_leaderboard_metrics,
+    get_metrics,
+    get_ratios,
+)
+
+
+LIVE_SCRIPT = """
+<script>
+(function () {
+    window.tallyLiveSources = window.tallyLiveSources || {};
+    var current = window.tallyLiveSources["__UID__"];
+    if (current && current.url === "__URL__") return;
+    if (current) {
+        if (current.source) current.source.close();
+        clearInterval(current.timer);
+    }
+    var live = {url: "__URL__", source: null, timer: null};
+    window.tallyLiveSources["__UID__"] = live;
+
+    function stop() {
+        if (live.source) live.source.close();
+        clearInterval(live.timer);
+        delete window.tallyLiveSources["__UID__"];
+    }
+    function apply(patch) {
+        if (!document.getElementById("__UID__")) return stop();
+        var el = document.getElementById(patch.id);
+        if (!el) return;
+        el.outerHTML = patch.html;
+        if (window.htmx) htmx.process(document.getElementById(patch.id));
+    }
+    // Used when the server has no stream slot free or EventSource is missing
+    function poll() {
+        if (live.timer) return;
+        var url = "__URL__" + ("__URL__".indexOf("?") < 0 ? "?" : "&") + "poll=1";
+        live.timer = setInterval(function () {
+            if (!document.getElementById("__UID__")) return stop();
+            fetch(url, {credentials: "same-origin"})
+                .then(function (r) { return r.ok ? r.json() : {patches: []}; })
+                .then(function (data) { data.patches.forEach(apply); });
+        }, __POLL__);
+    }
+
+    if (!window.EventSource) return poll();
+    live.source = new EventSource("__URL__");
+    live.source.addEventListener("patch", function (e) {
+        apply(JSON.parse(e.data));
+    });
+    live.source.addEventListener("error", function () {
+        if (live.source.readyState === EventSource.CLOSED) poll();
+    });
+})();
+</script>
+"""
+
+
+def render_live_script(uid, live_url):
+    """Script that applies server-sent patches to the component with ``uid``."""
+    from django.conf import settings
+
+    if not live_url:
+        return ""
+    poll_ms = int(getattr(settings, "TALLY_LIVE_POLL_SECONDS", 30) * 1000)
+    return (
+        LIVE_SCRIPT.replace("__UID__", uid)
+        .replace("__URL__", str(live_url))
+        .replace("__POLL__", str(poll_ms))
+    )
 
 
 class WhatsAppReport(Component):
@@ -24,6 +80,7 @@ class WhatsAppReport(Component):
     def __init__(self, classes: str = "", uid: str = "", role: List[str] = []):
         super().__init__(classes, uid, role)
 
+    @instrument_render
     def render_html(self, **kwargs) -> str:
         report_data = kwargs.get("whatsapp_report")
         if report_data is None:
@@ -46,38 +103,9 @@ class WhatsAppReport(Component):
             </div>
             '''
 
-        date_str = report_data["date"].strftime("%d %b, %Y")
-        metrics = [
-            ("visits", "Visits", "total_visits"),
-            ("appointments", "Appointments", "total_appointments"),
-            ("leads", "Leads", "total_leads"),
-            ("calls", "Calls", "total_calls"),
-            ("demos", "Demonstrations", "total_demos"),
-            ("letters", "Follow Up Letters", "total_letters"),
-            ("followups", "Follow Ups", "total_follow_ups"),
-            ("proposals", "Proposals Given", "total_proposals"),
-            ("policies", "Policies Sold", "total_policies"),
-            ("premium", "Premium", "total_premium"),
-        ]
-
-        today = report_data["today"]
-        qtd = report_data["qtd"]
-        lq = report_data["last_quarter"]
-
-        message = "TOT School Report\n"
-        message += f"Date: {date_str}\n"
-        message += f"Name: {report_data['user_name']}\n\n"
-
-        for p, label, key in metrics:
-            today_val = today.get(key, 0)
-            qtd_val = qtd.get(key, 0)
-            lq_val = lq.get(key, 0)
-
-            if key == "total_premium":
-                message += f"- {label}: {format_currency(today_val)}/{format_currency(qtd_val)}/{format_currency(lq_val)}\n"
-            else:
-                message += f"- {label}: {today_val}/{qtd_val}/{lq_val}\n"
+        from ..reports import format_daily_report
 
+        message = format_daily_report(report_data)
         encoded_message = urllib.parse.quote(message)
         whatsapp_url = f"https://wa.me/?text={encoded_message}"
 
@@ -167,33 +195,172 @@ class LeaderboardCard(Component):
 
 
 class LeaderboardContent(Component):
-    """Container for the 4 leaderboard cards."""
+    """Container for a leaderboard card per registered leaderboard metric."""
 
     def __init__(self, classes: str = "", uid: str = "", role: List[str] = []):
         super().__init__(classes, uid, role)
+        self.cards = self.build_cards()
+        self.records = RecordsCard(
+            uid="ldb-records",
+            title="All-Time Records",
+            key="org_records",
+            show_holder=True,
+            classes="md:col-span-2 xl:col-span-4",
+        )
 
-    def render_html(self, **kwargs) -> str:
-        cards = [
-            LeaderboardCard(uid="ldb-visits", title="Top Visits", metric_key="visits"),
-            LeaderboardCard(
-                uid="ldb-demos", title="Top Demonstrations", metric_key="demos"
-            ),
+    def build_cards(self):
+        return [
             LeaderboardCard(
-                uid="ldb-policies", title="Top Policies Sold", metric_key="policies"
-            ),
+                uid=f"ldb-{metric.slug}",
+                title=metric.leaderboard_title,
+                metric_key=metric.field,
+                format_as_currency=metric.currency,
+            )
+            for metric in get_leaderboard_metrics()
+        ]
+
+    def get_cards(self):
+        return self.cards
+
+    def get_score_cards(self, formulas):
+        """Cards of the active score formulas, which change without a rebuild."""
+        return [
             LeaderboardCard(
-                uid="ldb-premium",
-                title="Top Premium",
-                metric_key="premium",
-                format_as_currency=True,
-            ),
+                uid=f"ldb-{formula['key'].replace('_', '-')}",
+                title=formula["title"],
+                metric_key=formula["key"],
+            )
+            for formula in formulas
         ]
 
+    @instrument_render
+    def render_html(self, **kwargs) -> str:
+        cards = [*self.cards, *self.get_score_cards(kwargs.get("score_formulas", []))]
         rendered_cards = "".join([c.render_html(**kwargs) for c in cards])
+        records = self.records.render_html(**kwargs)
+        live_script = render_live_script(self.uid, kwargs.get("live_url"))
 
         return f"""
         <div id="{self.uid}" class="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-2 xl:grid-cols-4 gap-4 {self.classes}">
             {rendered_cards}
+            {records}
+            {live_script}
+        </div>
+        """
+
+
+class RecordsCard(Component):
+    """Best day, week and quarter per leaderboard metric.
+
+    Reads ``{metric: {period: TallyRecord}}`` from the kwargs entry ``key``;
+    ``show_holder`` names the agent holding each record.
+    """
+
+    periods = [("day", "Day"), ("week", "Week"), ("quarter", "Quarter")]
+
+    def __init__(
+        self,
+        title: str,
+        key: str,
+        show_holder: bool = False,
+        classes: str = "",
+        uid: str = "",
+        role: List[str] = [],
+    ):
+        super().__init__(classes, uid, role)
+        self.title = title
+        self.key = key
+        self.show_holder = show_holder
+        self.metrics = get_leaderboard_metrics()
+
+    def render_cell(self, metric, record):
+        if record is None:
+            return '<td class="opacity-50">-</td>'
+        holder = ""
+        if self.show_holder:
+            from django.utils.html import escape
+
+            name = escape(record.holder.name)
+            holder = f'<div class="text-xs opacity-70">{name}</div>'
+        return f"""
+        <td>
+            <div class="font-mono">{metric.format(record.value)}</div>
+            <div class="text-xs opacity-70">{record.period_start:%d %b %Y}</div>
+            {holder}
+        </td>
+        """
+
+    @instrument_render
+    def render_html(self, **kwargs) -> str:
+        records = kwargs.get(self.key)
+        if records is None:
+            return ""
+
+        header = "".join(f"<th>Best {label}</th>" for _, label in self.periods)
+        rows = []
+        for metric in self.metrics:
+            by_period = records.get(metric.field, {})
+            cells = "".join(
+                self.render_cell(metric, by_period.get(period))
+                for period, _ in self.periods
+            )
+            rows.append(f"<tr><td>{metric.label}</td>{cells}</tr>")
+
+        return f"""
+        <div id="{self.uid}" class="bg-base-200 rounded-box border border-base-300 p-4 {self.classes}">
+            <h3 class="font-bold text-lg mb-4 pb-2 border-b border-base-300">{self.title}</h3>
+            <div class="overflow-x-auto">
+                <table class="table table-sm">
+                    <thead><tr><th></th>{header}</tr></thead>
+                    <tbody>{"".join(rows)}</tbody>
+                </table>
+            </div>
+        </div>
+        """
+
+
+class TargetsCard(Component):
+    """Attainment of the agent's targets with run-rate projections.
+
+    Reads the list of target rows from ``targets`` in kwargs.
+    """
+
+    def __init__(self, classes: str = "", uid: str = "", role: List[str] = []):
+        super().__init__(classes, uid, role)
+
+    def render_row(self, target):
+        attainment = target["attainment"]
+        color = "progress-success" if attainment >= 100 else "progress-primary"
+        return f"""
+        <tr>
+            <td>{target["label"]}</td>
+            <td class="font-mono">{target["achieved"]} / {target["goal"]}</td>
+            <td>
+                <div class="flex items-center gap-2">
+                    <progress class="progress {color} w-24" value="{min(attainment, 100)}" max="100"></progress>
+                    <span class="font-mono text-sm">{attainment:.1f}%</span>
+                </div>
+            </td>
+            <td class="font-mono">{target["projected"]} ({target["projected_attainment"]:.1f}%)</td>
+        </tr>
+        """
+
+    @instrument_render
+    def render_html(self, **kwargs) -> str:
+        targets = kwargs.get("targets")
+        if not targets:
+            return ""
+
+        rows = "".join(self.render_row(target) for target in targets)
+        return f"""
+        <div id="{self.uid}" class="bg-base-200 rounded-box border border-base-300 p-4 {self.classes}">
+            <h3 class="font-bold text-lg mb-4 pb-2 border-b border-base-300">Targets</h3>
+            <div class="overflow-x-auto">
+                <table class="table table-sm">
+                    <thead><tr><th></th><th>Achieved</th><th>Attainment</th><th>Projected</th></tr></thead>
+                    <tbody>{rows}</tbody>
+                </table>
+            </div>
         </div>
         """
 
@@ -203,9 +370,11 @@ class StatCard(Component):
 
     Parameters:
         title: The label for the stat (e.g., "Policies Sold")
-        value: The value to display (e.g., "42" or "85.5%")
+        value: The value to display (e.g., "42" or "85.5%"), or a callable
+            receiving the kwargs entry named by ``key``
         description: Optional subtitle/description text
         color: DaisyUI color class (primary, secondary, accent, success, warning, error, info)
+        key: The kwargs entry passed to a callable ``value``
     """
 
     def __init__(
@@ -214,6 +383,7 @@ class StatCard(Component):
         value: str = "",
         description: str = "",
         color: str = "",
+        key: str = "",
         classes: str = "",
         uid: str = "",
         role: List[str] = [],
@@ -223,8 +393,13 @@ class StatCard(Component):
         self.value = value
         self.description = description
         self.color = color
+        self.key = key
 
     def render_html(self, **kwargs) -> str:
+        value = self.value
+        if callable(value):
+            value = value(kwargs.get(self.key) or {})
+
         description_html = (
             f'<div class="stat-desc">{self.description}</div>'
             if self.description
@@ -234,7 +409,7 @@ class StatCard(Component):
         return f"""
         <div id="{self.uid}" class="stat bg-base-100 rounded-box border border-base-300 {self.classes}">
             <div class="stat-title text-md font-bold">{self.title}</div>
-            <div class="text-{self.color} text-lg font-bold">{self.value}</div>
+            <div class="text-{self.color} text-lg font-bold">{value}</div>
             {description_html}
         </div>
         """
@@ -243,16 +418,26 @@ class StatCard(Component):
 class DashboardContent(Component):
     """Renders the full dashboard layout with Performance Summary and Detailed Metrics.
 
-    Reads the 'dashboard' dict from kwargs to populate stat cards.
+    Reads the 'dashboard' dict from kwargs to populate stat cards. The card
+    tree is built once per instance; only the card values are bound per render.
     """
 
     def __init__(self, classes: str = "", uid: str = "", role: List[str] = []):
         super().__init__(classes, uid, role)
+        self.metrics_cards = self.build_metrics_cards()
+        self.tally_stats = self.build_tally_stats()
+        self.whatsapp_report = WhatsAppReport(uid="dash-whatsapp-report")
+        self.targets = TargetsCard(uid="dash-targets", classes="mb-4")
+        self.records = RecordsCard(
+            uid="dash-records", title="Personal Bests", key="records", classes="mt-4"
+        )
 
-    def render_html(self, **kwargs) -> str:
-        d = kwargs.get("dashboard", {})
+    @property
+    def stats_uid(self):
+        return f"{self.uid}-stats"
 
-        metrics_cards = Column(
+    def build_metrics_cards(self):
+        return Column(
             uid="metrics-cards-column",
             classes="mb-4",
             children=[
@@ -268,48 +453,32 @@ class DashboardContent(Component):
                     uid="metrics-cards-row",
                     classes="grid grid-cols-2 lg:grid-cols-4 gap-2 my-2",
                     children=[
-                        StatCard(
-                            uid="dash-appt-visit",
-                            title="Appt. conversion",
-                            value=f"{d.get('appt_visit_ratio', 0)}%",
-                            description="Appt. / Visit Ratio",
-                        ),
-                        StatCard(
-                            uid="dash-demo-appt",
-                            title="Demo conversion",
-                            value=f"{d.get('demo_appt_ratio', 0)}%",
-                            description="Demo / Appt. Ratio",
-                        ),
-                        StatCard(
-                            uid="dash-policy-demo",
-                            title="Policy conversion",
-                            value=f"{d.get('policy_demo_ratio', 0)}%",
-                            description="Policy / Demo Ratio",
-                        ),
+                        *[
+                            StatCard(
+                                uid=f"dash-{ratio.slug}",
+                                title=ratio.label,
+                                key="dashboard",
+                                value=lambda d, k=ratio.key: f"{d.get(k, 0)}%",
+                                description=ratio.description,
+                            )
+                            for ratio in get_ratios()
+                        ],
                         StatCard(
                             uid="dash-forms-filled",
                             title="Forms Filled",
-                            value=str(d.get("forms_filled", 0)),
+                            key="dashboard",
+                            value=lambda d: str(d.get("forms_filled", 0)),
                             description="",
                         ),
                     ],
                 ),
             ],
-        ).render_html(**kwargs)
-
-        metrics = [
-            ("visits", "Visits", "total_visits"),
-            ("appointments", "Appointments", "total_appointments"),
-            ("leads", "Leads", "total_leads"),
-            ("calls", "Calls", "total_calls"),
-            ("demos", "Demonstrations", "total_demos"),
-            ("letters", "Follow Up Letters", "total_letters"),
-            ("followups", "Follow Ups", "total_follow_ups"),
-            ("proposals", "Proposals Given", "total_proposals"),
-            ("policies", "Policies Sold", "total_policies"),
-        ]
+        )
+
+    def build_tally_stats(self):
+        metrics = get_metrics()
 
-        tally_stats = Column(
+        return Column(
             uid="tally-stats-column",
             children=[
                 TitleField(
@@ -325,32 +494,389 @@ class DashboardContent(Component):
                     classes="grid grid-cols-2 md:grid-cols-3 gap-2 my-2",
                     children=[
                         StatCard(
-                            uid=f"dash-{metric[0]}",
-                            title=metric[1],
-                            value=d.get(metric[2], 0),
+                            uid=f"dash-{metric.slug}",
+                            title=metric.label,
+                            key="dashboard",
+                            value=lambda d, k=metric.key: d.get(k, 0),
                             description="",
                         )
                         for metric in metrics
+                        if not metric.currency
                     ],
                 ),
-                StatCard(
-                    uid="dash-premium",
-                    title="Premium",
-                    value=format_currency(d.get("total_premium", 0)),
-                    description="",
-                    color="success",
-                ),
+                *[
+                    StatCard(
+                        uid=f"dash-{metric.slug}",
+                        title=metric.label,
+                        key="dashboard",
+                        value=lambda d, m=metric: m.format(d.get(m.key, 0)),
+                        description="",
+                        color="success",
+                    )
+                    for metric in metrics
+                    if metric.currency
+                ],
             ],
-        ).render_html(**kwargs)
-
-        whatsapp_section = WhatsAppReport(uid="dash-whatsapp-report").render_html(
-            **kwargs
         )
 
+    def render_stats(self, d, **kwargs) -> str:
+        kwargs["dashboard"] = d
+        metrics_cards = self.metrics_cards.render_html(**kwargs)
+        tally_stats = self.tally_stats.render_html(**kwargs)
+
         return f"""
-        <div id="{self.uid}">
-            {whatsapp_section}
+        <div id="{self.stats_uid}">
             {metrics_cards}
             {tally_stats}
         </div>
         """
+
+    @instrument_render
+    def render_html(self, **kwargs) -> str:
+        d = kwargs.get("dashboard", {})
+
+        whatsapp_section = self.whatsapp_report.render_html(**kwargs)
+        live_script = render_live_script(self.uid, kwargs.get("live_url"))
+
+        return f"""
+        <div id="{self.uid}">
+            {whatsapp_section}
+            {self.targets.render_html(**kwargs)}
+            {self.render_stats(d, **kwargs)}
+            {self.records.render_html(**kwargs)}
+            {live_script}
+        </div>
+        """
+
+
+class ProfileList(Component):
+    """Table of captured request profiles with download links."""
+
+    def __init__(self, classes: str = "", uid: str = "", role: List[str] = []):
+        super().__init__(classes, uid, role)
+
+    def render_html(self, **kwargs) -> str:
+        from django.urls import reverse
+        from django.utils.html import escape
+
+        profiles = kwargs.get("profiles", [])
+        if not profiles:
+            return f'''
+            <div id="{self.uid}" class="p-4 text-center text-sm opacity-50 italic {self.classes}">
+                No profiles captured yet. Add <code>?_profile=1</code> or the
+                <code>X-Tally-Profile</code> header to a tally request.
+            </div>
+            '''
+
+        rows_html = []
+        for p in profiles:
+            url = reverse("tally:profile_download", args=[p["id"]])
+            rows_html.append(
+                f"""
+                <tr>
+                    <td class="font-mono text-xs">{escape(p["created"][:19])}</td>
+                    <td>{escape(p["view"])}</td>
+                    <td class="truncate max-w-xs">{escape(p["method"])} {escape(p["path"])}</td>
+                    <td>{escape(p["user"] or "-")}</td>
+                    <td class="font-mono">{p["duration"] * 1000:.0f} ms</td>
+                    <td class="font-mono">{p["query_count"]} / {p["query_time"] * 1000:.0f} ms</td>
+                    <td class="flex gap-2">
+                        <a class="link" href="{url}?kind=prof">.prof</a>
+                        <a class="link" href="{url}?kind=json">SQL &amp; stats</a>
+                    </td>
+                </tr>
+                """
+            )
+
+        return f"""
+        <div id="{self.uid}" class="overflow-x-auto {self.classes}">
+            <table class="table table-sm">
+                <thead>
+                    <tr>
+                        <th>Captured</th>
+                        <th>View</th>
+                        <th>Request</th>
+                        <th>User</th>
+                        <th>Duration</th>
+                        <th>Queries</th>
+                        <th></th>
+                    </tr>
+                </thead>
+                <tbody>{"".join(rows_html)}</tbody>
+            </table>
+        </div>
+        """
+
+
+class RankHistoryChart(Component):
+    """Rank-over-time line chart per leaderboard metric, rendered as inline SVG."""
+
+    width = 320
+    height = 120
+    padding = 8
+
+    def __init__(self, classes: str = "", uid: str = "", role: List[str] = []):
+        super().__init__(classes, uid, role)
+        self.metrics = get_leaderboard_metrics()
+
+    def render_chart(self, entries):
+        ranked = [(i, e) for i, e in enumerate(entries) if e["rank"] is not None]
+        if not ranked:
+            return '<div class="p-2 text-center text-sm opacity-50 italic">No data</div>'
+
+        worst = max(e["size"] for _, e in ranked) or 1
+        span = max(len(entries) - 1, 1)
+        inner_w = self.width - 2 * self.padding
+        inner_h = self.height - 2 * self.padding
+
+        def point(index, rank):
+            # Rank 1 at the top
+            x = self.padding + inner_w * index / span
+            y = self.padding + inner_h * (rank - 1) / max(worst - 1, 1)
+            return f"{x:.1f},{y:.1f}"
+
+        points = " ".join(point(i, e["rank"]) for i, e in ranked)
+        last_index, last = ranked[-1]
+        last_x, last_y = point(last_index, last["rank"]).split(",")
+        return f"""
+        <svg viewBox="0 0 {self.width} {self.height}" class="w-full h-32" role="img">
+            <polyline points="{points}" fill="none" stroke="currentColor"
+                stroke-width="2" class="text-primary" />
+            <circle cx="{last_x}" cy="{last_y}" r="3" class="fill-primary" />
+        </svg>
+        <div class="flex justify-between text-xs opacity-70">
+            <span>{entries[0]["date"]:%d %b}</span>
+            <span>#{last["rank"]} of {last["size"]}</span>
+            <span>{entries[-1]["date"]:%d %b}</span>
+        </div>
+        """
+
+    @instrument_render
+    def render_html(self, **kwargs) -> str:
+        history = kwargs.get("history") or {}
+        cards = []
+        for metric in self.metrics:
+            entries = history.get(metric.field, [])
+            cards.append(
+                f"""
+                <div id="{self.uid}-{metric.slug}" class="bg-base-200 rounded-box border border-base-300 p-4">
+                    <h3 class="font-bold text-lg mb-4 pb-2 border-b border-base-300">{metric.label} Rank</h3>
+                    {self.render_chart(entries)}
+                </div>
+                """
+            )
+        return f"""
+        <div id="{self.uid}" class="grid grid-cols-1 md:grid-cols-2 gap-4 {self.classes}">
+            {"".join(cards)}
+        </div>
+        """
+
+
+class TallyFacets(Component):
+    """Entry counts per agent, per week and submission state of a day.
+
+    Reads the ``facets`` dict from kwargs. Each count links to the list
+    filtered to it, swapped into the table like the filter form.
+    """
+
+    def __init__(self, classes: str = "", uid: str = "", role: List[str] = []):
+        super().__init__(classes, uid, role)
+
+    def link(self, list_url, label, count, **params):
+        from urllib.parse import urlencode
+
+        url = f"{list_url}?{urlencode(params)}"
+        return f"""
+        <li>
+            <a class="flex justify-between gap-2" hx-get="{url}"
+               hx-target="#tally-table_display_content" hx-swap="morph">
+                <span class="truncate">{label}</span>
+                <span class="badge badge-sm">{count}</span>
+            </a>
+        </li>
+        """
+
+    def group(self, title, items):
+        return f"""
+        <div class="bg-base-200 rounded-box border border-base-300 p-2">
+            <h4 class="font-bold text-sm px-2 pb-1">{title}</h4>
+            <ul class="menu menu-sm w-full max-h-64 overflow-y-auto flex-nowrap">
+                {"".join(items)}
+            </ul>
+        </div>
+        """
+
+    @instrument_render
+    def render_html(self, **kwargs) -> str:
+        from django.utils.html import escape
+
+        facets = kwargs.get("facets")
+        list_url = kwargs.get("list_url", "")
+        if not facets:
+            return ""
+
+        date = facets["date"]
+        agents = [
+            self.link(list_url, escape(a["user_name"]), a["entries"], user=a["user_id"])
+            for a in facets["agents"]
+        ]
+        weeks = [
+            self.link(
+                list_url,
+                f"{w['start']:%d %b} - {w['end']:%d %b}",
+                w["entries"],
+                week_start=w["start"].isoformat(),
+                week_end=w["end"].isoformat(),
+            )
+            for w in facets["weeks"]
+        ]
+        missing = facets["missing"]
+        shown = "".join(
+            f'<li class="px-2 truncate">{escape(name)}</li>' for name in missing[:20]
+        )
+        if facets["missing_count"] > len(missing[:20]):
+            shown += (
+                f'<li class="px-2 opacity-50">'
+                f'and {facets["missing_count"] - len(missing[:20])} more</li>'
+            )
+        submissions = [
+            self.link(
+                list_url, "Submitted", facets["submitted"], date=date.isoformat()
+            ),
+            f"""
+            <li>
+                <details>
+                    <summary class="flex justify-between gap-2">
+                        <span>Missing</span>
+                        <span class="badge badge-sm">{facets["missing_count"]}</span>
+                    </summary>
+                    <ul>{shown}</ul>
+                </details>
+            </li>
+            """,
+        ]
+
+        return f"""
+        <div id="{self.uid}" class="grid grid-cols-1 md:grid-cols-3 gap-4 mb-4 {self.classes}">
+            {self.group("Agents", agents)}
+            {self.group("Weeks", weeks)}
+            {self.group(f"On {date:%d %b %Y}", submissions)}
+        </div>
+        """
+
+
+class FacetsLoader(Component):
+    """Placeholder that loads the list facets and reloads them on filtering."""
+
+    def __init__(
+        self,
+        url: str,
+        form: str,
+        classes: str = "",
+        uid: str = "",
+        role: List[str] = [],
+    ):
+        super().__init__(classes, uid, role)
+        self.url = url
+        self.form = form
+
+    def render_html(self, **kwargs) -> str:
+        return f"""
+        <div id="{self.uid}" class="{self.classes}" hx-get="{self.url}"
+             hx-trigger="load, submit from:#{self.form}" hx-include="#{self.form}"
+             hx-swap="innerHTML"></div>
+        """
+
+
+class FunnelTable(Component):
+    """Sortable, paginated per-agent conversion funnel."""
+
+    def __init__(self, classes: str = "", uid: str = "", role: List[str] = []):
+        super().__init__(classes, uid, role)
+        metrics = get_metrics(["visits", "appointments", "demos", "policies"])
+        ratios = {ratio.numerator: ratio for ratio in get_ratios()}
+        # Each stage is followed by its conversion from the previous stage
+        self.columns = [("user__name", "Agent", None)]
+        for metric in metrics:
+            self.columns.append((metric.key, metric.label, str))
+            if metric.field in ratios:
+                ratio = ratios[metric.field]
+                self.columns.append((ratio.key, ratio.label, lambda v: f"{v:.1f}%"))
+        premium = get_metrics(["premium"])[0]
+        self.columns.append((premium.key, premium.label, premium.format))
+        self.columns.append(
+            ("premium_per_policy", "Per Policy", lambda v: premium.format(round(v)))
+        )
+
+    def link(self, params, **changes):
+        from urllib.parse import urlencode
+
+        query = urlencode({k: v for k, v in {**params, **changes}.items() if v})
+        return (
+            f'href="?{query}" hx-get="?{query}" hx-target="#{self.uid}" '
+            f'hx-select="#{self.uid}" hx-swap="outerHTML" hx-push-url="true"'
+        )
+
+    def render_header(self, key, label, params):
+        sort = params.get("sort", "")
+        arrow = ""
+        next_sort = f"-{key}"
+        if sort == key:
+            arrow, next_sort = " ▲", f"-{key}"
+        elif sort == f"-{key}":
+            arrow, next_sort = " ▼", key
+        return (
+            f'<th><a class="link link-hover" '
+            f"{self.link(params, sort=next_sort, page=None)}>{label}{arrow}</a></th>"
+        )
+
+    @instrument_render
+    def render_html(self, **kwargs) -> str:
+        from django.utils.html import escape
+
+        page = kwargs.get("funnel_page")
+        params = kwargs.get("funnel_params", {})
+        if page is None or not page.object_list:
+            return f"""
+            <div id="{self.uid}" class="p-4 text-center text-sm opacity-50 italic {self.classes}">
+                No agents match these filters.
+            </div>
+            """
+
+        header = "".join(
+            self.render_header(key, label, params) for key, label, _ in self.columns
+        )
+        rows = []
+        for row in page.object_list:
+            cells = [f'<td class="truncate max-w-xs">{escape(row["user__name"])}</td>']
+            cells.extend(
+                f'<td class="font-mono">{fmt(row[key])}</td>'
+                for key, _, fmt in self.columns[1:]
+            )
+            rows.append(f"<tr>{''.join(cells)}</tr>")
+
+        pager = []
+        if page.has_previous():
+            pager.append(
+                f'<a class="join-item btn btn-sm" '
+                f"{self.link(params, page=page.previous_page_number())}>«</a>"
+            )
+        pager.append(
+            f'<span class="join-item btn btn-sm btn-disabled">'
+            f"Page {page.number} of {page.paginator.num_pages}</span>"
+        )
+        if page.has_next():
+            pager.append(
+                f'<a class="join-item btn btn-sm" '
+                f"{self.link(params, page=page.next_page_number())}>»</a>"
+            )
+
+        return f"""
+        <div id="{self.uid}" class="overflow-x-auto {self.classes}">
+            <table class="table table-sm">
+                <thead><tr>{header}</tr></thead>
+                <tbody>{"".join(rows)}</tbody>
+            </table>
+            <div class="join mt-4">{"".join(pager)}</div>
+        </div>
+        """
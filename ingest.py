@@ -0,0 +1,216 @@
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .archive import get_archived_dates
+from .metrics import get_metrics
+from .models import Tally, TallyIngestRequest
+from .signals import tallies_bulk_saved
+from .utils import ensure_session_for_date, get_quarter_details_for_date
+
+
+class IngestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def parse_item(item, metric_fields, min_date, today):
+    """Validate one submitted day, returning ``(date, values, errors)``."""
+    errors = {}
+    if not isinstance(item, dict):
+        return None, {}, {"item": "Expected an object."}
+
+    date = None
+    try:
+        date = datetime.date.fromisoformat(str(item.get("date", "")))
+    except ValueError:
+        errors["date"] = "Expected an ISO date (YYYY-MM-DD)."
+    else:
+        if date > today:
+            errors["date"] = "Cannot submit tallies for future dates."
+        elif min_date and date < min_date:
+            errors["date"] = f"Cannot submit tallies before {min_date.isoformat()}."
+
+    values = {}
+    for field in metric_fields:
+        if field not in item:
+            continue
+        value = item[field]
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            errors[field] = "Expected a whole number."
+            continue
+        try:
+            value = int(value)
+        except ValueError:
+            errors[field] = "Expected a whole number."
+            continue
+        if value < 0:
+            errors[field] = "Must not be negative."
+            continue
+        values[field] = value
+
+    unknown = set(item) - set(metric_fields) - {"date"}
+    for field in sorted(unknown):
+        errors[field] = "Unknown field."
+    return date, values, errors
+
+
+def ingest_tallies(user_id, items, restrict_dates=True):
+    """Upsert a batch of daily tallies for one user in a single transaction.
+
+    Existing rows are fetched in one query so retries that change nothing are
+    reported as ``unchanged`` without writing. Sessions are resolved once per
+    batch.
+    """
+    max_items = getattr(settings, "TALLY_INGEST_MAX_ITEMS", 100)
+    if not isinstance(items, list) or not items:
+        raise IngestError("Expected a non-empty list of items.")
+    if len(items) > max_items:
+        raise IngestError(f"A batch may contain at most {max_items} items.")
+
+    metric_fields = [metric.field for metric in get_metrics()]
+    today = timezone.now().date()
+    min_date = None
+    if restrict_dates:
+        max_days = getattr(settings, "TALLY_INGEST_MAX_BACKDATE_DAYS", 7)
+        min_date = today - datetime.timedelta(days=max_days)
+
+    results = []
+    parsed = {}
+    for index, item in enumerate(items):
+        date, values, errors = parse_item(item, metric_fields, min_date, today)
+        if date and date in parsed and not errors:
+            errors["date"] = "Duplicate date in batch."
+        result = {"index": index, "date": date.isoformat() if date else None}
+        if errors:
+            result.update(status="error", errors=errors)
+        else:
+            parsed[date] = (values, result)
+        results.append(result)
+
+    with transaction.atomic():
+        for date in sorted(get_archived_dates(list(parsed))):
+            _, result = parsed.pop(date)
+            result.update(status="error", errors={"date": "Session is archived."})
+
+        existing = {
+            tally.date: tally
+            for tally in Tally.objects.select_for_update().filter(
+                user_id=user_id, date__in=list(parsed)
+            )
+        }
+
+        to_write = []
+        previous = {}
+        for date, (values, result) in parsed.items():
+            current = existing.get(date)
+            if current is None:
+                row = {field: values.get(field, 0) for field in metric_fields}
+                result["status"] = "created"
+            else:
+                before = {field: getattr(current, field) for field in metric_fields}
+                row = {**before, **values}
+                if row == before:
+                    result["status"] = "unchanged"
+                    continue
+                previous[(user_id, date)] = before
+                result["status"] = "updated"
+            to_write.append(Tally(user_id=user_id, date=date, **row))
+
+        if to_write:
+            Tally.objects.bulk_create(
+                to_write,
+                update_conflicts=True,
+                unique_fields=["user", "date"],
+                update_fields=metric_fields,
+            )
+            # Quarters touched by the batch, resolved once instead of per row
+            quarters = {
+                get_quarter_details_for_date(tally.date)[0]: tally.date
+                for tally in to_write
+            }
+            for date in quarters.values():
+                ensure_session_for_date(date)
+            tallies_bulk_saved.send(
+                sender=Tally, instances=to_write, previous=previous
+            )
+
+    return results
+
+
+def summarize_results(results):
+    summary = {"created": 0, "updated": 0, "unchanged": 0, "error": 0}
+    for result in results:
+        summary[result["status"]] += 1
+    return summary
+
+
+def request_fingerprint(payload):
+    """Hash of a request payload, independent of key order and whitespace."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def prune_ingest_requests(user_id):
+    """Forget the user's idempotency keys older than ``TALLY_INGEST_KEY_HOURS``.
+
+    Runs before each keyed request, so an expired key starts a new request
+    and the stored responses of a user stay bounded.
+    """
+    hours = getattr(settings, "TALLY_INGEST_KEY_HOURS", 24)
+    cutoff = timezone.now() - datetime.timedelta(hours=hours)
+    TallyIngestRequest.objects.filter(user_id=user_id, created_at__lt=cutoff).delete()
+
+
+def run_idempotent(user_id, key, handler, fingerprint=""):
+    """Run ``handler`` once per ``(user, key)`` and replay its stored response.
+
+    ``fingerprint`` identifies the request; replaying a key with a different
+    one is refused with a 422 rather than answered with the old response.
+    Keys expire after ``TALLY_INGEST_KEY_HOURS``. Returns
+    ``(status, body, replayed)``.
+    """
+    if not key:
+        status, body = handler()
+        return status, body, False
+
+    with transaction.atomic():
+        prune_ingest_requests(user_id)
+        try:
+            with transaction.atomic():
+                record = TallyIngestRequest.objects.create(
+                    user_id=user_id, key=key, request_hash=fingerprint
+                )
+        except IntegrityError:
+            # Blocks until a concurrent request with the same key commits
+            record = TallyIngestRequest.objects.filter(
+                user_id=user_id, key=key
+            ).first()
+            if record is None:
+                raise IngestError(
+                    "A request with this idempotency key is in progress.", 409
+                )
+            # Keys stored before hashing was added have none to compare
+            if record.request_hash and record.request_hash != fingerprint:
+                raise IngestError(
+                    "This idempotency key was already used for a different "
+                    "request.",
+                    422,
+                )
+            if record.response is None:
+                raise IngestError(
+                    "A request with this idempotency key is in progress.", 409
+                )
+            return record.status, record.response, True
+
+        status, body = handler()
+        record.status = status
+        record.response = body
+        record.save(update_fields=["status", "response"])
+        return status, body, False
@@ -0,0 +1,365 @@
+"""In-process metrics for the tally app, exposed in Prometheus text format.
+
+Metrics live in the memory of each worker process. Without
+TALLY_METRICS_DIR the endpoint serves only the numbers of the process that
+answers the scrape, so under several workers each scrape samples one of
+them. With TALLY_METRICS_DIR set, every process writes its samples there
+at most every TALLY_METRICS_FLUSH_SECONDS and the endpoint sums the files
+of all processes. Clear the directory when the server starts, as counters
+of old processes would otherwise keep counting.
+
+The endpoint is served to superusers, and to scrapers sending
+``Authorization: Bearer <TALLY_METRICS_TOKEN>``.
+"""
+
+import functools
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .profiling import maybe_profile
+from .sqltags import get_caller, get_session_tag, sql_tags
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, count = self.values.get(
+                key, ([0] * len(self.buckets), 0, 0)
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                labels = dict(key)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append(
+                        (
+                            f"{self.name}_bucket",
+                            {**labels, "le": str(bound)},
+                            bucket_count,
+                        )
+                    )
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": "+Inf"}, count)
+                )
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+VIEW_LATENCY = Histogram(
+    "tally_view_duration_seconds", "Time spent serving a tally view."
+)
+VIEW_PREPARE = Histogram(
+    "tally_view_prepare_seconds", "Time spent in prepare_data of a tally view."
+)
+VIEW_RENDER = Histogram(
+    "tally_view_render_seconds",
+    "Time spent in a tally view outside prepare_data, mostly rendering.",
+)
+VIEW_QUERIES = Histogram(
+    "tally_view_queries", "Database queries per tally request.", QUERY_COUNT_BUCKETS
+)
+VIEW_QUERY_TIME = Histogram(
+    "tally_view_query_seconds", "Database time per tally request."
+)
+AGGREGATE_LATENCY = Histogram(
+    "tally_aggregate_duration_seconds", "Time spent in TallyManager aggregates."
+)
+AGGREGATE_QUERIES = Histogram(
+    "tally_aggregate_queries",
+    "Database queries per TallyManager aggregate call.",
+    QUERY_COUNT_BUCKETS,
+)
+COMPONENT_RENDER = Histogram(
+    "tally_component_render_seconds", "Time spent rendering tally components."
+)
+CACHE_REQUESTS = Counter(
+    "tally_cache_requests_total", "Tally cache lookups by cache and result."
+)
+
+REGISTRY = [
+    VIEW_LATENCY,
+    VIEW_PREPARE,
+    VIEW_RENDER,
+    VIEW_QUERIES,
+    VIEW_QUERY_TIME,
+    AGGREGATE_LATENCY,
+    AGGREGATE_QUERIES,
+    COMPONENT_RENDER,
+    CACHE_REQUESTS,
+]
+
+
+class QueryRecorder:
+    """Database execute wrapper that counts queries and their duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def instrument_view(cls):
+    """Class decorator recording latency, query and render metrics for a view."""
+    view_name = f"tally.{cls.__name__}"
+    dispatch = cls.dispatch
+
+    @functools.wraps(dispatch)
+    def instrumented_dispatch(self, request, *args, **kwargs):
+        recorder = QueryRecorder()
+        self._prepare_seconds = 0.0
+        start = time.perf_counter()
+        status = "500"
+        try:
+            with maybe_profile(request, view_name), connection.execute_wrapper(
+                recorder
+            ), sql_tags(view=view_name, caller=get_caller(request.user)):
+                response = dispatch(self, request, *args, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            VIEW_LATENCY.observe(
+                elapsed, view=view_name, method=request.method, status=status
+            )
+            VIEW_QUERIES.observe(recorder.count, view=view_name)
+            VIEW_QUERY_TIME.observe(recorder.duration, view=view_name)
+            if self._prepare_seconds:
+                VIEW_PREPARE.observe(self._prepare_seconds, view=view_name)
+                VIEW_RENDER.observe(elapsed - self._prepare_seconds, view=view_name)
+            flush_samples()
+
+    cls.dispatch = instrumented_dispatch
+
+    prepare_data = getattr(cls, "prepare_data", None)
+    if prepare_data is not None:
+
+        @functools.wraps(prepare_data)
+        def instrumented_prepare_data(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return prepare_data(self, *args, **kwargs)
+            finally:
+                self._prepare_seconds = getattr(self, "_prepare_seconds", 0.0) + (
+                    time.perf_counter() - start
+                )
+
+        cls.prepare_data = instrumented_prepare_data
+
+    return cls
+
+
+def instrument_aggregate(func):
+    """Record latency and query counts of a TallyManager aggregate method."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder), sql_tags(
+                method=func.__name__, session=get_session_tag(kwargs.get("session"))
+            ):
+                return func(*args, **kwargs)
+        finally:
+            AGGREGATE_LATENCY.observe(
+                time.perf_counter() - start, method=func.__name__
+            )
+            AGGREGATE_QUERIES.observe(recorder.count, method=func.__name__)
+
+    return wrapper
+
+
+def instrument_render(func):
+    """Record render time of a component's render_html."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            COMPONENT_RENDER.observe(
+                time.perf_counter() - start, component=type(self).__name__
+            )
+
+    return wrapper
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in sorted(labels.items()):
+        value = (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def collect_samples():
+    """``{metric name: [(sample name, labels, value)]}`` of this process."""
+    return {metric.name: metric.samples() for metric in REGISTRY}
+
+
+def get_metrics_dir():
+    return getattr(settings, "TALLY_METRICS_DIR", None)
+
+
+# Samples file of this process, named per process start so a reused pid
+# does not overwrite the counts of a process that exited
+_samples_file = (None, None)
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def get_samples_path(directory):
+    global _samples_file
+    pid, name = _samples_file
+    if pid != os.getpid():
+        name = f"tally-metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        _samples_file = (os.getpid(), name)
+    return os.path.join(directory, name)
+
+
+def flush_samples(force=False):
+    """Write this process's samples to TALLY_METRICS_DIR, if it is set."""
+    global _last_flush
+    directory = get_metrics_dir()
+    if not directory:
+        return
+    interval = getattr(settings, "TALLY_METRICS_FLUSH_SECONDS", 10)
+    now = time.monotonic()
+    with _flush_lock:
+        if not force and now - _last_flush < interval:
+            return
+        _last_flush = now
+        path = get_samples_path(directory)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(collect_samples(), f)
+            os.replace(f"{path}.tmp", path)
+        except OSError:
+            # Metrics are best effort and never fail a request
+            pass
+
+
+def merge_samples(directory):
+    """Sum the samples written by every process, all counters and histograms."""
+    merged = {metric.name: {} for metric in REGISTRY}
+    for path in sorted(glob.glob(os.path.join(directory, "tally-metrics-*.json"))):
+        try:
+            with open(path) as f:
+                samples = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric_name, rows in samples.items():
+            if metric_name not in merged:
+                continue
+            for name, labels, value in rows:
+                key = (name, tuple(sorted(labels.items())))
+                merged[metric_name][key] = merged[metric_name].get(key, 0) + value
+    return {
+        metric_name: [
+            (name, dict(labels), value) for (name, labels), value in rows.items()
+        ]
+        for metric_name, rows in merged.items()
+    }
+
+
+def render_metrics():
+    directory = get_metrics_dir()
+    if directory:
+        flush_samples(force=True)
+        samples = merge_samples(directory)
+    else:
+        samples = collect_samples()
+
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in samples.get(metric.name, []):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def can_view_metrics(request):
+    token = getattr(settings, "TALLY_METRICS_TOKEN", None)
+    if token and hmac.compare_digest(
+        request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {token}"
+    ):
+        return True
+    # REMOTE_ADDR is the proxy's address behind nginx, so it proves nothing
+    return request.user.is_authenticated and request.user.is_superuser
+
+
+def metrics_view(request):
+    if not can_view_metrics(request):
+        return HttpResponseForbidden("Metrics need a superuser or the metrics token.")
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
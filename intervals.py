@@ -0,0 +1,164 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .singleflight import get_shared_cache
+
+VERSION_KEY = "tally:sessions:version"
+
+
+class _Node:
+    def __init__(self, center, intervals, left, right):
+        self.center = center
+        # Both orders let a point query stop at the first interval that misses
+        self.by_start = sorted(intervals, key=lambda i: i[0])
+        self.by_end = sorted(intervals, key=lambda i: i[1], reverse=True)
+        self.left = left
+        self.right = right
+
+
+class IntervalTree:
+    """Static centered interval tree over closed ``(start, end, item)`` intervals.
+
+    Point queries take O(log n + k) for k matches.
+    """
+
+    def __init__(self, intervals):
+        self.root = self._build(list(intervals))
+
+    @classmethod
+    def _build(cls, intervals):
+        if not intervals:
+            return None
+        points = sorted(p for start, end, _ in intervals for p in (start, end))
+        center = points[len(points) // 2]
+        left, right, here = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        return _Node(center, here, cls._build(left), cls._build(right))
+
+    def at(self, point):
+        """Items whose interval contains ``point``."""
+        found = []
+        node = self.root
+        while node is not None:
+            if point < node.center:
+                for start, end, item in node.by_start:
+                    if start > point:
+                        break
+                    found.append(item)
+                node = node.left
+            elif point > node.center:
+                for start, end, item in node.by_end:
+                    if end < point:
+                        break
+                    found.append(item)
+                node = node.right
+            else:
+                found.extend(item for _, _, item in node.by_start)
+                break
+        return found
+
+    def overlapping(self, start, end):
+        """Items whose interval overlaps ``[start, end]``."""
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            found.extend(
+                item for s, e, item in node.by_start if s <= end and e >= start
+            )
+            if start < node.center:
+                stack.append(node.left)
+            if end > node.center:
+                stack.append(node.right)
+        return found
+
+
+class SessionIndex:
+    """All sessions of the database, indexed by their date range."""
+
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+        self.tree = IntervalTree((s.start, s.end, s) for s in self.sessions)
+
+    @staticmethod
+    def _filter(sessions, kind, archived):
+        if kind is not None:
+            sessions = [s for s in sessions if s.kind == kind]
+        if archived is not None:
+            sessions = [s for s in sessions if bool(s.archived_at) == archived]
+        return sorted(sessions, key=lambda s: (s.start, s.end, s.pk))
+
+    def for_date(self, date, kind=None, archived=None):
+        return self._filter(self.tree.at(date), kind, archived)
+
+    def overlapping(self, start, end, kind=None, archived=None):
+        return self._filter(self.tree.overlapping(start, end), kind, archived)
+
+
+# Per-process index, rebuilt when it expires or another process bumps the
+# shared version after changing a session
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_session_version():
+    cache = get_shared_cache()
+    if cache is None:
+        return 0
+    return cache.get(VERSION_KEY) or 0
+
+
+def get_session_index():
+    global _index
+    ttl = getattr(settings, "TALLY_SESSION_CACHE_SECONDS", 300)
+    version = get_session_version()
+    now = time.monotonic()
+
+    current = _index
+    if current is not None and current[1] > now and current[2] == version:
+        return current[0]
+
+    from .models import TotSchoolSession
+
+    index = SessionIndex(TotSchoolSession.objects.all())
+    with _index_lock:
+        _index = (index, now + ttl, version)
+    return index
+
+
+def _bump_session_version():
+    global _index
+    _index = None
+    cache = get_shared_cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def clear_session_index():
+    """Drop the index now, and in every process once the change commits."""
+    global _index
+    _index = None
+    transaction.on_commit(_bump_session_version)
+
+
+def sessions_for_date(date, kind=None, archived=None):
+    return get_session_index().for_date(date, kind=kind, archived=archived)
+
+
+def sessions_overlapping(start, end, kind=None, archived=None):
+    return get_session_index().overlapping(start, end, kind=kind, archived=archived)
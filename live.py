@@ -0,0 +1,384 @@
+"""Live leaderboard and dashboard patches over server-sent events.
+
+A tally write publishes one compact delta per changed user to the channel
+of each open session containing it; every viewer re-ranks in memory and
+receives only the cards that changed. The default ``InProcessBroker`` only
+reaches viewers connected to the process that handled the write. Run more
+than one worker process with ``TALLY_LIVE_BROKER`` set to
+``p_totschool_tally.live.RedisBroker`` (needs the ``redis`` package).
+
+Each open stream holds a worker thread for up to TALLY_LIVE_MAX_SECONDS.
+TALLY_LIVE_MAX_STREAMS caps the streams per process; viewers past the cap
+poll every TALLY_LIVE_POLL_SECONDS instead.
+"""
+
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class InProcessBroker:
+    """Fans messages out to subscriber queues within the current process."""
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        q = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers[channel].add(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            self._subscribers[channel].discard(q)
+            if not self._subscribers[channel]:
+                del self._subscribers[channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # A slow viewer drops its oldest update rather than blocking others
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait(message)
+                except queue.Full:
+                    # Refilled by a concurrent publisher; this runs in the
+                    # writer's on_commit and must not fail it
+                    pass
+        return len(subscribers)
+
+
+class RedisBroker:
+    """Fans messages out across processes through Redis pub/sub.
+
+    Each process holds one pattern subscription to every session channel,
+    read by a background thread that hands messages to an
+    ``InProcessBroker``. A change is therefore still fanned out once per
+    process, not once per viewer. The server is TALLY_LIVE_REDIS_URL.
+    """
+
+    def __init__(self, url=None, max_queue_size=100):
+        import redis
+
+        url = url or getattr(
+            settings, "TALLY_LIVE_REDIS_URL", "redis://localhost:6379/0"
+        )
+        self.client = redis.Redis.from_url(url)
+        self.local = InProcessBroker(max_queue_size=max_queue_size)
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def _listen(self):
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(session_channel("*"))
+                for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self.local.publish(
+                            message["channel"].decode(), json.loads(message["data"])
+                        )
+            except Exception:
+                # Dropped connection; viewers resync when their stream reconnects
+                time.sleep(1.0)
+            finally:
+                pubsub.close()
+
+    def subscribe(self, channel):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, daemon=True)
+                self._listener.start()
+        return self.local.subscribe(channel)
+
+    def unsubscribe(self, channel, q):
+        self.local.unsubscribe(channel, q)
+
+    def publish(self, channel, message):
+        return self.client.publish(channel, json.dumps(message, default=str))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+# Per-process cap on open streams, each of which holds a worker thread
+_stream_slots = None
+_stream_slots_lock = threading.Lock()
+
+
+def acquire_stream_slot():
+    """Claim a stream slot without waiting; False when the process is full."""
+    global _stream_slots
+    with _stream_slots_lock:
+        if _stream_slots is None:
+            _stream_slots = threading.BoundedSemaphore(
+                getattr(settings, "TALLY_LIVE_MAX_STREAMS", 20)
+            )
+    return _stream_slots.acquire(blocking=False)
+
+
+def release_stream_slot():
+    _stream_slots.release()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            broker_path = getattr(settings, "TALLY_LIVE_BROKER", None)
+            if broker_path:
+                _broker = import_string(broker_path)()
+            else:
+                _broker = InProcessBroker()
+        return _broker
+
+
+def set_broker(broker):
+    global _broker
+    with _broker_lock:
+        _broker = broker
+
+
+def live_updates_enabled():
+    return getattr(settings, "TALLY_LIVE_UPDATES", True)
+
+
+def session_channel(session_id):
+    return f"tally-session-{session_id}"
+
+
+def build_change_message(session, user_id):
+    """Compact delta for one user's change: their totals and the session totals."""
+    from users.models import User
+    from .metrics import get_dashboard_metric_names, get_leaderboard_metric_names
+    from .models import Tally, flagged_rows_excluded
+
+    # The user's totals also patch the dashboards showing that user, so they
+    # cover the dashboard's metrics; leaderboards read the ranked metrics
+    metrics = get_dashboard_metric_names()
+    user_totals = Tally.objects.get_dashboard_stats(
+        user_id=user_id, session=session, metrics=metrics
+    )
+    session_totals = Tally.objects.get_dashboard_stats(
+        session=session, metrics=metrics
+    )
+    message = {
+        "session": session.pk,
+        "user": {
+            "id": user_id,
+            "name": User.objects.filter(id=user_id)
+            .values_list("name", flat=True)
+            .first(),
+            "totals": user_totals,
+        },
+        "totals": session_totals,
+    }
+    if flagged_rows_excluded():
+        # Leaderboards rank the user without their flagged rows
+        message["user"]["ranked_totals"] = Tally.objects.get_dashboard_stats(
+            user_id=user_id,
+            session=session,
+            metrics=get_leaderboard_metric_names(),
+            exclude_flagged=True,
+        )
+    return message
+
+
+def publish_tally_changes(changes):
+    """Publish one delta per changed user to each live session they touched.
+
+    ``changes`` is a list of ``(user_id, date)`` pairs.
+    """
+    from .intervals import sessions_for_date
+
+    broker = get_broker()
+    published = set()
+    for user_id, date in changes:
+        for session in sessions_for_date(date, archived=False):
+            if (session.pk, user_id) in published:
+                continue
+            published.add((session.pk, user_id))
+            broker.publish(
+                session_channel(session.pk), build_change_message(session, user_id)
+            )
+
+
+def publish_tally_change(user_id, date):
+    """Publish a delta to every live session containing ``date``, once per change."""
+    publish_tally_changes([(user_id, date)])
+
+
+def schedule_tally_change(instance):
+    if not live_updates_enabled() or not instance.date:
+        return
+    user_id, date = instance.user_id, instance.date
+    transaction.on_commit(lambda: publish_tally_change(user_id, date))
+
+
+def schedule_tally_changes(instances):
+    if not live_updates_enabled() or not instances:
+        return
+    changes = [(tally.user_id, tally.date) for tally in instances]
+    transaction.on_commit(lambda: publish_tally_changes(changes))
+
+
+def apply_user_delta(rankings, user):
+    """Update full rankings in place with a user's new totals and re-rank."""
+    from .metrics import get_metrics
+
+    for metric in get_metrics(list(rankings)):
+        ranking = [e for e in rankings[metric.field] if e["user_id"] != user["id"]]
+        if user["totals"].get("forms_filled"):
+            ranking.append(
+                {
+                    "user_id": user["id"],
+                    "user_name": user["name"],
+                    "value": user["totals"].get(metric.key, 0),
+                }
+            )
+        ranking.sort(key=lambda e: e["value"], reverse=True)
+        rankings[metric.field] = [
+            {**entry, "rank": index + 1} for index, entry in enumerate(ranking)
+        ]
+
+
+def format_event(event, data):
+    lines = [f"event: {event}"]
+    lines.extend(f"data: {line}" for line in json.dumps(data).splitlines())
+    return "\n".join(lines) + "\n\n"
+
+
+class LiveStream:
+    """Per-viewer SSE stream that patches rendered components from deltas.
+
+    The broker message is computed once per change; each viewer only re-ranks
+    in memory and re-renders the cards whose contents changed.
+    """
+
+    def __init__(self, session, scope, user_id=None, user_name=None):
+        self.session = session
+        self.scope = scope
+        self.user_id = user_id
+        self.user_name = user_name
+        self.rankings = None
+        self.dashboard = None
+        self.rendered = {}
+        self.broker = get_broker()
+        self.channel = session_channel(session.pk)
+        self.subscription = None
+        self.content = None
+        self.initial_patches = []
+        self.holds_slot = False
+
+    def subscribe(self):
+        """Subscribe before loading the initial state so no change is missed."""
+        self.subscription = self.broker.subscribe(self.channel)
+
+    def start(self):
+        self.subscribe()
+        self.initial_patches = self.load_initial_state()
+
+    def __iter__(self):
+        return self.events(self.initial_patches)
+
+    def close(self):
+        """Unsubscribe and free the stream slot, also if never iterated."""
+        if self.subscription is not None:
+            self.broker.unsubscribe(self.channel, self.subscription)
+            self.subscription = None
+        if self.holds_slot:
+            self.holds_slot = False
+            release_stream_slot()
+
+    def load_initial_state(self):
+        from .metrics import get_dashboard_metric_names
+        from .models import Tally
+
+        if self.scope == "leaderboard":
+            self.rankings = Tally.objects.get_leaderboard_rankings(
+                session=self.session
+            )
+        else:
+            self.dashboard = Tally.objects.get_dashboard_stats(
+                user_id=self.user_id,
+                session=self.session,
+                metrics=get_dashboard_metric_names(),
+            )
+        return self.render_patches()
+
+    def apply(self, message):
+        if self.scope == "leaderboard":
+            user = message["user"]
+            if "ranked_totals" in user:
+                user = {**user, "totals": user["ranked_totals"]}
+            apply_user_delta(self.rankings, user)
+        elif not self.user_id:
+            self.dashboard = message["totals"]
+        elif str(message["user"]["id"]) == str(self.user_id):
+            self.dashboard = message["user"]["totals"]
+        return self.render_patches()
+
+    def render_patches(self):
+        from .components.tally_components import DashboardContent, LeaderboardContent
+        from .models import summarize_ranking
+
+        if self.scope == "leaderboard":
+            leaderboards = {
+                metric_name: summarize_ranking(ranking, self.user_id, self.user_name)
+                for metric_name, ranking in self.rankings.items()
+            }
+            if self.content is None:
+                self.content = LeaderboardContent(uid="tally-leaderboard-content")
+            fragments = {
+                card.uid: card.render_html(leaderboards=leaderboards)
+                for card in self.content.get_cards()
+            }
+        else:
+            if self.content is None:
+                self.content = DashboardContent(uid="tally-dashboard-content")
+            fragments = {
+                self.content.stats_uid: self.content.render_stats(self.dashboard)
+            }
+
+        patches = []
+        for uid, html in fragments.items():
+            if self.rendered.get(uid) != html:
+                self.rendered[uid] = html
+                patches.append({"id": uid, "html": html})
+        return patches
+
+    def events(self, initial_patches=()):
+        heartbeat = getattr(settings, "TALLY_LIVE_HEARTBEAT_SECONDS", 15)
+        deadline = time.monotonic() + getattr(
+            settings, "TALLY_LIVE_MAX_SECONDS", 300
+        )
+        try:
+            yield "retry: 3000\n\n"
+            for patch in initial_patches:
+                yield format_event("patch", patch)
+            while time.monotonic() < deadline:
+                try:
+                    message = self.subscription.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                for patch in self.apply(message):
+                    yield format_event("patch", patch)
+        finally:
+            self.close()
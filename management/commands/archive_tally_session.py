@@ -0,0 +1,64 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from p_totschool_tally.archive import archive_session
+from p_totschool_tally.models import TotSchoolSession
+
+
+class Command(BaseCommand):
+    help = "Archive closed tally sessions into summaries and compressed CSV files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sessions",
+            nargs="*",
+            help="Session names to archive. Defaults to every closed session.",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="Delete the archived daily rows from the tally table.",
+        )
+        parser.add_argument(
+            "--archive-dir",
+            help="Directory for the exported CSV files (default: TALLY_ARCHIVE_DIR).",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Archive sessions that have not ended yet.",
+        )
+
+    def handle(self, *args, **options):
+        if options["sessions"]:
+            sessions = TotSchoolSession.objects.filter(name__in=options["sessions"])
+            missing = set(options["sessions"]) - {s.name for s in sessions}
+            if missing:
+                raise CommandError(f"Unknown sessions: {', '.join(sorted(missing))}")
+        else:
+            # Earliest end first, so contests inside a quarter are archived
+            # before the quarter's rows can be pruned
+            sessions = [
+                s
+                for s in TotSchoolSession.objects.order_by("end", "start")
+                if s.is_closed
+            ]
+
+        for session in sessions:
+            try:
+                path, count = archive_session(
+                    session,
+                    prune=options["prune"],
+                    archive_dir=options["archive_dir"],
+                    force=options["force"],
+                )
+            except ValidationError as e:
+                self.stderr.write(self.style.WARNING(" ".join(e.messages)))
+                continue
+
+            if path is None:
+                self.stdout.write(f"{session.name}: already archived")
+            else:
+                self.stdout.write(
+                    self.style.SUCCESS(f"{session.name}: {count} rows -> {path}")
+                )
@@ -0,0 +1,112 @@
+import datetime
+import os
+import time
+
+from django.core.exceptions import FieldError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from p_totschool_tally.models import TotSchoolSession
+from p_totschool_tally.utils import ensure_session_for_date
+from p_totschool_tally.workbooks import (
+    FORMATS,
+    build_jobs,
+    generate_workbooks,
+    get_report_dir,
+    load_session_data,
+    xlsx_available,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the quarter-close report workbooks of tally sessions in parallel: "
+        "a session summary, one per agent group and one per agent. Reruns skip "
+        "workbooks that were already written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sessions",
+            nargs="*",
+            help="Session names. Defaults to the last quarter.",
+        )
+        parser.add_argument(
+            "--output-dir",
+            help="Directory for the workbooks (default: TALLY_REPORT_DIR).",
+        )
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="xlsx needs openpyxl; defaults to xlsx when it is installed.",
+        )
+        parser.add_argument(
+            "--group-by",
+            help="User field to group agents by, e.g. branch.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Worker processes (default: one per core).",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rebuild workbooks that already exist.",
+        )
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or ("xlsx" if xlsx_available() else "csv")
+        if fmt == "xlsx" and not xlsx_available():
+            raise CommandError("xlsx output needs openpyxl, use --format csv.")
+
+        if options["sessions"]:
+            sessions = list(
+                TotSchoolSession.objects.filter(name__in=options["sessions"])
+            )
+            missing = set(options["sessions"]) - {s.name for s in sessions}
+            if missing:
+                raise CommandError(f"Unknown sessions: {', '.join(sorted(missing))}")
+        else:
+            current = ensure_session_for_date(timezone.now().date())
+            sessions = [
+                ensure_session_for_date(current.start - datetime.timedelta(days=1))
+            ]
+
+        output_dir = options["output_dir"] or get_report_dir()
+        started = time.monotonic()
+        jobs = []
+        for session in sessions:
+            try:
+                data = load_session_data(session, group_by=options["group_by"])
+            except FieldError as e:
+                raise CommandError(f"Cannot group by {options['group_by']}: {e}")
+            jobs.extend(build_jobs(session, data, output_dir, fmt))
+        self.stdout.write(
+            f"Loaded {len(jobs)} workbooks in {time.monotonic() - started:.1f}s"
+        )
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+
+        def progress(done, total, path, error):
+            if error:
+                self.stderr.write(f"[{done}/{total}] {path}: {error}")
+            elif done == total or done % 50 == 0:
+                self.stdout.write(f"[{done}/{total}] {path}")
+
+        written, skipped, failed = generate_workbooks(
+            jobs,
+            workers=options["workers"],
+            force=options["force"],
+            progress=progress,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {written} workbooks to {output_dir} in "
+                f"{time.monotonic() - started:.1f}s, skipped {skipped} existing"
+            )
+        )
+        if failed:
+            raise CommandError(f"{len(failed)} workbooks failed, rerun to retry them.")
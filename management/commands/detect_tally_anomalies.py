@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from p_totschool_tally.anomalies import detect_session, get_config, numpy_available
+from p_totschool_tally.models import TotSchoolSession
+from p_totschool_tally.utils import ensure_session_for_date
+
+
+class Command(BaseCommand):
+    help = (
+        "Flag suspicious tally rows (outliers for the agent, funnel "
+        "inconsistencies and sudden jumps) for review in the admin. Reruns "
+        "keep the review state of existing flags and resolve the findings "
+        "that no longer hold. Needs numpy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sessions",
+            nargs="*",
+            help="Session names. Defaults to the current quarter.",
+        )
+        parser.add_argument(
+            "--z-threshold",
+            type=float,
+            help="Z-score above which a value is an outlier "
+            "(TALLY_ANOMALIES['z_threshold']).",
+        )
+
+    def handle(self, *args, **options):
+        if not numpy_available():
+            raise CommandError("The anomaly detector needs numpy installed.")
+
+        if options["sessions"]:
+            sessions = list(
+                TotSchoolSession.objects.filter(name__in=options["sessions"])
+            )
+            missing = set(options["sessions"]) - {s.name for s in sessions}
+            if missing:
+                raise CommandError(f"Unknown sessions: {', '.join(sorted(missing))}")
+        else:
+            sessions = [ensure_session_for_date(timezone.now().date())]
+
+        config = get_config()
+        if options["z_threshold"] is not None:
+            config["z_threshold"] = options["z_threshold"]
+
+        for session in sessions:
+            started = time.monotonic()
+            rows, found, created, reopened, resolved = detect_session(
+                session, config
+            )
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{session.name}: scanned {rows} rows in {elapsed:.1f}s, "
+                    f"{found} findings, {created} new flags, {reopened} reopened, "
+                    f"{resolved} resolved"
+                )
+            )
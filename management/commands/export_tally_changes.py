@@ -0,0 +1,48 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand
+
+from p_totschool_tally.changelog import export_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Export tally changes past a consumer's watermark as JSON lines or CSV "
+        "and advance the watermark."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("consumer", help="Name of the downstream consumer.")
+        parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+        parser.add_argument(
+            "--out", help="File to append to (default: standard output)."
+        )
+        parser.add_argument("--limit", type=int, default=10000)
+        parser.add_argument(
+            "--lag",
+            type=int,
+            help="Hold back changes newer than this many seconds "
+            "(default: TALLY_CHANGE_LOG_LAG).",
+        )
+
+    def handle(self, *args, **options):
+        fmt = options["format"]
+        if options["out"]:
+            header = not os.path.exists(options["out"]) or not os.path.getsize(
+                options["out"]
+            )
+            with open(options["out"], "a", newline="") as stream:
+                count, position = export_changes(
+                    options["consumer"],
+                    stream,
+                    fmt,
+                    options["limit"],
+                    options["lag"],
+                    header,
+                )
+        else:
+            count, position = export_changes(
+                options["consumer"], sys.stdout, fmt, options["limit"], options["lag"]
+            )
+        self.stderr.write(f"Exported {count} changes, watermark at {position}")
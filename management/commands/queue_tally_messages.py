@@ -0,0 +1,32 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from p_totschool_tally.models import OutboundMessage
+from p_totschool_tally.outbound import enqueue_daily_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue daily report messages for agents who submitted and reminders "
+        "for those who did not. Safe to rerun, queued messages are deduplicated."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date",
+            type=datetime.date.fromisoformat,
+            help="Report day (default: today).",
+        )
+        parser.add_argument(
+            "--kind",
+            action="append",
+            dest="kinds",
+            choices=[kind for kind, _ in OutboundMessage.KIND_CHOICES],
+            help="Message kind to queue, repeatable (default: both).",
+        )
+
+    def handle(self, *args, **options):
+        kinds = options["kinds"] or [kind for kind, _ in OutboundMessage.KIND_CHOICES]
+        created = enqueue_daily_messages(date=options["date"], kinds=kinds)
+        self.stdout.write(self.style.SUCCESS(f"Queued {created} messages"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from p_totschool_tally.records import rebuild_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every personal and org-wide tally record from the tally "
+        "table. Records are kept up to date on every write; run this after "
+        "changing the metrics or writing tallies with QuerySet.update()."
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild_records()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} personal records"))
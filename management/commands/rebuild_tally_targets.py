@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from p_totschool_tally.models import TotSchoolSession
+from p_totschool_tally.targets import rebuild_targets
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the achieved totals of tally targets from the tally table. "
+        "Targets are kept up to date on every write; run this after writing "
+        "tallies with QuerySet.update()."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sessions",
+            nargs="*",
+            help="Session names. Defaults to every session with targets.",
+        )
+
+    def handle(self, *args, **options):
+        if options["sessions"]:
+            sessions = list(
+                TotSchoolSession.objects.filter(name__in=options["sessions"])
+            )
+            missing = set(options["sessions"]) - {s.name for s in sessions}
+            if missing:
+                raise CommandError(f"Unknown sessions: {', '.join(sorted(missing))}")
+        else:
+            sessions = TotSchoolSession.objects.filter(targets__isnull=False).distinct()
+
+        count = rebuild_targets(sessions)
+        self.stdout.write(self.style.SUCCESS(f"Recounted {count} targets"))
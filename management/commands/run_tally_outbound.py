@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from p_totschool_tally.outbound import run_worker
+
+
+class Command(BaseCommand):
+    help = "Send queued tally messages through the configured provider."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when no message is due instead of polling.",
+        )
+        parser.add_argument(
+            "--idle-sleep",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls of an empty queue.",
+        )
+
+    def handle(self, *args, **options):
+        total = run_worker(once=options["once"], idle_sleep=options["idle_sleep"])
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} messages"))
@@ -0,0 +1,65 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from p_totschool_tally.intervals import sessions_for_date
+from p_totschool_tally.models import TotSchoolSession
+from p_totschool_tally.snapshots import session_dates, take_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Store each agent's leaderboard rank and value per metric for a day. "
+        "Run nightly after submissions close."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date",
+            type=datetime.date.fromisoformat,
+            help="Day to snapshot (default: today).",
+        )
+        parser.add_argument(
+            "--session",
+            action="append",
+            dest="sessions",
+            help="Session name to snapshot. Defaults to every open session.",
+        )
+        parser.add_argument(
+            "--backfill",
+            action="store_true",
+            help="Snapshot every day from the session start up to the date.",
+        )
+
+    def handle(self, *args, **options):
+        date = options["date"] or timezone.now().date()
+
+        if options["sessions"]:
+            sessions = list(
+                TotSchoolSession.objects.filter(name__in=options["sessions"])
+            )
+            missing = set(options["sessions"]) - {s.name for s in sessions}
+            if missing:
+                raise CommandError(f"Unknown sessions: {', '.join(sorted(missing))}")
+        else:
+            sessions = sessions_for_date(date, archived=False)
+
+        for session in sessions:
+            if session.archived_at:
+                self.stderr.write(
+                    self.style.WARNING(f"{session.name}: archived, skipped")
+                )
+                continue
+            dates = [date]
+            if options["backfill"]:
+                dates = list(session_dates(session, date))
+            snapshots = take_snapshots(session, dates)
+            days = len({s.date for s in snapshots})
+            size = sum(len(s.user_ids) + len(s.values) for s in snapshots)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{session.name}: {len(snapshots)} snapshots over {days} days "
+                    f"({size / 1024:.1f} KiB)"
+                )
+            )
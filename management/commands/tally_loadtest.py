@@ -0,0 +1,201 @@
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from p_totschool_tally.management.commands.tally_loadtest_seed import (
+    random_tally_values,
+)
+
+LOCK_MARKERS = (
+    "database is locked",
+    "deadlock detected",
+    "could not obtain lock",
+    "could not serialize access",
+    "lock wait timeout",
+)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.lock_contention = Counter()
+        self.requests = 0
+
+    def record(self, step, elapsed, status, body):
+        with self.lock:
+            self.requests += 1
+            self.latencies[step].append(elapsed)
+            if status >= 400 or status == 0:
+                self.errors[step] += 1
+            text = body.lower()
+            if status in (409, 423, 503) or any(m in text for m in LOCK_MARKERS):
+                self.lock_contention[step] += 1
+
+
+class VirtualUser:
+    """One simulated browser with its own cookies."""
+
+    def __init__(self, base_url, cookie_name, session_key, stats, timeout):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        host = urllib.parse.urlsplit(self.base_url).hostname
+        self.cookies.set_cookie(
+            http.cookiejar.Cookie(
+                0, cookie_name, session_key, None, False, host, False, False,
+                "/", True, False, None, False, None, None, {},
+            )
+        )
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies)
+        )
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == "csrftoken":
+                return cookie.value
+        return ""
+
+    def request(self, step, path, data=None):
+        url = urllib.parse.urljoin(self.base_url, path)
+        headers = {"HX-Request": "true"}
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(
+                {**data, "csrfmiddlewaretoken": self.csrf_token()}
+            ).encode()
+            headers["X-CSRFToken"] = self.csrf_token()
+            headers["Referer"] = url
+        request = urllib.request.Request(url, data=body, headers=headers)
+
+        start = time.perf_counter()
+        status, text = 0, ""
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                status = response.status
+                text = response.read().decode(errors="replace")
+        except urllib.error.HTTPError as e:
+            status = e.code
+            text = e.read().decode(errors="replace")
+        except (urllib.error.URLError, OSError) as e:
+            text = str(e)
+        self.stats.record(step, time.perf_counter() - start, status, text)
+
+    def agent_flow(self, prefix):
+        self.request("daily_form", f"{prefix}daily/")
+        self.request("submit", f"{prefix}daily/", data=random_tally_values())
+        self.request("dashboard", f"{prefix}dashboard/")
+        self.request("leaderboard", f"{prefix}leaderboard/")
+        self.request("list", f"{prefix}list/")
+
+    def admin_flow(self, prefix):
+        self.request("dashboard", f"{prefix}dashboard/")
+        self.request("leaderboard", f"{prefix}leaderboard/")
+        self.request("list", f"{prefix}list/")
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate the evening submission rush against a running server and "
+        "report throughput, latency percentiles, errors and lock contention."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000/")
+        parser.add_argument("--prefix", default="tally/")
+        parser.add_argument("--sessions", default="loadtest_sessions.json")
+        parser.add_argument("--agents", type=int, default=50)
+        parser.add_argument("--admins", type=int, default=5)
+        parser.add_argument("--duration", type=float, default=60)
+        parser.add_argument(
+            "--think-time", type=float, default=0.5, help="Mean pause between flows."
+        )
+        parser.add_argument("--timeout", type=float, default=30)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["sessions"]) as f:
+                sessions = json.load(f)
+        except OSError as e:
+            raise CommandError(f"Run tally_loadtest_seed first: {e}")
+
+        agent_keys = sessions["agents"][: options["agents"]]
+        admin_keys = sessions["admins"][: options["admins"]]
+        if len(agent_keys) < options["agents"] or len(admin_keys) < options["admins"]:
+            raise CommandError("Not enough seeded sessions for the requested mix.")
+
+        stats = Stats()
+        deadline = time.monotonic() + options["duration"]
+        prefix = options["prefix"]
+
+        def run(session_key, is_admin):
+            user = VirtualUser(
+                options["base_url"],
+                sessions["session_cookie_name"],
+                session_key,
+                stats,
+                options["timeout"],
+            )
+            # Spread the start so the rush ramps up like it does in the evening
+            time.sleep(random.uniform(0, options["think_time"] * 2))
+            while time.monotonic() < deadline:
+                if is_admin:
+                    user.admin_flow(prefix)
+                else:
+                    user.agent_flow(prefix)
+                time.sleep(random.expovariate(1 / options["think_time"]))
+
+        workers = [(key, False) for key in agent_keys] + [
+            (key, True) for key in admin_keys
+        ]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+            for future in [pool.submit(run, *worker) for worker in workers]:
+                future.result()
+        elapsed = time.monotonic() - started
+
+        self.report(stats, elapsed)
+
+    def report(self, stats, elapsed):
+        self.stdout.write(
+            f"{stats.requests} requests in {elapsed:.1f}s "
+            f"({stats.requests / elapsed:.1f} req/s)\n"
+        )
+        self.stdout.write(
+            f"{'step':<12} {'count':>7} {'p50 ms':>8} {'p90 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'max ms':>8} {'errors':>7} {'locks':>6}"
+        )
+        for step, latencies in sorted(stats.latencies.items()):
+            self.stdout.write(
+                f"{step:<12} {len(latencies):>7} "
+                f"{percentile(latencies, 50) * 1000:>8.1f} "
+                f"{percentile(latencies, 90) * 1000:>8.1f} "
+                f"{percentile(latencies, 95) * 1000:>8.1f} "
+                f"{percentile(latencies, 99) * 1000:>8.1f} "
+                f"{max(latencies) * 1000:>8.1f} "
+                f"{stats.errors[step]:>7} {stats.lock_contention[step]:>6}"
+            )
+        self.stdout.write(
+            f"\nerrors: {sum(stats.errors.values())}, "
+            f"lock contention: {sum(stats.lock_contention.values())}"
+        )
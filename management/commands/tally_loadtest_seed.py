@@ -0,0 +1,118 @@
+import datetime
+import json
+import random
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from users.models import User
+
+from p_totschool_tally.metrics import get_metrics
+from p_totschool_tally.models import Tally
+from p_totschool_tally.signals import tallies_bulk_saved
+from p_totschool_tally.utils import ensure_session_for_date
+
+
+def random_tally_values():
+    visits = random.randint(0, 12)
+    appointments = random.randint(0, visits)
+    demos = random.randint(0, appointments)
+    policies = random.randint(0, demos)
+    values = {metric.field: random.randint(0, 20) for metric in get_metrics()}
+    values.update(
+        visits=visits,
+        appointments=appointments,
+        demos=demos,
+        policies=policies,
+        premium=policies * random.randint(5000, 50000),
+    )
+    return values
+
+
+def create_login_session(user):
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+class Command(BaseCommand):
+    help = "Seed load-test agents, admins and tallies, and write their login cookies."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--agents", type=int, default=200)
+        parser.add_argument("--admins", type=int, default=5)
+        parser.add_argument(
+            "--days", type=int, default=30, help="Days of history per agent."
+        )
+        parser.add_argument("--out", default="loadtest_sessions.json")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        today = timezone.now().date()
+
+        def get_users(prefix, count, role):
+            users = []
+            for i in range(count):
+                user, _ = User.objects.get_or_create(
+                    email=f"{prefix}{i}@loadtest.invalid",
+                    defaults={
+                        "name": f"Load Test {prefix.title()} {i}",
+                        "phone": f"9{i:09d}",
+                        "role": role,
+                    },
+                )
+                users.append(user)
+            return users
+
+        agents = get_users("agent", options["agents"], "agent")
+        admins = get_users("admin", options["admins"], "totschool_admin")
+
+        for day in range(0, options["days"] + 1, 28):
+            ensure_session_for_date(today - datetime.timedelta(days=day))
+
+        # History only, today is left for the load test to submit. Rows from
+        # an earlier seed are kept, so only new ones are inserted
+        start = today - datetime.timedelta(days=options["days"])
+        existing = set(
+            Tally.objects.filter(user__in=agents, date__gte=start).values_list(
+                "user_id", "date"
+            )
+        )
+        tallies = [
+            Tally(user=agent, date=date, **random_tally_values())
+            for agent in agents
+            for date in (
+                today - datetime.timedelta(days=day)
+                for day in range(1, options["days"] + 1)
+            )
+            if random.random() < 0.85 and (agent.id, date) not in existing
+        ]
+        with transaction.atomic():
+            Tally.objects.bulk_create(tallies, batch_size=2000)
+            # Fill the change log, records and targets as real writes do
+            tallies_bulk_saved.send(sender=Tally, instances=tallies, previous={})
+
+        with open(options["out"], "w") as f:
+            json.dump(
+                {
+                    "session_cookie_name": settings.SESSION_COOKIE_NAME,
+                    "agents": [create_login_session(u) for u in agents],
+                    "admins": [create_login_session(u) for u in admins],
+                },
+                f,
+                indent=2,
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {len(agents)} agents, {len(admins)} admins and "
+                f"{len(tallies)} tallies; sessions written to {options['out']}"
+            )
+        )
@@ -0,0 +1,70 @@
+import json
+import random
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local HTTP endpoint that accepts HttpProvider batches, logs them "
+        "and can fail a share of messages to exercise retries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8025)
+        parser.add_argument(
+            "--fail-rate",
+            type=float,
+            default=0.0,
+            help="Share of messages to reject, between 0 and 1.",
+        )
+
+    def handle(self, *args, **options):
+        stdout = self.stdout
+        fail_rate = options["fail_rate"]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    messages = json.loads(self.rfile.read(length))["messages"]
+                except (ValueError, KeyError):
+                    self.send_error(400, "Expected {\"messages\": [...]}")
+                    return
+
+                results = []
+                for message in messages:
+                    if random.random() < fail_rate:
+                        results.append(
+                            {"id": message["id"], "ok": False, "error": "Stub failure"}
+                        )
+                        continue
+                    stdout.write(f"-> {message['to']} ({message['kind']})")
+                    results.append(
+                        {
+                            "id": message["id"],
+                            "ok": True,
+                            "provider_id": uuid.uuid4().hex,
+                        }
+                    )
+
+                body = json.dumps({"results": results}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", options["port"]), Handler)
+        self.stdout.write(f"Outbound stub listening on 127.0.0.1:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,86 @@
+import json
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from p_totschool_tally.sqltags import parse_comment
+
+DURATION_RE = re.compile(r"duration: ([\d.]+) ms")
+
+
+def read_entries(path):
+    """Yield ``(tags, seconds)`` from a capture file or a database log.
+
+    Capture files hold one JSON object per line. Any other line is read as a
+    log line with a sqlcommenter comment and, as PostgreSQL logs it with
+    log_min_duration_statement, a ``duration: N ms`` prefix.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                yield entry["tags"], entry["duration"]
+                continue
+            tags = parse_comment(line)
+            if tags:
+                match = DURATION_RE.search(line)
+                yield tags, float(match.group(1)) / 1000 if match else 0.0
+
+
+class Command(BaseCommand):
+    help = "Group captured tally SQL by its tags and rank the groups by database time."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            help="Capture file or database log (default: TALLY_SQL_CAPTURE_FILE).",
+        )
+        parser.add_argument(
+            "--group-by",
+            default="view,method",
+            help="Comma separated tags to group by (default: view,method).",
+        )
+        parser.add_argument("--top", type=int, default=20)
+
+    def handle(self, *args, **options):
+        path = options["path"] or getattr(settings, "TALLY_SQL_CAPTURE_FILE", None)
+        if not path:
+            raise CommandError("Pass a file or set TALLY_SQL_CAPTURE_FILE.")
+        keys = [key.strip() for key in options["group_by"].split(",") if key.strip()]
+
+        groups = defaultdict(list)
+        try:
+            for tags, duration in read_entries(path):
+                groups[tuple(tags.get(key, "-") for key in keys)].append(duration)
+        except OSError as e:
+            raise CommandError(str(e))
+        if not groups:
+            self.stdout.write("No tagged queries found.")
+            return
+
+        total = sum(sum(durations) for durations in groups.values()) or 1
+        ranked = sorted(groups.items(), key=lambda item: sum(item[1]), reverse=True)
+
+        width = max(len(" / ".join(group)) for group, _ in ranked[: options["top"]])
+        width = max(width, len(" / ".join(keys)))
+        self.stdout.write(
+            f"{' / '.join(keys):<{width}} {'queries':>8} {'total ms':>10} "
+            f"{'avg ms':>8} {'max ms':>8} {'share':>6}"
+        )
+        for group, durations in ranked[: options["top"]]:
+            self.stdout.write(
+                f"{' / '.join(group):<{width}} {len(durations):>8} "
+                f"{sum(durations) * 1000:>10.1f} "
+                f"{sum(durations) / len(durations) * 1000:>8.2f} "
+                f"{max(durations) * 1000:>8.2f} "
+                f"{sum(durations) / total:>6.1%}"
+            )
@@ -0,0 +1,90 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from lariv.registry import UIRegistry
+
+from p_totschool_tally.components.tally_components import DashboardContent
+from p_totschool_tally.ui import FROZEN_COMPONENTS
+
+SAMPLE_DASHBOARD = {
+    "total_calls": 120,
+    "total_leads": 45,
+    "total_visits": 80,
+    "total_appointments": 40,
+    "total_demos": 25,
+    "total_letters": 30,
+    "total_follow_ups": 50,
+    "total_proposals": 12,
+    "total_policies": 8,
+    "total_premium": 1250000,
+    "forms_filled": 60,
+    "appt_visit_ratio": 50.0,
+    "demo_appt_ratio": 62.5,
+    "policy_demo_ratio": 32.0,
+}
+
+
+def measure(fn, iterations):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    allocated = sum(s.size_diff for s in stats if s.size_diff > 0)
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+    return elapsed / iterations, allocated / iterations, blocks / iterations
+
+
+class Command(BaseCommand):
+    help = "Compare per-request cost of rebuilding vs reusing tally component trees."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        rows = []
+
+        for name in FROZEN_COMPONENTS:
+            component = UIRegistry.get(name)
+            component().build()
+            # Trees are kept alive like a request holds them until it finishes
+            trees = []
+
+            def build(component=component):
+                trees.append(component().build())
+
+            with override_settings(TALLY_FREEZE_UI=False):
+                rows.append((name, measure(build, iterations), "rebuild"))
+            trees.clear()
+            rows.append((name, measure(build, iterations), "frozen"))
+
+        content = DashboardContent(uid="tally-dashboard-content")
+
+        def render_fresh():
+            DashboardContent(uid="tally-dashboard-content").render_stats(
+                SAMPLE_DASHBOARD
+            )
+
+        def render_frozen():
+            content.render_stats(SAMPLE_DASHBOARD)
+
+        rows.append(("DashboardContent", measure(render_fresh, iterations), "rebuild"))
+        rows.append(("DashboardContent", measure(render_frozen, iterations), "frozen"))
+
+        self.stdout.write(
+            f"{'component':<28} {'mode':<8} {'us/req':>10} {'KiB/req':>10} "
+            f"{'blocks/req':>11}"
+        )
+        for name, (seconds, allocated, blocks), mode in rows:
+            self.stdout.write(
+                f"{name:<28} {mode:<8} {seconds * 1e6:>10.1f} "
+                f"{allocated / 1024:>10.1f} {blocks:>11.0f}"
+            )
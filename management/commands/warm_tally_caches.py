@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from p_totschool_tally.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Create upcoming tally sessions and prefill the session, dashboard and "
+        "leaderboard caches. Schedule it shortly before each quarter starts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--quarters-ahead",
+            type=int,
+            default=1,
+            help="Number of upcoming quarters to create sessions for.",
+        )
+        parser.add_argument(
+            "--sessions-only",
+            action="store_true",
+            help="Only create sessions, do not compute aggregates.",
+        )
+
+    def handle(self, *args, **options):
+        sessions, warmed = warm_up(
+            quarters_ahead=options["quarters_ahead"],
+            aggregates=not options["sessions_only"],
+        )
+        for session in sessions:
+            self.stdout.write(f"{session.name}: {session.start} - {session.end}")
+        if warmed:
+            self.stdout.write(self.style.SUCCESS(f"Warmed caches for {sessions[0]}"))
+        elif not options["sessions_only"]:
+            self.stdout.write(
+                "No shared TALLY_SINGLEFLIGHT cache configured, aggregates not warmed"
+            )
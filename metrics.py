@@ -0,0 +1,257 @@
+import functools
+import operator
+
+from django.db.models import (
+    Case,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    IntegerField,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
+
+
+def format_currency(amount):
+    """Format number in Indian currency style."""
+    if amount == 0:
+        return "₹0"
+    s = str(amount)
+    if len(s) <= 3:
+        return f"₹{s}"
+    result = s[-3:]
+    s = s[:-3]
+    while s:
+        result = s[-2:] + "," + result
+        s = s[:-2]
+    return f"₹{result}"
+
+
+class Metric:
+    """A summable Tally field and how it is labelled and formatted.
+
+    Parameters:
+        field: The Tally model field that is summed
+        label: Display label on dashboards and reports
+        slug: Short name used in component uids, defaults to the field
+        short_slug: Abbreviated slug of the tally detail and form row uids,
+            defaults to the slug
+        input_label: Label on the tally forms, defaults to the label
+        short_label: Label on the tally detail view, defaults to the label
+        leaderboard_title: Title of the metric's leaderboard card, if it has one
+        currency: Format values as currency
+    """
+
+    def __init__(
+        self,
+        field,
+        label,
+        slug=None,
+        short_slug=None,
+        input_label=None,
+        short_label=None,
+        leaderboard_title=None,
+        currency=False,
+    ):
+        self.field = field
+        self.label = label
+        self.slug = slug or field
+        self.short_slug = short_slug or self.slug
+        self.input_label = input_label or label
+        self.short_label = short_label or label
+        self.leaderboard_title = leaderboard_title
+        self.currency = currency
+
+    @property
+    def key(self):
+        return f"total_{self.field}"
+
+    def aggregate(self):
+        return Coalesce(Sum(self.field), Value(0), output_field=IntegerField())
+
+    def format(self, value):
+        return format_currency(value) if self.currency else str(value)
+
+
+class Ratio:
+    """A conversion percentage derived from two metrics."""
+
+    def __init__(self, key, label, description, numerator, denominator):
+        self.key = key
+        self.label = label
+        self.description = description
+        self.numerator = numerator
+        self.denominator = denominator
+
+    @property
+    def slug(self):
+        return self.key.removesuffix("_ratio").replace("_", "-")
+
+    def compute(self, totals):
+        denominator = totals[f"total_{self.denominator}"]
+        if denominator > 0:
+            return round((totals[f"total_{self.numerator}"] / denominator) * 100, 1)
+        return 0
+
+    def expression(self):
+        """The ratio in SQL, over ``total_<field>`` annotations of a grouped query.
+
+        Unrounded so ordering is exact, round for display.
+        """
+        return safe_divide(
+            f"total_{self.numerator}", f"total_{self.denominator}", scale=100
+        )
+
+
+def safe_divide(numerator, denominator, scale=1):
+    """``numerator / denominator * scale`` in SQL, 0 when the denominator is 0."""
+    return Case(
+        When(
+            **{f"{denominator}__gt": 0},
+            then=Cast(F(numerator), FloatField())
+            * scale
+            / Cast(F(denominator), FloatField()),
+        ),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def weighted_sum(weights):
+    """``sum(weight * total_<field>)`` in SQL over a grouped query's totals."""
+    terms = [
+        Cast(F(f"total_{field}"), FloatField()) * Value(float(weight))
+        for field, weight in weights.items()
+        if weight
+    ]
+    if not terms:
+        return Value(0.0, output_field=FloatField())
+    return ExpressionWrapper(
+        functools.reduce(operator.add, terms), output_field=FloatField()
+    )
+
+
+_metrics = {}
+_ratios = {}
+
+
+def register_metric(metric):
+    _metrics[metric.field] = metric
+    return metric
+
+
+def register_ratio(ratio):
+    _ratios[ratio.key] = ratio
+    return ratio
+
+
+def get_metric(name):
+    return _metrics[name]
+
+
+def get_metrics(names=None):
+    if names is None:
+        return list(_metrics.values())
+    return [_metrics[name] for name in names]
+
+
+def get_ratios(names=None):
+    if names is None:
+        return list(_ratios.values())
+    return [_ratios[name] for name in names]
+
+
+def get_leaderboard_metrics():
+    return [metric for metric in _metrics.values() if metric.leaderboard_title]
+
+
+def get_dashboard_metric_names():
+    """Metric fields and ratio keys the dashboard cards show."""
+    return [*_metrics, *_ratios]
+
+
+def get_leaderboard_metric_names():
+    return [metric.field for metric in get_leaderboard_metrics()]
+
+
+def resolve_metrics(names=None):
+    """Split requested metric fields and ratio keys into metrics and ratios.
+
+    Ratios pull in the metrics they are derived from. ``None`` requests
+    everything.
+    """
+    if names is None:
+        return get_metrics(), get_ratios()
+
+    ratios = [_ratios[name] for name in names if name in _ratios]
+    fields = {name for name in names if name not in _ratios}
+    for ratio in ratios:
+        fields.update((ratio.numerator, ratio.denominator))
+    unknown = fields - set(_metrics)
+    if unknown:
+        raise KeyError(f"Unknown tally metrics: {', '.join(sorted(unknown))}")
+    # Keep registration order so rendering is stable
+    return [m for m in _metrics.values() if m.field in fields], ratios
+
+
+def build_aggregates(metrics):
+    return {metric.key: metric.aggregate() for metric in metrics}
+
+
+def compute_ratios(totals, ratios):
+    return {ratio.key: ratio.compute(totals) for ratio in ratios}
+
+
+register_metric(Metric("visits", "Visits", leaderboard_title="Top Visits"))
+register_metric(Metric("appointments", "Appointments", short_slug="appts"))
+register_metric(Metric("leads", "Leads"))
+register_metric(Metric("calls", "Calls"))
+register_metric(
+    Metric("demos", "Demonstrations", leaderboard_title="Top Demonstrations")
+)
+register_metric(
+    Metric(
+        "letters",
+        "Follow Up Letters",
+        input_label="Follow Up Letters Sent",
+        short_label="Letters",
+    )
+)
+register_metric(Metric("follow_ups", "Follow Ups", slug="followups"))
+register_metric(Metric("proposals", "Proposals Given"))
+register_metric(
+    Metric("policies", "Policies Sold", leaderboard_title="Top Policies Sold")
+)
+register_metric(
+    Metric("premium", "Premium", leaderboard_title="Top Premium", currency=True)
+)
+
+register_ratio(
+    Ratio(
+        "appt_visit_ratio",
+        "Appt. conversion",
+        "Appt. / Visit Ratio",
+        "appointments",
+        "visits",
+    )
+)
+register_ratio(
+    Ratio(
+        "demo_appt_ratio",
+        "Demo conversion",
+        "Demo / Appt. Ratio",
+        "demos",
+        "appointments",
+    )
+)
+register_ratio(
+    Ratio(
+        "policy_demo_ratio",
+        "Policy conversion",
+        "Policy / Demo Ratio",
+        "policies",
+        "demos",
+    )
+)
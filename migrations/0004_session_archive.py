@@ -0,0 +1,105 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def metric_fields():
+    return [
+        ("visits", models.IntegerField(default=0)),
+        ("appointments", models.IntegerField(default=0)),
+        ("leads", models.IntegerField(default=0)),
+        ("calls", models.IntegerField(default=0)),
+        ("demos", models.IntegerField(default=0)),
+        ("letters", models.IntegerField(default=0)),
+        ("follow_ups", models.IntegerField(default=0)),
+        ("proposals", models.IntegerField(default=0)),
+        ("policies", models.IntegerField(default=0)),
+        ("premium", models.IntegerField(default=0)),
+    ]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("p_totschool_tally", "0003_auto_generate_sessions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="totschoolsession",
+            name="archived_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="SessionUserSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("forms_filled", models.IntegerField(default=0)),
+                *metric_fields(),
+                (
+                    "session",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="user_summaries",
+                        to="p_totschool_tally.totschoolsession",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tally_session_summaries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("session", "user")},
+            },
+        ),
+        migrations.CreateModel(
+            name="SessionMonthlyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("forms_filled", models.IntegerField(default=0)),
+                *metric_fields(),
+                (
+                    "session",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="monthly_rollups",
+                        to="p_totschool_tally.totschoolsession",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tally_monthly_rollups",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["month"],
+                "unique_together": {("session", "user", "month")},
+            },
+        ),
+    ]
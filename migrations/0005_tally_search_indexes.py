@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+SEARCH_COLUMNS = ("name", "email", "phone")
+
+
+def index_name(column):
+    return f"tally_user_{column}_trgm"
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    try:
+        with transaction.atomic():
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except Exception:
+        # Without the extension the admin search falls back to sequential scans
+        return
+
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    table = schema_editor.quote_name(User._meta.db_table)
+    columns = {f.column for f in User._meta.get_fields() if hasattr(f, "column")}
+    for column in SEARCH_COLUMNS:
+        if column not in columns:
+            continue
+        # Matches the UPPER(...) LIKE expression Django uses for icontains
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {index_name(column)} ON {table} "
+            f"USING gin ((UPPER({schema_editor.quote_name(column)}::text)) "
+            "gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for column in SEARCH_COLUMNS:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {index_name(column)}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("p_totschool_tally", "0004_session_archive"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tally",
+            index=models.Index(fields=["date"], name="tally_date_idx"),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("p_totschool_tally", "0006_tallyingestrequest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="totschoolsession",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("quarter", "Quarter"),
+                    ("contest", "Contest"),
+                    ("campaign", "Campaign"),
+                ],
+                default="quarter",
+                max_length=20,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="totschoolsession",
+            index=models.Index(fields=["start", "end"], name="session_range_idx"),
+        ),
+    ]
@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("p_totschool_tally", "0007_totschoolsession_kind"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("metric", models.CharField(max_length=50)),
+                ("date", models.DateField()),
+                ("size", models.IntegerField(default=0)),
+                ("user_ids", models.BinaryField()),
+                ("values", models.BinaryField()),
+                (
+                    "session",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="snapshots",
+                        to="p_totschool_tally.totschoolsession",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["date"],
+                "unique_together": {("session", "metric", "date")},
+            },
+        ),
+    ]
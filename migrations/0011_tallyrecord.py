@@ -0,0 +1,65 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("p_totschool_tally", "0010_tallychange"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TallyRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("is_org", models.BooleanField(default=False)),
+                ("metric", models.CharField(max_length=50)),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[
+                            ("day", "Day"),
+                            ("week", "Week"),
+                            ("quarter", "Quarter"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("period_start", models.DateField()),
+                ("value", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "holder",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tally_records",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("is_org", False)),
+                        fields=("holder", "metric", "period"),
+                        name="tally_personal_record_unique",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("is_org", True)),
+                        fields=("metric", "period"),
+                        name="tally_org_record_unique",
+                    ),
+                ],
+            },
+        ),
+    ]
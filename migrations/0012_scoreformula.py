@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("p_totschool_tally", "0011_tallyrecord"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScoreFormula",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                (
+                    "weights",
+                    models.JSONField(
+                        default=dict,
+                        help_text=(
+                            'Weight per metric field, e.g. {"policies": 5, '
+                            '"premium": 3}'
+                        ),
+                    ),
+                ),
+                (
+                    "normalize",
+                    models.BooleanField(
+                        default=True,
+                        help_text=(
+                            "Scale each metric against the session's highest total"
+                        ),
+                    ),
+                ),
+                ("is_active", models.BooleanField(default=True)),
+                ("order", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["order", "id"],
+            },
+        ),
+    ]
@@ -0,0 +1,77 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("p_totschool_tally", "0012_scoreformula"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Target",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[
+                            ("visits", "Visits"),
+                            ("appointments", "Appointments"),
+                            ("leads", "Leads"),
+                            ("calls", "Calls"),
+                            ("demos", "Demonstrations"),
+                            ("letters", "Follow Up Letters"),
+                            ("follow_ups", "Follow Ups"),
+                            ("proposals", "Proposals Given"),
+                            ("policies", "Policies Sold"),
+                            ("premium", "Premium"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ("goal", models.PositiveIntegerField()),
+                ("achieved", models.IntegerField(default=0, editable=False)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "session",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="targets",
+                        to="p_totschool_tally.totschoolsession",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tally_targets",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["session", "metric"], name="tally_target_session_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("session", "user", "metric"),
+                        name="tally_target_unique",
+                    )
+                ],
+            },
+        ),
+    ]
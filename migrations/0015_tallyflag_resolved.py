@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("p_totschool_tally", "0014_tallyflag"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="tallyflag",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("open", "Open"),
+                    ("confirmed", "Confirmed error"),
+                    ("dismissed", "Dismissed"),
+                    ("resolved", "Corrected"),
+                ],
+                default="open",
+                max_length=10,
+            ),
+        ),
+    ]
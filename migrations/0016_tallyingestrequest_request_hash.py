@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("p_totschool_tally", "0015_tallyflag_resolved"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tallyingestrequest",
+            name="request_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -1,9 +1,27 @@
-from django.db import models
-from django.db.models import Sum, Count, Value, IntegerField
-from django.db.models.functions import Coalesce
+from django.db import models, router, transaction
+from django.core.exceptions import ValidationError
+from django.db.models import F, Max, Sum, Count, Q, Value, IntegerField, Window
+from django.db.models.functions import Coalesce, Rank
 from django.utils import timezone
 from users.models import User
 from django.urls import reverse
+from .instrumentation import instrument_aggregate
+from .metrics import (
+    build_aggregates,
+    compute_ratios,
+    get_leaderboard_metrics,
+    get_metrics,
+    get_ratios,
+    resolve_metrics,
+    safe_divide,
+    weighted_sum,
+)
+from .singleflight import single_flight
+
+
+METRIC_FIELDS = tuple(metric.field for metric in get_metrics())
+
+FUNNEL_FIELDS = ("visits", "appointments", "demos", "policies", "premium")
 
 
 def get_current_date():
@@ -12,63 +30,97 @@ def get_current_date():
 
 
 class TallyManager(models.Manager):
-    def get_dashboard_stats(self, user_id=None, session=None):
-        queryset = self.all()
+    @instrument_aggregate
+    @single_flight
+    def get_dashboard_stats(
+        self, user_id=None, session=None, metrics=None, exclude_flagged=False
+    ):
+        """Totals and conversion ratios, aggregating only the requested metrics.
+
+        ``metrics`` lists metric fields and ratio keys from the metric
+        registry; ``None`` computes all of them. ``exclude_flagged`` leaves
+        out rows the anomaly detector flagged, as the leaderboards do.
+        """
+        metric_list, ratios = resolve_metrics(metrics)
+
+        if getattr(session, "archived_at", None):
+            # Archived sessions are answered from the frozen per-user summaries
+            queryset = SessionUserSummary.objects.filter(session=session)
+            forms_filled = Coalesce(
+                Sum("forms_filled"), Value(0), output_field=IntegerField()
+            )
+        else:
+            queryset = self.all()
+            if session:
+                queryset = queryset.filter(
+                    date__gte=session.start, date__lte=session.end
+                )
+            forms_filled = Count("id")
+            if exclude_flagged:
+                queryset = exclude_flagged_rows(queryset)
         if user_id:
             queryset = queryset.filter(user=user_id)
-        if session:
-            queryset = queryset.filter(date__gte=session.start, date__lte=session.end)
 
         totals = queryset.aggregate(
-            total_calls=Coalesce(Sum("calls"), Value(0), output_field=IntegerField()),
-            total_leads=Coalesce(Sum("leads"), Value(0), output_field=IntegerField()),
-            total_visits=Coalesce(Sum("visits"), Value(0), output_field=IntegerField()),
-            total_appointments=Coalesce(
-                Sum("appointments"), Value(0), output_field=IntegerField()
-            ),
-            total_demos=Coalesce(Sum("demos"), Value(0), output_field=IntegerField()),
-            total_letters=Coalesce(
-                Sum("letters"), Value(0), output_field=IntegerField()
-            ),
-            total_follow_ups=Coalesce(
-                Sum("follow_ups"), Value(0), output_field=IntegerField()
-            ),
-            total_proposals=Coalesce(
-                Sum("proposals"), Value(0), output_field=IntegerField()
-            ),
-            total_policies=Coalesce(
-                Sum("policies"), Value(0), output_field=IntegerField()
-            ),
-            total_premium=Coalesce(
-                Sum("premium"), Value(0), output_field=IntegerField()
-            ),
-            forms_filled=Count("id"),
+            **build_aggregates(metric_list), forms_filled=forms_filled
         )
-
-        # Calculate conversion rates with new ratios
-        appt_visit_ratio = 0
-        demo_appt_ratio = 0
-        policy_demo_ratio = 0
-
-        if totals["total_visits"] > 0:
-            appt_visit_ratio = round(
-                (totals["total_appointments"] / totals["total_visits"]) * 100, 1
-            )
-        if totals["total_appointments"] > 0:
-            demo_appt_ratio = round(
-                (totals["total_demos"] / totals["total_appointments"]) * 100, 1
-            )
-        if totals["total_demos"] > 0:
-            policy_demo_ratio = round(
-                (totals["total_policies"] / totals["total_demos"]) * 100, 1
-            )
-
-        totals["appt_visit_ratio"] = appt_visit_ratio
-        totals["demo_appt_ratio"] = demo_appt_ratio
-        totals["policy_demo_ratio"] = policy_demo_ratio
+        totals.update(compute_ratios(totals, ratios))
 
         return totals
 
+    @instrument_aggregate
+    def get_sessions_stats(self, sessions, user_id=None, metrics=None):
+        """Dashboard totals for several sessions, keyed by session pk.
+
+        Open sessions share one scan over their combined date range, each
+        summed with a conditional aggregate, so overlapping contests cost one
+        query together rather than one each.
+        """
+        metric_list, ratios = resolve_metrics(metrics)
+        stats = {}
+
+        open_sessions = []
+        for session in sessions:
+            if session.archived_at:
+                stats[session.pk] = self.get_dashboard_stats(
+                    user_id=user_id, session=session, metrics=metrics
+                )
+            else:
+                open_sessions.append(session)
+        if not open_sessions:
+            return stats
+
+        aggregates = {}
+        for session in open_sessions:
+            in_session = Q(date__gte=session.start, date__lte=session.end)
+            for metric in metric_list:
+                aggregates[f"s{session.pk}_{metric.key}"] = Coalesce(
+                    Sum(metric.field, filter=in_session),
+                    Value(0),
+                    output_field=IntegerField(),
+                )
+            aggregates[f"s{session.pk}_forms_filled"] = Count("id", filter=in_session)
+
+        queryset = self.filter(
+            date__gte=min(s.start for s in open_sessions),
+            date__lte=max(s.end for s in open_sessions),
+        )
+        if user_id:
+            queryset = queryset.filter(user=user_id)
+        row = queryset.aggregate(**aggregates)
+
+        for session in open_sessions:
+            prefix = f"s{session.pk}_"
+            totals = {
+                key.removeprefix(prefix): value
+                for key, value in row.items()
+                if key.startswith(prefix)
+            }
+            totals.update(compute_ratios(totals, ratios))
+            stats[session.pk] = totals
+        return stats
+
+    @instrument_aggregate
     def get_whatsapp_report_data(self, user_id=None):
         if not user_id:
             return None
@@ -87,17 +139,23 @@ class TallyManager(models.Manager):
                 self.start = start
                 self.end = end
 
+        # The report lists every metric and no ratios
+        metrics = [metric.field for metric in get_metrics()]
         today_session = DummySession(today, today)
-        today_totals = self.get_dashboard_stats(user_id=user_id, session=today_session)
+        today_totals = self.get_dashboard_stats(
+            user_id=user_id, session=today_session, metrics=metrics
+        )
 
         current_quarter = ensure_session_for_date(today)
         qtd_session = DummySession(current_quarter.start, today)
-        qtd_totals = self.get_dashboard_stats(user_id=user_id, session=qtd_session)
+        qtd_totals = self.get_dashboard_stats(
+            user_id=user_id, session=qtd_session, metrics=metrics
+        )
 
         last_quarter_date = current_quarter.start - datetime.timedelta(days=1)
         last_quarter_session = ensure_session_for_date(last_quarter_date)
         last_quarter_totals = self.get_dashboard_stats(
-            user_id=user_id, session=last_quarter_session
+            user_id=user_id, session=last_quarter_session, metrics=metrics
         )
 
         user = User.objects.get(id=user_id)
@@ -111,75 +169,342 @@ class TallyManager(models.Manager):
             "date": today,
         }
 
-    def get_leaderboards(self, user_id=None, session=None):
-        queryset = self.all()
-        if session:
-            queryset = queryset.filter(date__gte=session.start, date__lte=session.end)
+    @instrument_aggregate
+    @single_flight
+    def get_leaderboard_rankings(self, session=None, metrics=None):
+        """Full per-metric rankings of every user with tallies in the session.
+
+        Only the requested metrics are aggregated; ``None`` ranks every
+        metric that has a leaderboard.
+        """
+        if metrics is None:
+            metric_list = get_leaderboard_metrics()
+        else:
+            metric_list = get_metrics(metrics)
+
+        if getattr(session, "archived_at", None):
+            queryset = SessionUserSummary.objects.filter(session=session)
+        else:
+            queryset = exclude_flagged_rows(self.all())
+            if session:
+                queryset = queryset.filter(
+                    date__gte=session.start, date__lte=session.end
+                )
 
         # Aggregate totals per user
         user_totals = queryset.values("user__id", "user__name").annotate(
-            total_visits=Coalesce(Sum("visits"), Value(0), output_field=IntegerField()),
-            total_demos=Coalesce(Sum("demos"), Value(0), output_field=IntegerField()),
-            total_policies=Coalesce(
-                Sum("policies"), Value(0), output_field=IntegerField()
-            ),
-            total_premium=Coalesce(
-                Sum("premium"), Value(0), output_field=IntegerField()
-            ),
+            **build_aggregates(metric_list)
+        )
+        return rank_user_totals(user_totals, metric_list)
+
+    @instrument_aggregate
+    @single_flight
+    def get_session_user_totals(self, session=None):
+        """Every metric per user for the session in one grouped scan."""
+        if getattr(session, "archived_at", None):
+            queryset = SessionUserSummary.objects.filter(session=session)
+            forms_filled = Sum("forms_filled")
+        else:
+            queryset = self.all()
+            if session:
+                queryset = queryset.filter(
+                    date__gte=session.start, date__lte=session.end
+                )
+            forms_filled = Count("id")
+
+        return list(
+            queryset.values("user__id", "user__name").annotate(
+                **build_aggregates(get_metrics()), forms_filled=forms_filled
+            )
         )
 
-        metrics = [
-            ("visits", "total_visits"),
-            ("demos", "total_demos"),
-            ("policies", "total_policies"),
-            ("premium", "total_premium"),
-        ]
+    @instrument_aggregate
+    @single_flight
+    def get_list_facets(self, session=None, date=None):
+        """Entry counts per agent, per week and for ``date`` in one grouped scan.
+
+        Each week is a conditional count on the per-agent rows, so the week
+        facet is their column sum.
+        """
+        from .utils import get_session_weeks
+
+        weeks = get_session_weeks(session.start, session.end)
+        rows = list(
+            self.filter(date__gte=session.start, date__lte=session.end)
+            .order_by()
+            .values("user__id", "user__name")
+            .annotate(
+                entries=Count("id"),
+                submitted=Count("id", filter=Q(date=date)),
+                **{
+                    f"week_{index}": Count(
+                        "id", filter=Q(date__gte=start, date__lte=end)
+                    )
+                    for index, (start, end) in enumerate(weeks)
+                },
+            )
+        )
+        return {
+            "agents": [
+                {
+                    "user_id": row["user__id"],
+                    "user_name": row["user__name"],
+                    "entries": row["entries"],
+                    "submitted": bool(row["submitted"]),
+                }
+                for row in sorted(rows, key=lambda r: (-r["entries"], r["user__name"]))
+            ],
+            "weeks": [
+                {
+                    "start": start,
+                    "end": end,
+                    "entries": sum(row[f"week_{index}"] for row in rows),
+                    "agents": sum(1 for row in rows if row[f"week_{index}"]),
+                }
+                for index, (start, end) in enumerate(weeks)
+            ],
+        }
 
-        leaderboards = {}
+    def get_funnel(self, session=None, order_by="-policy_demo_ratio", minimums=None):
+        """Per-agent conversion funnel with the ratios computed in SQL.
+
+        Returns a grouped values queryset, one row per agent, so callers can
+        paginate it. ``order_by`` is a funnel total, ratio key,
+        ``premium_per_policy`` or ``user__name``, prefixed with ``-`` for
+        descending. ``minimums`` maps funnel fields to the least total an
+        agent needs to be listed.
+        """
+        metric_list, ratios = resolve_metrics(
+            [*FUNNEL_FIELDS, *(ratio.key for ratio in get_ratios())]
+        )
 
-        for metric_name, field_name in metrics:
-            # Sort all users by the specific metric
-            sorted_totals = sorted(
-                user_totals, key=lambda x: x[field_name], reverse=True
+        if getattr(session, "archived_at", None):
+            queryset = SessionUserSummary.objects.filter(session=session)
+        else:
+            queryset = self.all()
+            if session:
+                queryset = queryset.filter(
+                    date__gte=session.start, date__lte=session.end
+                )
+
+        rows = (
+            queryset.values("user__id", "user__name")
+            .annotate(**build_aggregates(metric_list))
+            .annotate(
+                **{ratio.key: ratio.expression() for ratio in ratios},
+                premium_per_policy=safe_divide("total_premium", "total_policies"),
             )
+        )
 
-            top_5 = []
-            user_entry = None
+        for field, minimum in (minimums or {}).items():
+            if field not in FUNNEL_FIELDS:
+                raise ValueError(f"Unknown funnel field: {field}")
+            if minimum:
+                rows = rows.filter(**{f"total_{field}__gte": minimum})
+
+        sortable = get_funnel_sort_keys()
+        if order_by.lstrip("-") not in sortable:
+            raise ValueError(f"Cannot sort the funnel by {order_by}")
+        # The user id keeps pages stable between equal values
+        return rows.order_by(order_by, "user__id")
+
+    def get_session_overview(
+        self, session=None, dashboard_user_id=None, leaderboard_user_id=None
+    ):
+        """Dashboard totals and leaderboards derived from one shared scan.
+
+        The dashboard covers ``dashboard_user_id`` (every user when unset) and
+        the leaderboards highlight ``leaderboard_user_id``.
+        """
+        user_totals = self.get_session_user_totals(session=session)
+        metric_list, ratios = resolve_metrics()
+
+        rows = user_totals
+        if dashboard_user_id:
+            rows = [
+                r for r in user_totals if str(r["user__id"]) == str(dashboard_user_id)
+            ]
+        dashboard = {
+            metric.key: sum(row[metric.key] for row in rows) for metric in metric_list
+        }
+        dashboard["forms_filled"] = sum(row["forms_filled"] for row in rows)
+        dashboard.update(compute_ratios(dashboard, ratios))
+
+        user_name = None
+        if leaderboard_user_id:
+            user_name = next(
+                (
+                    r["user__name"]
+                    for r in user_totals
+                    if str(r["user__id"]) == str(leaderboard_user_id)
+                ),
+                None,
+            )
+            if user_name is None:
+                user_name = User.objects.filter(id=leaderboard_user_id).values_list(
+                    "name", flat=True
+                ).first()
+
+        if flagged_rows_excluded():
+            # The shared scan still counts flagged rows
+            rankings = self.get_leaderboard_rankings(session=session)
+        else:
+            rankings = rank_user_totals(user_totals, get_leaderboard_metrics())
+        leaderboards = {
+            metric_name: summarize_ranking(ranking, leaderboard_user_id, user_name)
+            for metric_name, ranking in rankings.items()
+        }
+        return {"dashboard": dashboard, "leaderboards": leaderboards}
+
+    @instrument_aggregate
+    @single_flight
+    def get_score_ranking(self, session=None, weights=None, normalize=True):
+        """Every user ranked by a weighted score of their session totals.
+
+        ``weights`` maps metric fields to weights. With ``normalize`` each
+        total is first divided by the session's highest total of that metric,
+        so metrics on different scales count as weighted; the maxima take one
+        extra aggregate query. Scores and ranks are computed in SQL.
+        """
+        weights = {field: weight for field, weight in (weights or {}).items() if weight}
+        metric_list = get_metrics(list(weights))
+
+        if getattr(session, "archived_at", None):
+            queryset = SessionUserSummary.objects.filter(session=session)
+        else:
+            queryset = exclude_flagged_rows(self.all())
+            if session:
+                queryset = queryset.filter(
+                    date__gte=session.start, date__lte=session.end
+                )
+
+        rows = queryset.values("user__id", "user__name").annotate(
+            **build_aggregates(metric_list)
+        )
+        if normalize and metric_list:
+            maxima = rows.aggregate(
+                **{f"max_{metric.field}": Max(metric.key) for metric in metric_list}
+            )
+            weights = {
+                field: weight * 100 / maxima[f"max_{field}"]
+                for field, weight in weights.items()
+                if maxima[f"max_{field}"]
+            }
 
-            for index, row in enumerate(sorted_totals):
-                rank = index + 1
-                entry = {
-                    "rank": rank,
-                    "user_id": row["user__id"],
-                    "user_name": row["user__name"],
-                    "value": row[field_name],
-                }
+        rows = rows.annotate(score=weighted_sum(weights)).annotate(
+            rank=Window(Rank(), order_by=F("score").desc())
+        )
+        return [
+            {
+                "rank": row["rank"],
+                "user_id": row["user__id"],
+                "user_name": row["user__name"],
+                "value": round(row["score"], 1),
+            }
+            for row in rows.order_by("-score", "user__name")
+        ]
 
-                if rank <= 5:
-                    top_5.append(entry)
+    def get_score_leaderboards(self, formulas, user_id=None, session=None):
+        """Summaries of each formula's ranking, keyed by ``formula.key``."""
+        if not formulas:
+            return {}
+        user_name = None
+        if user_id:
+            user_name = User.objects.filter(id=user_id).values_list(
+                "name", flat=True
+            ).first()
+        return {
+            formula.key: summarize_ranking(
+                self.get_score_ranking(
+                    session=session,
+                    weights=formula.weights,
+                    normalize=formula.normalize,
+                ),
+                user_id,
+                user_name,
+            )
+            for formula in formulas
+        }
 
-                if user_id and row["user__id"] == user_id:
-                    user_entry = entry
+    @instrument_aggregate
+    def get_leaderboards(self, user_id=None, session=None, metrics=None):
+        rankings = self.get_leaderboard_rankings(session=session, metrics=metrics)
 
+        user_name = None
+        if user_id:
             # If user has no tallies in session, create a default 0 entry for them
-            if user_id and not user_entry:
-                try:
-                    user = User.objects.get(id=user_id)
-                    user_entry = {
-                        "rank": "-",
-                        "user_id": user.id,
-                        "user_name": user.name,
-                        "value": 0,
-                    }
-                except User.DoesNotExist:
-                    user_entry = None
-
-            leaderboards[metric_name] = {
-                "top_5": top_5,
-                "current_user": user_entry,
+            user_name = User.objects.filter(id=user_id).values_list(
+                "name", flat=True
+            ).first()
+
+        return {
+            metric_name: summarize_ranking(ranking, user_id, user_name)
+            for metric_name, ranking in rankings.items()
+        }
+
+
+def get_funnel_sort_keys():
+    return [
+        "user__name",
+        *(f"total_{field}" for field in FUNNEL_FIELDS),
+        *(ratio.key for ratio in get_ratios()),
+        "premium_per_policy",
+    ]
+
+
+def flagged_rows_excluded():
+    from .anomalies import get_config
+
+    return get_config()["exclude_from_leaderboards"]
+
+
+def exclude_flagged_rows(queryset):
+    """Leave out tallies with open or confirmed anomaly flags, when configured."""
+    if not flagged_rows_excluded():
+        return queryset
+    return queryset.exclude(flags__status__in=TallyFlag.ACTIVE)
+
+
+def get_score_formulas():
+    return list(ScoreFormula.objects.filter(is_active=True))
+
+
+def rank_user_totals(user_totals, metrics):
+    """Sort per-user totals rows into a ranking for each metric."""
+    rankings = {}
+    for metric in metrics:
+        sorted_totals = sorted(user_totals, key=lambda x: x[metric.key], reverse=True)
+        rankings[metric.field] = [
+            {
+                "rank": index + 1,
+                "user_id": row["user__id"],
+                "user_name": row["user__name"],
+                "value": row[metric.key],
             }
+            for index, row in enumerate(sorted_totals)
+        ]
+    return rankings
+
 
-        return leaderboards
+def summarize_ranking(ranking, user_id=None, user_name=None, size=5):
+    """Top entries of a ranking plus the entry of ``user_id``.
+
+    Users without tallies in the ranking get a zero entry when ``user_name``
+    is known.
+    """
+    user_entry = None
+    if user_id:
+        user_entry = next(
+            (e for e in ranking if str(e["user_id"]) == str(user_id)), None
+        )
+        if user_entry is None and user_name is not None:
+            user_entry = {
+                "rank": "-",
+                "user_id": int(user_id),
+                "user_name": user_name,
+                "value": 0,
+            }
+    return {"top_5": ranking[:size], "current_user": user_entry}
 
 
 class Tally(models.Model):
@@ -203,6 +528,7 @@ class Tally(models.Model):
     class Meta:
         unique_together = ["user", "date"]
         ordering = ["-date"]
+        indexes = [models.Index(fields=["date"], name="tally_date_idx")]
 
     def __str__(self):
         return f"{self.user.name} - {self.date}"
@@ -210,18 +536,483 @@ class Tally(models.Model):
     def get_absolute_url(self):
         return reverse("tally:detail", kwargs={"pk": self.pk})
 
+    # post_save and post_delete receivers (change log, targets, records) write
+    # in the same transaction as the row, so neither commits without the other
+    def save(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(Tally, instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(Tally, instance=self)
+        with transaction.atomic(using=using):
+            return super().delete(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The row as loaded, so the change log can diff a later save
+        instance._loaded_state = get_tally_state(instance)
+        return instance
+
+
+def get_tally_state(tally):
+    """User, date and metric values of a tally, None for deferred fields."""
+    loaded = tally.__dict__
+    return {
+        "user_id": loaded.get("user_id"),
+        "date": loaded.get("date"),
+        **{field: loaded.get(field) for field in METRIC_FIELDS},
+    }
+
 
 class TotSchoolSession(models.Model):
+    QUARTER = "quarter"
+    CONTEST = "contest"
+    CAMPAIGN = "campaign"
+    KIND_CHOICES = [
+        (QUARTER, "Quarter"),
+        (CONTEST, "Contest"),
+        (CAMPAIGN, "Campaign"),
+    ]
+
     name = models.CharField(max_length=250, unique=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=QUARTER)
     start = models.DateField()
     end = models.DateField()
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["start", "end"], name="session_range_idx"),
+        ]
 
     @property
     def is_active(self):
         return self.start <= timezone.now().date() <= self.end
 
+    @property
+    def is_closed(self):
+        return self.end < timezone.now().date()
+
     def __str__(self):
         return self.name
 
     def get_absolute_url(self):
         return reverse("totschool_sessions:detail", kwargs={"pk": self.pk})
+
+
+class SessionUserSummary(models.Model):
+    """Frozen per-user totals for an archived session."""
+
+    session = models.ForeignKey(
+        TotSchoolSession, on_delete=models.CASCADE, related_name="user_summaries"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="tally_session_summaries"
+    )
+    forms_filled = models.IntegerField(default=0)
+
+    visits = models.IntegerField(default=0)
+    appointments = models.IntegerField(default=0)
+    leads = models.IntegerField(default=0)
+    calls = models.IntegerField(default=0)
+    demos = models.IntegerField(default=0)
+    letters = models.IntegerField(default=0)
+    follow_ups = models.IntegerField(default=0)
+    proposals = models.IntegerField(default=0)
+    policies = models.IntegerField(default=0)
+    premium = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ["session", "user"]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.session.name}"
+
+
+class SessionMonthlyRollup(models.Model):
+    """Frozen per-user monthly totals for an archived session."""
+
+    session = models.ForeignKey(
+        TotSchoolSession, on_delete=models.CASCADE, related_name="monthly_rollups"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="tally_monthly_rollups"
+    )
+    month = models.DateField()
+    forms_filled = models.IntegerField(default=0)
+
+    visits = models.IntegerField(default=0)
+    appointments = models.IntegerField(default=0)
+    leads = models.IntegerField(default=0)
+    calls = models.IntegerField(default=0)
+    demos = models.IntegerField(default=0)
+    letters = models.IntegerField(default=0)
+    follow_ups = models.IntegerField(default=0)
+    proposals = models.IntegerField(default=0)
+    policies = models.IntegerField(default=0)
+    premium = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ["session", "user", "month"]
+        ordering = ["month"]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.month:%b %Y}"
+
+
+def check_metric_columns(app_configs=None, **kwargs):
+    """System check that the metric columns match the metric registry.
+
+    The columns are declared on the models for migrations, so a metric
+    registered without them, or a column left over from an unregistered
+    metric, would make the archived summaries drop totals.
+    """
+    from django.core import checks
+
+    errors = []
+    for model in (Tally, SessionUserSummary, SessionMonthlyRollup):
+        columns = {
+            field.name
+            for field in model._meta.concrete_fields
+            if isinstance(field, models.IntegerField) and not field.primary_key
+        } - {"forms_filled"}
+        missing = [field for field in METRIC_FIELDS if field not in columns]
+        unknown = sorted(columns - set(METRIC_FIELDS))
+        if missing:
+            errors.append(
+                checks.Error(
+                    f"{model.__name__} has no column for the tally metrics "
+                    f"{', '.join(missing)}.",
+                    hint="Add the columns with a migration.",
+                    obj=model,
+                    id="p_totschool_tally.E001",
+                )
+            )
+        if unknown:
+            errors.append(
+                checks.Error(
+                    f"{model.__name__} has columns {', '.join(unknown)} that are "
+                    "not registered tally metrics.",
+                    hint="Register them with metrics.register_metric().",
+                    obj=model,
+                    id="p_totschool_tally.E002",
+                )
+            )
+    return errors
+
+
+class TallyIngestRequest(models.Model):
+    """Stored response of a bulk ingest request, replayed for its idempotency key."""
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="tally_ingest_requests"
+    )
+    key = models.CharField(max_length=255)
+    # Hash of the request, so a key reused for another batch is refused
+    request_hash = models.CharField(max_length=64, blank=True)
+    status = models.IntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ["user", "key"]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.key}"
+
+
+class LeaderboardSnapshot(models.Model):
+    """Ranking of one metric at the end of a day, packed for compact storage.
+
+    ``user_ids`` and ``values`` are zlib-compressed int64 arrays in rank order,
+    see ``snapshots.pack``.
+    """
+
+    session = models.ForeignKey(
+        TotSchoolSession, on_delete=models.CASCADE, related_name="snapshots"
+    )
+    metric = models.CharField(max_length=50)
+    date = models.DateField()
+    size = models.IntegerField(default=0)
+    user_ids = models.BinaryField()
+    values = models.BinaryField()
+
+    class Meta:
+        unique_together = ["session", "metric", "date"]
+        ordering = ["date"]
+
+    def __str__(self):
+        return f"{self.session.name} - {self.metric} - {self.date}"
+
+
+class OutboundMessage(models.Model):
+    """A queued outbound message and its delivery state."""
+
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENDING, "Sending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    DAILY_REPORT = "daily_report"
+    REMINDER = "reminder"
+    KIND_CHOICES = [
+        (DAILY_REPORT, "Daily Report"),
+        (REMINDER, "Missing Report Reminder"),
+    ]
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="tally_outbound_messages"
+    )
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    recipient = models.CharField(max_length=255)
+    body = models.TextField()
+    # Identifies the message across enqueue runs, e.g. "reminder:12:2025-01-31"
+    dedup_key = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    provider_message_id = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["status", "next_attempt_at"], name="outbound_queue_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.dedup_key}"
+
+
+class TallyChange(models.Model):
+    """Append-only log of tally inserts, updates and deletes.
+
+    The id is the change sequence consumers keep as their watermark. Users
+    are referenced without a constraint so the log outlives deleted users.
+    """
+
+    INSERT = "insert"
+    UPDATE = "update"
+    DELETE = "delete"
+    OP_CHOICES = [(INSERT, "Insert"), (UPDATE, "Update"), (DELETE, "Delete")]
+
+    id = models.BigAutoField(primary_key=True)
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    tally_id = models.IntegerField(null=True, blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+    )
+    date = models.DateField()
+    before = models.JSONField(null=True, blank=True)
+    after = models.JSONField(null=True, blank=True)
+    # after - before per metric, only the metrics that changed
+    delta = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"#{self.id} {self.op} {self.user_id} {self.date}"
+
+
+class TallyChangeCursor(models.Model):
+    """Last change id a downstream consumer has processed."""
+
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class TallyRecord(models.Model):
+    """Best day, week or quarter total of a metric.
+
+    Personal records have one row per holder, metric and period; org-wide
+    records (``is_org``) one row per metric and period, naming the holder.
+    """
+
+    DAY = "day"
+    WEEK = "week"
+    QUARTER = "quarter"
+    PERIOD_CHOICES = [(DAY, "Day"), (WEEK, "Week"), (QUARTER, "Quarter")]
+
+    holder = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="tally_records"
+    )
+    is_org = models.BooleanField(default=False)
+    metric = models.CharField(max_length=50)
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    value = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["holder", "metric", "period"],
+                condition=models.Q(is_org=False),
+                name="tally_personal_record_unique",
+            ),
+            models.UniqueConstraint(
+                fields=["metric", "period"],
+                condition=models.Q(is_org=True),
+                name="tally_org_record_unique",
+            ),
+        ]
+
+    def __str__(self):
+        scope = "Org" if self.is_org else "Personal"
+        return f"{scope} best {self.period} {self.metric}: {self.value}"
+
+
+class ScoreFormula(models.Model):
+    """Weights of a composite score leaderboard, configured by admins.
+
+    The score of an agent is the weighted sum of their session totals. When
+    normalised, each total is scaled to 100 for the session's top agent in
+    that metric before weighting.
+    """
+
+    name = models.CharField(max_length=100)
+    weights = models.JSONField(
+        default=dict,
+        help_text='Weight per metric field, e.g. {"policies": 5, "premium": 3}',
+    )
+    normalize = models.BooleanField(
+        default=True,
+        help_text="Scale each metric against the session's highest total",
+    )
+    is_active = models.BooleanField(default=True)
+    order = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["order", "id"]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def key(self):
+        return f"score_{self.pk}"
+
+    def clean(self):
+        if not isinstance(self.weights, dict) or not self.weights:
+            raise ValidationError({"weights": "Give at least one metric weight."})
+        unknown = set(self.weights) - set(METRIC_FIELDS)
+        if unknown:
+            raise ValidationError(
+                {"weights": f"Unknown metrics: {', '.join(sorted(unknown))}"}
+            )
+        for field, weight in self.weights.items():
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+                raise ValidationError(
+                    {"weights": f"Weight of {field} is not a number."}
+                )
+
+
+class Target(models.Model):
+    """An agent's goal for one metric over a session.
+
+    ``achieved`` is the agent's session total of the metric. Tally writes
+    keep it up to date, so attainment is read from the target rows without
+    aggregating tallies.
+    """
+
+    session = models.ForeignKey(
+        TotSchoolSession, on_delete=models.CASCADE, related_name="targets"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="tally_targets"
+    )
+    metric = models.CharField(
+        max_length=50, choices=[(m.field, m.label) for m in get_metrics()]
+    )
+    goal = models.PositiveIntegerField()
+    achieved = models.IntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["session", "user", "metric"], name="tally_target_unique"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["session", "metric"], name="tally_target_session_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.session.name} {self.metric}: {self.goal}"
+
+
+class TallyFlag(models.Model):
+    """A tally row the anomaly detector found suspicious, awaiting review."""
+
+    ZSCORE = "zscore"
+    FUNNEL = "funnel"
+    JUMP = "jump"
+    REASON_CHOICES = [
+        (ZSCORE, "Outlier for the agent"),
+        (FUNNEL, "Funnel inconsistency"),
+        (JUMP, "Sudden jump"),
+    ]
+
+    OPEN = "open"
+    CONFIRMED = "confirmed"
+    DISMISSED = "dismissed"
+    RESOLVED = "resolved"
+    STATUS_CHOICES = [
+        (OPEN, "Open"),
+        (CONFIRMED, "Confirmed error"),
+        (DISMISSED, "Dismissed"),
+        (RESOLVED, "Corrected"),
+    ]
+    # Flags that still hold: their rows are left out of leaderboards when
+    # configured, and editing the row or rerunning the detector resolves them
+    ACTIVE = [OPEN, CONFIRMED]
+
+    tally = models.ForeignKey(Tally, on_delete=models.CASCADE, related_name="flags")
+    reason = models.CharField(max_length=10, choices=REASON_CHOICES)
+    metric = models.CharField(max_length=50)
+    value = models.IntegerField()
+    score = models.FloatField(default=0)
+    detail = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=OPEN)
+    created_at = models.DateTimeField(auto_now_add=True)
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+    reviewed_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tally", "reason", "metric"], name="tally_flag_unique"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["status", "tally"], name="tally_flag_status_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.get_reason_display()} in {self.metric} of {self.tally}"
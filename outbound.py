@@ -0,0 +1,274 @@
+"""Queue and worker for outbound daily reports and reminders.
+
+Messages are rows of ``OutboundMessage``. Enqueueing builds every agent's
+message from a few grouped scans and inserts them in bulk, skipping dedup
+keys that already exist. Workers claim due messages with ``SKIP LOCKED``,
+hand them to the configured provider in batches and record the outcome,
+retrying failures with exponential backoff.
+"""
+
+import datetime
+import json
+import logging
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboundMessage
+from .reports import build_daily_reports, format_daily_report, format_reminder
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Dotted path of the provider class
+    "provider": "p_totschool_tally.outbound.FileProvider",
+    # Messages handed to the provider per call
+    "batch_size": 50,
+    # Messages per second across a worker, 0 for no limit
+    "rate": 10,
+    "max_attempts": 5,
+    # Seconds before the first retry, doubled on every further attempt
+    "retry_delay": 60,
+    # Seconds after which a message stuck in "sending" is claimed again
+    "claim_timeout": 600,
+    # FileProvider output and HttpProvider endpoint
+    "file": "tally_outbound.jsonl",
+    "url": "http://127.0.0.1:8025/send",
+    "timeout": 10,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "TALLY_OUTBOUND", {})}
+
+
+class SendResult:
+    def __init__(self, ok, provider_message_id="", error=""):
+        self.ok = ok
+        self.provider_message_id = provider_message_id
+        self.error = error
+
+
+class Provider:
+    """Delivers a batch of messages, returning one SendResult per message."""
+
+    def __init__(self, config):
+        self.config = config
+
+    def send_batch(self, messages):
+        raise NotImplementedError
+
+
+class FileProvider(Provider):
+    """Local stub that appends each message to a JSON lines file."""
+
+    def send_batch(self, messages):
+        with open(self.config["file"], "a") as f:
+            for message in messages:
+                f.write(
+                    json.dumps(
+                        {
+                            "id": message.pk,
+                            "to": message.recipient,
+                            "kind": message.kind,
+                            "body": message.body,
+                            "at": timezone.now().isoformat(),
+                        }
+                    )
+                    + "\n"
+                )
+        return [SendResult(True, f"file-{message.pk}") for message in messages]
+
+
+class HttpProvider(Provider):
+    """Posts a batch as JSON to ``url``, e.g. the tally_outbound_stub server.
+
+    The endpoint answers ``{"results": [{"id", "ok", "provider_id", "error"}]}``.
+    """
+
+    def send_batch(self, messages):
+        payload = json.dumps(
+            {
+                "messages": [
+                    {"id": m.pk, "to": m.recipient, "kind": m.kind, "body": m.body}
+                    for m in messages
+                ]
+            }
+        ).encode()
+        request = urllib.request.Request(
+            self.config["url"],
+            data=payload,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(
+                request, timeout=self.config["timeout"]
+            ) as response:
+                results = json.load(response)["results"]
+        except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+            return [SendResult(False, error=str(e)) for _ in messages]
+
+        by_id = {result.get("id"): result for result in results}
+        sent = []
+        for message in messages:
+            result = by_id.get(message.pk)
+            if result is None:
+                sent.append(SendResult(False, error="Missing from provider response"))
+            else:
+                sent.append(
+                    SendResult(
+                        bool(result.get("ok")),
+                        result.get("provider_id") or "",
+                        result.get("error") or "",
+                    )
+                )
+        return sent
+
+
+def get_provider(config=None):
+    config = config or get_config()
+    return import_string(config["provider"])(config)
+
+
+def get_recipients(user_ids):
+    from users.models import User
+
+    return dict(
+        User.objects.filter(id__in=user_ids)
+        .exclude(phone__isnull=True)
+        .exclude(phone="")
+        .values_list("id", "phone")
+    )
+
+
+def enqueue_daily_messages(date=None, kinds=(OutboundMessage.DAILY_REPORT,)):
+    """Queue today's reports and/or reminders for every agent.
+
+    Returns the number of messages created; ones already queued for the day
+    are skipped by their dedup key.
+    """
+    date = date or timezone.now().date()
+    reports = build_daily_reports(date)
+    recipients = get_recipients(list(reports))
+
+    messages = []
+    for user_id, report in reports.items():
+        recipient = recipients.get(user_id)
+        if not recipient:
+            continue
+        if report["submitted"] and OutboundMessage.DAILY_REPORT in kinds:
+            kind, body = OutboundMessage.DAILY_REPORT, format_daily_report(report)
+        elif not report["submitted"] and OutboundMessage.REMINDER in kinds:
+            kind, body = OutboundMessage.REMINDER, format_reminder(
+                report["user_name"], date
+            )
+        else:
+            continue
+        messages.append(
+            OutboundMessage(
+                user_id=user_id,
+                kind=kind,
+                recipient=recipient,
+                body=body,
+                dedup_key=f"{kind}:{user_id}:{date.isoformat()}",
+            )
+        )
+
+    before = OutboundMessage.objects.filter(
+        dedup_key__in=[m.dedup_key for m in messages]
+    ).count()
+    OutboundMessage.objects.bulk_create(
+        messages, batch_size=1000, ignore_conflicts=True
+    )
+    return len(messages) - before
+
+
+def claim_batch(size, config):
+    """Mark up to ``size`` due messages as sending and return them."""
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=config["claim_timeout"])
+    with transaction.atomic():
+        messages = list(
+            OutboundMessage.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundMessage.PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:size]
+        )
+        if len(messages) < size:
+            # Messages left behind by a worker that died mid-send
+            messages += list(
+                OutboundMessage.objects.select_for_update(skip_locked=True)
+                .filter(status=OutboundMessage.SENDING, claimed_at__lt=stale)
+                .order_by("claimed_at", "id")[: size - len(messages)]
+            )
+        if messages:
+            OutboundMessage.objects.filter(pk__in=[m.pk for m in messages]).update(
+                status=OutboundMessage.SENDING,
+                claimed_at=now,
+                attempts=F("attempts") + 1,
+            )
+            for message in messages:
+                message.attempts += 1
+    return messages
+
+
+def record_results(messages, results, config):
+    now = timezone.now()
+    updated = []
+    for message, result in zip(messages, results):
+        if result.ok:
+            message.status = OutboundMessage.SENT
+            message.sent_at = now
+            message.provider_message_id = result.provider_message_id
+            message.last_error = ""
+        elif message.attempts >= config["max_attempts"]:
+            message.status = OutboundMessage.FAILED
+            message.last_error = result.error
+        else:
+            delay = config["retry_delay"] * 2 ** (message.attempts - 1)
+            message.status = OutboundMessage.PENDING
+            message.next_attempt_at = now + datetime.timedelta(seconds=delay)
+            message.last_error = result.error
+        updated.append(message)
+    OutboundMessage.objects.bulk_update(
+        updated,
+        ["status", "sent_at", "provider_message_id", "last_error", "next_attempt_at"],
+    )
+
+
+def process_batch(provider, config):
+    """Send one batch, returning how many messages it contained."""
+    messages = claim_batch(config["batch_size"], config)
+    if not messages:
+        return 0
+    try:
+        results = provider.send_batch(messages)
+    except Exception as e:
+        logger.exception("Outbound provider failed")
+        results = [SendResult(False, error=str(e)) for _ in messages]
+    record_results(messages, results, config)
+    return len(messages)
+
+
+def run_worker(once=False, idle_sleep=5, config=None):
+    """Send due messages until the queue is empty (``once``) or forever."""
+    config = config or get_config()
+    provider = get_provider(config)
+    total = 0
+    while True:
+        start = time.monotonic()
+        sent = process_batch(provider, config)
+        total += sent
+        if not sent:
+            if once:
+                return total
+            time.sleep(idle_sleep)
+            continue
+        if config["rate"]:
+            # Keep the average send rate under the provider's limit
+            time.sleep(max(0.0, sent / config["rate"] - (time.monotonic() - start)))
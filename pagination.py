@@ -0,0 +1,38 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """Row estimate from the PostgreSQL planner, or None on other databases."""
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that trusts the planner estimate for large result sets.
+
+    Counts below TALLY_EXACT_COUNT_LIMIT are still computed exactly, so small
+    filtered pages show the right number of pages.
+    """
+
+    @cached_property
+    def count(self):
+        limit = getattr(settings, "TALLY_EXACT_COUNT_LIMIT", 10000)
+        if hasattr(self.object_list, "query"):
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return super().count
@@ -0,0 +1,180 @@
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+PROFILE_ID_RE = re.compile(r"^[\w.-]+$")
+
+
+def get_profile_dir():
+    profile_dir = getattr(settings, "TALLY_PROFILE_DIR", None)
+    if profile_dir:
+        return str(profile_dir)
+    return os.path.join(str(settings.BASE_DIR), "tally_profiles")
+
+
+def can_view_profiles(user):
+    return user.is_authenticated and (
+        user.is_superuser or user.role in ["totschool_admin"]
+    )
+
+
+def should_profile(request):
+    """Profile when an admin asks for it or the request is sampled."""
+    if can_view_profiles(request.user) and (
+        request.headers.get("X-Tally-Profile") or request.GET.get("_profile")
+    ):
+        return True
+    sample_rate = getattr(settings, "TALLY_PROFILE_SAMPLE_RATE", 0)
+    return bool(sample_rate) and random.random() < sample_rate
+
+
+class ProfileCapture:
+    """Captures a cProfile profile and the SQL executed during a request."""
+
+    def __init__(self, request, view_name):
+        self.request = request
+        self.view_name = view_name
+        self.queries = []
+        self.profiler = cProfile.Profile()
+        self.enabled = False
+        self.start = None
+
+    def record_sql(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {
+                    "sql": sql,
+                    "params": repr(params),
+                    "duration": time.perf_counter() - start,
+                }
+            )
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        try:
+            self.profiler.enable()
+            self.enabled = True
+        except ValueError:
+            # Another profiler is already active in this thread
+            self.enabled = False
+        self.wrapper = connection.execute_wrapper(self.record_sql)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wrapper.__exit__(exc_type, exc, tb)
+        duration = time.perf_counter() - self.start
+        if self.enabled:
+            self.profiler.disable()
+            self.save(duration)
+        return False
+
+    def save(self, duration):
+        profile_dir = get_profile_dir()
+        os.makedirs(profile_dir, exist_ok=True)
+
+        now = timezone.now()
+        profile_id = (
+            f"{now:%Y%m%d-%H%M%S}-{self.view_name.replace('.', '-')}"
+            f"-{uuid.uuid4().hex[:8]}"
+        )
+        self.profiler.dump_stats(os.path.join(profile_dir, f"{profile_id}.prof"))
+
+        stats_text = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stats_text)
+        stats.sort_stats("cumulative").print_stats(40)
+
+        user = self.request.user
+        meta = {
+            "id": profile_id,
+            "created": now.isoformat(),
+            "view": self.view_name,
+            "path": self.request.get_full_path(),
+            "method": self.request.method,
+            "user": str(user.pk) if user.is_authenticated else None,
+            "duration": duration,
+            "query_count": len(self.queries),
+            "query_time": sum(q["duration"] for q in self.queries),
+            "queries": self.queries,
+            "stats": stats_text.getvalue(),
+        }
+        with open(os.path.join(profile_dir, f"{profile_id}.json"), "w") as f:
+            json.dump(meta, f)
+        prune_profiles(profile_dir)
+
+
+def prune_profiles(profile_dir):
+    """Delete the oldest profiles past the retention limits.
+
+    At most TALLY_PROFILE_MAX_COUNT profiles are kept, none older than
+    TALLY_PROFILE_MAX_AGE_DAYS.
+    """
+    max_count = getattr(settings, "TALLY_PROFILE_MAX_COUNT", 500)
+    max_age = getattr(settings, "TALLY_PROFILE_MAX_AGE_DAYS", 7) * 86400
+    # Ids start with their timestamp, so names sort oldest first
+    ids = sorted({name.rsplit(".", 1)[0] for name in os.listdir(profile_dir)})
+    expired = set(ids[: max(len(ids) - max_count, 0)])
+    cutoff = time.time() - max_age
+    for profile_id in ids:
+        path = os.path.join(profile_dir, f"{profile_id}.json")
+        try:
+            if os.path.getmtime(path) < cutoff:
+                expired.add(profile_id)
+            else:
+                break
+        except OSError:
+            continue
+    for profile_id in expired:
+        for kind in ("prof", "json"):
+            try:
+                os.remove(os.path.join(profile_dir, f"{profile_id}.{kind}"))
+            except OSError:
+                pass
+
+
+def maybe_profile(request, view_name):
+    if should_profile(request):
+        return ProfileCapture(request, view_name)
+    return contextlib.nullcontext()
+
+
+def list_profiles(limit=200):
+    profile_dir = get_profile_dir()
+    if not os.path.isdir(profile_dir):
+        return []
+
+    names = sorted(
+        (n for n in os.listdir(profile_dir) if n.endswith(".json")), reverse=True
+    )
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(profile_dir, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta.pop("queries", None)
+        meta.pop("stats", None)
+        profiles.append(meta)
+    return profiles
+
+
+def get_profile_path(profile_id, kind="prof"):
+    if kind not in ("prof", "json") or not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(get_profile_dir(), f"{profile_id}.{kind}")
+    return path if os.path.exists(path) else None
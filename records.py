@@ -0,0 +1,325 @@
+"""Personal and org-wide bests, maintained as tallies change.
+
+A tally write only touches the day, week and quarter containing it, so the
+totals of those windows are compared with the stored records. The full
+history of an agent is scanned only when the window holding a record went
+down; org-wide records are then recomputed from the personal records.
+Recomputation sees the rows still in the tally table, and the quarter totals
+of archived sessions from their summaries. Day and week totals of pruned
+rows are not kept, so those bests can only be recomputed from live rows.
+"""
+
+import datetime
+import itertools
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncQuarter, TruncWeek
+
+from .metrics import get_metrics
+from .models import SessionUserSummary, Tally, TallyRecord, TotSchoolSession
+from .utils import get_quarter_details_for_date
+
+PERIODS = (TallyRecord.DAY, TallyRecord.WEEK, TallyRecord.QUARTER)
+
+
+def get_window(period, date):
+    """``(start, end)`` of the day, week (from Monday) or quarter of ``date``."""
+    if period == TallyRecord.DAY:
+        return date, date
+    if period == TallyRecord.WEEK:
+        start = date - datetime.timedelta(days=date.weekday())
+        return start, start + datetime.timedelta(days=6)
+    _, start, end = get_quarter_details_for_date(date)
+    return start, end
+
+
+def get_window_totals(user_id, windows):
+    """Metric totals of the user for each ``(period, start, end)`` in one query."""
+    metrics = get_metrics()
+    aggregates = {}
+    for index, (period, start, end) in enumerate(windows):
+        in_window = Q(date__gte=start, date__lte=end)
+        for metric in metrics:
+            aggregates[f"w{index}_{metric.field}"] = Coalesce(
+                Sum(metric.field, filter=in_window),
+                Value(0),
+                output_field=IntegerField(),
+            )
+    row = Tally.objects.filter(
+        user=user_id,
+        date__gte=min(start for _, start, _ in windows),
+        date__lte=max(end for _, _, end in windows),
+    ).aggregate(**aggregates)
+    return [
+        {metric.field: row[f"w{index}_{metric.field}"] for metric in metrics}
+        for index in range(len(windows))
+    ]
+
+
+def get_archived_quarter_totals(user_id):
+    """Quarter totals of the user from the summaries of archived quarters."""
+    return (
+        SessionUserSummary.objects.filter(
+            user=user_id,
+            session__kind=TotSchoolSession.QUARTER,
+            session__archived_at__isnull=False,
+        )
+        .order_by()
+        .values(*[m.field for m in get_metrics()], period_start=F("session__start"))
+    )
+
+
+def get_history_best(user_id, period):
+    """``{metric: (value, period_start)}`` over the user's whole history.
+
+    Quarter bests include archived quarters, whose rows may have been pruned.
+    """
+    metrics = get_metrics()
+    queryset = Tally.objects.filter(user=user_id).order_by()
+    if period == TallyRecord.DAY:
+        rows = queryset.values("date", *[m.field for m in metrics])
+        start_key = "date"
+    else:
+        trunc = TruncWeek if period == TallyRecord.WEEK else TruncQuarter
+        rows = (
+            queryset.annotate(period_start=trunc("date"))
+            .values("period_start")
+            .annotate(**{m.field: Sum(m.field) for m in metrics})
+        )
+        start_key = "period_start"
+        if period == TallyRecord.QUARTER:
+            rows = itertools.chain(rows, get_archived_quarter_totals(user_id))
+
+    best = {}
+    for row in rows:
+        start = row[start_key]
+        if isinstance(start, datetime.datetime):
+            start = start.date()
+        for metric in metrics:
+            value = row[metric.field] or 0
+            current = best.get(metric.field)
+            # Ties keep the earliest window
+            if value > 0 and (
+                current is None
+                or value > current[0]
+                or (value == current[0] and start < current[1])
+            ):
+                best[metric.field] = (value, start)
+    return best
+
+
+def save_record(record):
+    """Save ``record``, or update the row another transaction created first.
+
+    Records are only locked once they exist, so two writers can both try to
+    insert the same one; the higher value wins.
+    """
+    if record.pk:
+        record.save()
+        return
+    try:
+        with transaction.atomic():
+            record.save()
+    except IntegrityError:
+        lookup = {"is_org": record.is_org, "metric": record.metric}
+        if not record.is_org:
+            lookup["holder"] = record.holder_id
+        existing = TallyRecord.objects.select_for_update().get(
+            period=record.period, **lookup
+        )
+        if record.value > existing.value:
+            existing.holder_id = record.holder_id
+            existing.value = record.value
+            existing.period_start = record.period_start
+            existing.save()
+
+
+def records_enabled():
+    return getattr(settings, "TALLY_RECORDS", True)
+
+
+def update_records(user_id, dates):
+    """Bring the user's and the org's records up to date after ``dates`` changed."""
+    windows = sorted(
+        {(period, *get_window(period, date)) for period in PERIODS for date in dates}
+    )
+    totals = get_window_totals(user_id, windows)
+
+    with transaction.atomic():
+        records = {
+            (r.metric, r.period): r
+            for r in TallyRecord.objects.select_for_update().filter(
+                holder=user_id, is_org=False
+            )
+        }
+
+        changed = {}
+        recompute = set()
+        for (period, start, _), window_totals in zip(windows, totals):
+            for field, value in window_totals.items():
+                record = records.get((field, period))
+                if record is None:
+                    if value > 0:
+                        records[(field, period)] = changed[(field, period)] = (
+                            TallyRecord(
+                                holder_id=user_id,
+                                metric=field,
+                                period=period,
+                                period_start=start,
+                                value=value,
+                            )
+                        )
+                elif value > record.value:
+                    record.value = value
+                    record.period_start = start
+                    changed[(field, period)] = record
+                elif record.period_start == start and value < record.value:
+                    recompute.add((field, period))
+
+        lowered = set()
+        for period in sorted({period for _, period in recompute}):
+            best = get_history_best(user_id, period)
+            for field in sorted(f for f, p in recompute if p == period):
+                record = records[(field, period)]
+                value, start = best.get(field, (0, record.period_start))
+                if (value, start) != (record.value, record.period_start):
+                    if value < record.value:
+                        lowered.add((field, period))
+                    record.value = value
+                    record.period_start = start
+                    changed[(field, period)] = record
+
+        for record in changed.values():
+            if record.value > 0:
+                save_record(record)
+            elif record.pk:
+                record.delete()
+
+        update_org_records(changed, lowered)
+
+
+def update_org_records(changed, lowered):
+    """Raise org records beaten by ``changed`` personal records.
+
+    Org records whose holder's record was ``lowered`` are recomputed from
+    the personal records.
+    """
+    if not changed:
+        return
+    keys = set(changed)
+    org = {
+        (r.metric, r.period): r
+        for r in TallyRecord.objects.select_for_update().filter(
+            is_org=True,
+            metric__in={metric for metric, _ in keys},
+            period__in={period for _, period in keys},
+        )
+    }
+    for key, personal in changed.items():
+        record = org.get(key)
+        if record is None:
+            if personal.value > 0:
+                save_record(
+                    TallyRecord(
+                        holder_id=personal.holder_id,
+                        is_org=True,
+                        metric=personal.metric,
+                        period=personal.period,
+                        period_start=personal.period_start,
+                        value=personal.value,
+                    )
+                )
+        elif personal.value > record.value:
+            record.holder_id = personal.holder_id
+            record.value = personal.value
+            record.period_start = personal.period_start
+            record.save()
+        elif key in lowered and record.holder_id == personal.holder_id:
+            best = (
+                TallyRecord.objects.filter(
+                    is_org=False, metric=record.metric, period=record.period
+                )
+                .order_by("-value", "period_start")
+                .first()
+            )
+            if best is None:
+                record.delete()
+            else:
+                record.holder_id = best.holder_id
+                record.value = best.value
+                record.period_start = best.period_start
+                record.save()
+
+
+def get_user_records(user_id):
+    """``{metric: {period: record}}`` of one agent in a single indexed lookup."""
+    records = {}
+    for record in TallyRecord.objects.filter(holder=user_id, is_org=False):
+        records.setdefault(record.metric, {})[record.period] = record
+    return records
+
+
+def get_org_records():
+    """Org-wide ``{metric: {period: record}}`` with their holders."""
+    records = {}
+    for record in TallyRecord.objects.filter(is_org=True).select_related("holder"):
+        records.setdefault(record.metric, {})[record.period] = record
+    return records
+
+
+def serialize_records(records):
+    return {
+        metric: {
+            period: {
+                "value": record.value,
+                "period_start": record.period_start.isoformat(),
+                "holder": record.holder.name if record.is_org else None,
+            }
+            for period, record in by_period.items()
+        }
+        for metric, by_period in records.items()
+    }
+
+
+def rebuild_records():
+    """Recompute every record from the tally table and the archived quarters."""
+    with transaction.atomic():
+        TallyRecord.objects.all().delete()
+        archived = SessionUserSummary.objects.order_by().values_list(
+            "user_id", flat=True
+        )
+        user_ids = (
+            Tally.objects.order_by().values_list("user_id", flat=True).union(archived)
+        )
+        personal = []
+        for user_id in user_ids:
+            for period in PERIODS:
+                for field, (value, start) in get_history_best(user_id, period).items():
+                    personal.append(
+                        TallyRecord(
+                            holder_id=user_id,
+                            metric=field,
+                            period=period,
+                            period_start=start,
+                            value=value,
+                        )
+                    )
+        TallyRecord.objects.bulk_create(personal, batch_size=1000)
+
+        best = {}
+        for record in sorted(personal, key=lambda r: (-r.value, r.period_start)):
+            best.setdefault((record.metric, record.period), record)
+        TallyRecord.objects.bulk_create(
+            TallyRecord(
+                holder_id=record.holder_id,
+                is_org=True,
+                metric=record.metric,
+                period=record.period,
+                period_start=record.period_start,
+                value=record.value,
+            )
+            for record in best.values()
+        )
+    return len(personal)
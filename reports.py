@@ -0,0 +1,71 @@
+import datetime
+from types import SimpleNamespace
+
+from django.utils import timezone
+
+from .metrics import get_metrics
+from .models import Tally
+from .utils import ensure_session_for_date
+
+
+def format_daily_report(report_data):
+    """Plain text of an agent's daily report, as shared on WhatsApp."""
+    today = report_data["today"]
+    qtd = report_data["qtd"]
+    lq = report_data["last_quarter"]
+
+    message = "TOT School Report\n"
+    message += f"Date: {report_data['date'].strftime('%d %b, %Y')}\n"
+    message += f"Name: {report_data['user_name']}\n\n"
+
+    for metric in get_metrics():
+        today_val = metric.format(today.get(metric.key, 0))
+        qtd_val = metric.format(qtd.get(metric.key, 0))
+        lq_val = metric.format(lq.get(metric.key, 0))
+        message += f"- {metric.label}: {today_val}/{qtd_val}/{lq_val}\n"
+    return message
+
+
+def format_reminder(user_name, date):
+    return (
+        f"Hi {user_name}, your TOT School daily report for "
+        f"{date.strftime('%d %b, %Y')} has not been submitted yet."
+    )
+
+
+def build_daily_reports(date=None):
+    """Report data of ``get_whatsapp_report_data`` for every agent at once.
+
+    Three grouped scans (the day, quarter to date and last quarter) replace
+    three aggregates per agent. Returns ``{user_id: report_data}`` for every
+    agent with tallies this or last quarter; agents who have not submitted
+    for ``date`` get ``{"submitted": False, ...}``.
+    """
+    date = date or timezone.now().date()
+    current_quarter = ensure_session_for_date(date)
+    last_quarter = ensure_session_for_date(
+        current_quarter.start - datetime.timedelta(days=1)
+    )
+
+    def by_user(session):
+        return {
+            row["user__id"]: row
+            for row in Tally.objects.get_session_user_totals(session=session)
+        }
+
+    today = by_user(SimpleNamespace(pk=None, start=date, end=date))
+    qtd = by_user(SimpleNamespace(pk=None, start=current_quarter.start, end=date))
+    lq = by_user(last_quarter)
+
+    reports = {}
+    for user_id in {*qtd, *lq}:
+        row = qtd.get(user_id) or lq[user_id]
+        reports[user_id] = {
+            "submitted": user_id in today,
+            "today": today.get(user_id, {}),
+            "qtd": qtd.get(user_id, {}),
+            "last_quarter": lq.get(user_id, {}),
+            "user_name": row["user__name"],
+            "date": date,
+        }
+    return reports
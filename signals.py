@@ -1,10 +1,323 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from .models import Tally
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from users.models import User
+from .models import Tally, TallyFlag, Target, TotSchoolSession
+from .intervals import clear_session_index
 from .utils import ensure_session_for_date
 
+# Sent after tallies are written in bulk, where post_save does not fire.
+# Arguments: instances (written Tally objects) and previous (metric values
+# before the write, keyed by (user_id, date), for rows that already existed).
+tallies_bulk_saved = Signal()
+
+
+@receiver(pre_save, sender=Tally)
+def prevent_archived_session_edits(sender, instance, **kwargs):
+    from .archive import check_not_archived
+
+    check_not_archived(instance)
+
+
+@receiver(pre_save, sender=Tally)
+def capture_tally_before(sender, instance, **kwargs):
+    from .changelog import capture_before, change_log_enabled
+    from .targets import targets_enabled
+
+    if change_log_enabled() or targets_enabled():
+        capture_before(instance)
+
+
+@receiver(post_save, sender=Tally)
+def log_tally_save(sender, instance, created, **kwargs):
+    from .changelog import change_log_enabled, record_save
+
+    if change_log_enabled():
+        record_save(instance, created)
+
+
+@receiver(post_delete, sender=Tally)
+def log_tally_delete(sender, instance, **kwargs):
+    from .archive import get_archived_session_for_date
+    from .changelog import change_log_enabled, record_delete
+
+    # Pruning an archived session removes rows, not results
+    if change_log_enabled() and not get_archived_session_for_date(instance.date):
+        record_delete(instance)
+
+
+@receiver(tallies_bulk_saved, sender=Tally)
+def log_tally_bulk_save(sender, instances, previous, **kwargs):
+    from .changelog import change_log_enabled, record_bulk
+
+    if change_log_enabled():
+        record_bulk(instances, previous)
+
+
+@receiver(pre_save, sender=Tally)
+def remember_previous_state(sender, instance, **kwargs):
+    # Runs after capture_tally_before, which loads the stored row when needed
+    state = getattr(instance, "_loaded_state", None)
+    instance._previous_state = None
+    if state and state["user_id"] and state["date"] and not instance._state.adding:
+        instance._previous_state = dict(state)
+
+
+@receiver(post_save, sender=Tally)
+def update_tally_records(sender, instance, **kwargs):
+    from .records import records_enabled, update_records
+
+    if not records_enabled():
+        return
+    previous = getattr(instance, "_previous_state", None)
+    dates = {instance.date}
+    if previous and previous["user_id"] != instance.user_id:
+        update_records(previous["user_id"], {previous["date"]})
+    elif previous:
+        dates.add(previous["date"])
+    update_records(instance.user_id, dates)
+
+
+@receiver(post_delete, sender=Tally)
+def update_tally_records_on_delete(sender, instance, **kwargs):
+    from .archive import get_archived_session_for_date
+    from .records import records_enabled, update_records
+
+    # Pruning an archived session removes rows, not results
+    if records_enabled() and not get_archived_session_for_date(instance.date):
+        update_records(instance.user_id, {instance.date})
+
+
+@receiver(tallies_bulk_saved, sender=Tally)
+def update_tally_records_bulk(sender, instances, **kwargs):
+    from .records import records_enabled, update_records
+
+    if not records_enabled():
+        return
+    dates_by_user = {}
+    for instance in instances:
+        dates_by_user.setdefault(instance.user_id, set()).add(instance.date)
+    for user_id, dates in dates_by_user.items():
+        update_records(user_id, dates)
+
+
+@receiver(post_save, sender=Tally)
+def update_tally_targets(sender, instance, **kwargs):
+    from .models import get_tally_state
+    from .targets import apply_change, targets_enabled
+
+    after = get_tally_state(instance)
+    if targets_enabled():
+        apply_change(getattr(instance, "_previous_state", None), after)
+    # The next save of this instance diffs against what was just written
+    instance._loaded_state = after
+
+
+@receiver(post_delete, sender=Tally)
+def update_tally_targets_on_delete(sender, instance, **kwargs):
+    from .models import get_tally_state
+    from .targets import apply_change, targets_enabled
+
+    if targets_enabled():
+        before = getattr(instance, "_loaded_state", None) or get_tally_state(instance)
+        apply_change(before, None)
+
+
+@receiver(tallies_bulk_saved, sender=Tally)
+def update_tally_targets_bulk(sender, instances, previous, **kwargs):
+    from .changelog import diff
+    from .models import get_tally_state
+    from .targets import apply_deltas, targets_enabled
+
+    if not targets_enabled():
+        return
+    apply_deltas(
+        [
+            (
+                instance.user_id,
+                instance.date,
+                diff(
+                    previous.get((instance.user_id, instance.date)),
+                    get_tally_state(instance),
+                ),
+            )
+            for instance in instances
+        ]
+    )
+
+
+@receiver(pre_save, sender=Target)
+def set_target_achieved(sender, instance, update_fields=None, **kwargs):
+    from .targets import compute_achieved
+
+    # Saving a target through a form recounts it, which also repairs drift
+    if update_fields is None:
+        instance.achieved = compute_achieved(
+            instance.session, instance.user_id, instance.metric
+        )
+
+
+@receiver(post_save, sender=Tally)
+def update_agent_roster(sender, instance, created, **kwargs):
+    from .agents import note_agent_activity
+
+    if created:
+        note_agent_activity(instance.user_id, instance.date)
+
+
+@receiver(tallies_bulk_saved, sender=Tally)
+def update_agent_roster_bulk(sender, instances, previous, **kwargs):
+    from .agents import note_agent_activity
+
+    created = {
+        (instance.user_id, instance.date)
+        for instance in instances
+        if (instance.user_id, instance.date) not in previous
+    }
+    for user_id, date in created:
+        note_agent_activity(user_id, date)
+
+
+def get_roster_fields():
+    """User fields the rosters show or are selected by."""
+    names = {field.name for field in User._meta.concrete_fields}
+    return [name for name in ("name", "role", "is_active") if name in names]
+
+
+@receiver(pre_save, sender=User)
+def remember_roster_fields(sender, instance, update_fields=None, **kwargs):
+    instance._previous_roster_fields = None
+    fields = get_roster_fields()
+    # Saves such as the last_login update on each login skip the lookup
+    if update_fields is not None and not set(fields) & set(update_fields):
+        return
+    if instance.pk and not instance._state.adding:
+        instance._previous_roster_fields = (
+            User.objects.filter(pk=instance.pk).values_list(*fields).first()
+        )
+
+
+@receiver(post_save, sender=User)
+def clear_agent_rosters(sender, instance, created, **kwargs):
+    from .agents import clear_rosters, get_agent_roles
+
+    if created:
+        changed = instance.role in get_agent_roles()
+    else:
+        previous = getattr(instance, "_previous_roster_fields", None)
+        current = tuple(getattr(instance, field) for field in get_roster_fields())
+        changed = previous is not None and previous != current
+    if changed:
+        clear_rosters()
+
+
+@receiver(post_delete, sender=User)
+def clear_agent_rosters_on_delete(sender, instance, **kwargs):
+    from .agents import clear_rosters
+
+    clear_rosters()
+
 
 @receiver(post_save, sender=Tally)
 def auto_generate_session(sender, instance, **kwargs):
     if instance.date:
         ensure_session_for_date(instance.date)
+
+
+@receiver(post_save, sender=TotSchoolSession)
+@receiver(post_delete, sender=TotSchoolSession)
+def invalidate_session_index(sender, instance, **kwargs):
+    clear_session_index()
+
+
+@receiver(pre_save, sender=TotSchoolSession)
+def remember_session_range(sender, instance, update_fields=None, **kwargs):
+    instance._previous_range = None
+    if update_fields is not None and not {"start", "end"} & set(update_fields):
+        return
+    if instance.pk and not instance._state.adding:
+        instance._previous_range = (
+            TotSchoolSession.objects.filter(pk=instance.pk)
+            .values_list("start", "end")
+            .first()
+        )
+
+
+@receiver(post_save, sender=TotSchoolSession)
+def recount_session_targets(sender, instance, created, **kwargs):
+    from django.db import transaction
+
+    from .targets import rebuild_targets, targets_enabled
+
+    # Targets follow tally writes only, so new dates need a full recount
+    previous = getattr(instance, "_previous_range", None)
+    if targets_enabled() and previous and previous != (instance.start, instance.end):
+        transaction.on_commit(lambda: rebuild_targets([instance]))
+
+
+@receiver(post_save, sender=Tally)
+@receiver(post_delete, sender=Tally)
+def invalidate_aggregate_cache(sender, instance, **kwargs):
+    from .singleflight import schedule_invalidation
+
+    schedule_invalidation()
+
+
+@receiver(tallies_bulk_saved, sender=Tally)
+def invalidate_aggregate_cache_bulk(sender, instances, **kwargs):
+    from .singleflight import schedule_invalidation
+
+    schedule_invalidation()
+
+
+@receiver(post_save, sender=Tally)
+def resolve_tally_flags(sender, instance, **kwargs):
+    from .anomalies import resolve_changed
+    from .models import get_tally_state
+
+    previous = getattr(instance, "_previous_state", None)
+    if previous:
+        resolve_changed([(instance.pk, previous, get_tally_state(instance))])
+
+
+@receiver(tallies_bulk_saved, sender=Tally)
+def resolve_tally_flags_bulk(sender, instances, previous, **kwargs):
+    from .anomalies import resolve_changed
+    from .models import get_tally_state
+
+    resolve_changed(
+        [
+            (
+                instance.pk,
+                previous.get((instance.user_id, instance.date)),
+                get_tally_state(instance),
+            )
+            for instance in instances
+        ]
+    )
+
+
+@receiver(post_save, sender=TallyFlag)
+@receiver(post_delete, sender=TallyFlag)
+def invalidate_aggregate_cache_on_review(sender, instance, **kwargs):
+    from .models import flagged_rows_excluded
+    from .singleflight import schedule_invalidation
+
+    # Reviews only change the totals when leaderboards leave flagged rows out
+    if flagged_rows_excluded():
+        schedule_invalidation()
+
+
+# Runs after invalidation so the pushed totals are computed fresh
+@receiver(post_save, sender=Tally)
+@receiver(post_delete, sender=Tally)
+def publish_live_update(sender, instance, **kwargs):
+    from .live import schedule_tally_change
+
+    schedule_tally_change(instance)
+
+
+@receiver(tallies_bulk_saved, sender=Tally)
+def publish_live_update_bulk(sender, instances, **kwargs):
+    from .live import schedule_tally_changes
+
+    schedule_tally_changes(instances)
@@ -0,0 +1,198 @@
+import functools
+import hashlib
+import inspect
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .instrumentation import record_cache
+
+GENERATION_KEY = "tally:sf:generation"
+
+DEFAULTS = {
+    "enabled": True,
+    # Name of a Django cache shared by all processes, or None for per-process only
+    "cache": None,
+    # Seconds a cached result is served as fresh
+    "fresh": 5,
+    # Further seconds a stale result is served while one caller revalidates
+    "stale": 30,
+    # Seconds to wait on another caller's computation before computing anyway
+    "timeout": 10,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "TALLY_SINGLEFLIGHT", {})}
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and shares it with waiting callers."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """Return ``(result, shared)``; ``shared`` is set when another caller ran it."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.event.wait(timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            # The in-flight computation is taking too long, do our own
+            return fn(), False
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+_flight = SingleFlight()
+
+
+def _session_key(session):
+    if session is None:
+        return None
+    return (
+        getattr(session, "pk", None),
+        str(session.start),
+        str(session.end),
+        bool(getattr(session, "archived_at", None)),
+    )
+
+
+def make_key(name, arguments):
+    parts = [name]
+    for arg_name, value in sorted(arguments.items()):
+        if arg_name == "session":
+            value = _session_key(value)
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            value = sorted(str(v) for v in value)
+        elif value is not None:
+            value = str(value)
+        parts.append((arg_name, value))
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def get_shared_cache():
+    """The cache shared by all processes, or None when caching is per-process."""
+    config = get_config()
+    if not config["enabled"] or not config["cache"]:
+        return None
+    return caches[config["cache"]]
+
+
+def get_generation(cache):
+    return cache.get(GENERATION_KEY) or 0
+
+
+def bump_generation():
+    """Invalidate every cached aggregate, called after tallies change."""
+    cache = get_shared_cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+
+
+def schedule_invalidation():
+    transaction.on_commit(bump_generation)
+
+
+def _cached_call(key, fn, config):
+    cache = caches[config["cache"]]
+    value_key = f"tally:sf:{get_generation(cache)}:{key}"
+    lock_key = f"{value_key}:lock"
+    now = time.time()
+
+    entry = cache.get(value_key)
+    if entry is not None:
+        value, fresh_until = entry
+        if fresh_until > now:
+            return value, True
+        if not cache.add(lock_key, 1, timeout=config["timeout"]):
+            # Someone else is revalidating, serve the stale value meanwhile
+            return value, True
+    elif not cache.add(lock_key, 1, timeout=config["timeout"]):
+        # Another process is computing, wait for its result
+        deadline = now + config["timeout"]
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(value_key)
+            if entry is not None:
+                return entry[0], True
+        return fn(), False
+
+    try:
+        value = fn()
+        cache.set(
+            value_key,
+            (value, time.time() + config["fresh"]),
+            timeout=config["fresh"] + config["stale"],
+        )
+        return value, False
+    finally:
+        cache.delete(lock_key)
+
+
+def single_flight(func):
+    """Coalesce identical concurrent calls of a TallyManager aggregate method."""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        config = get_config()
+        if not config["enabled"]:
+            return func(self, *args, **kwargs)
+
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments.pop("self")
+        key = make_key(f"{self.model._meta.label}.{func.__name__}", arguments)
+
+        def compute():
+            return func(self, *args, **kwargs)
+
+        if config["cache"]:
+            result, shared = _flight.do(
+                key,
+                lambda: _cached_call(key, compute, config),
+                timeout=config["timeout"],
+            )
+            # A result shared in-process is as good as a cache hit
+            shared = shared or result[1]
+            result = result[0]
+        else:
+            result, shared = _flight.do(key, compute, timeout=config["timeout"])
+
+        record_cache(func.__name__, shared)
+        return result
+
+    return wrapper
@@ -0,0 +1,136 @@
+import datetime
+import sys
+import zlib
+from array import array
+
+from django.db import transaction
+
+from .metrics import get_leaderboard_metrics, get_metrics
+from .models import LeaderboardSnapshot, Tally, rank_user_totals
+
+
+def pack(values):
+    """Compress a list of integers into little-endian int64s."""
+    packed = array("q", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return zlib.compress(packed.tobytes())
+
+
+def unpack(data):
+    values = array("q")
+    values.frombytes(zlib.decompress(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def build_snapshots(session, dates, metrics=None):
+    """Build snapshot rows for ``dates`` from one scan of the session.
+
+    Each snapshot holds the cumulative ranking from the session start to its
+    date. Rows are summed per user and day in SQL and accumulated here, so a
+    backfill over a full quarter still reads the tallies once.
+    """
+    metric_list = get_metrics(metrics) if metrics else get_leaderboard_metrics()
+    dates = sorted(d for d in dates if session.start <= d <= session.end)
+    if not dates:
+        return []
+
+    daily = (
+        Tally.objects.filter(date__gte=session.start, date__lte=dates[-1])
+        .order_by("date")
+        .values_list("date", "user_id", "user__name", *[m.field for m in metric_list])
+    )
+
+    totals = {}
+    snapshots = []
+    pending = iter(dates)
+    next_date = next(pending)
+
+    def snapshot(date):
+        rankings = rank_user_totals(list(totals.values()), metric_list)
+        for metric in metric_list:
+            ranking = rankings[metric.field]
+            snapshots.append(
+                LeaderboardSnapshot(
+                    session=session,
+                    metric=metric.field,
+                    date=date,
+                    size=len(ranking),
+                    user_ids=pack([e["user_id"] for e in ranking]),
+                    values=pack([e["value"] for e in ranking]),
+                )
+            )
+
+    for date, user_id, user_name, *values in daily.iterator(chunk_size=5000):
+        while next_date is not None and date > next_date:
+            snapshot(next_date)
+            next_date = next(pending, None)
+        if next_date is None:
+            break
+        row = totals.get(user_id)
+        if row is None:
+            row = totals[user_id] = {
+                "user__id": user_id,
+                "user__name": user_name,
+                **{m.key: 0 for m in metric_list},
+            }
+        for metric, value in zip(metric_list, values):
+            row[metric.key] += value
+
+    while next_date is not None:
+        snapshot(next_date)
+        next_date = next(pending, None)
+    return snapshots
+
+
+def take_snapshots(session, dates, metrics=None):
+    """Build and store snapshots, replacing any already taken for the dates."""
+    snapshots = build_snapshots(session, dates, metrics)
+    with transaction.atomic():
+        LeaderboardSnapshot.objects.filter(
+            session=session,
+            date__in={s.date for s in snapshots},
+            metric__in={s.metric for s in snapshots},
+        ).delete()
+        LeaderboardSnapshot.objects.bulk_create(snapshots, batch_size=500)
+    return snapshots
+
+
+def session_dates(session, until):
+    day = session.start
+    while day <= min(until, session.end):
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def get_rank_history(session, user_id, metrics=None):
+    """Rank and cumulative value of a user per metric and snapshot day.
+
+    Returns ``{metric: [{"date", "rank", "value", "size"}, ...]}`` with
+    ``rank`` None on days before the user's first tally in the session.
+    """
+    metric_list = get_metrics(metrics) if metrics else get_leaderboard_metrics()
+    history = {metric.field: [] for metric in metric_list}
+    user_id = int(user_id)
+
+    snapshots = (
+        LeaderboardSnapshot.objects.filter(session=session, metric__in=list(history))
+        .order_by("date")
+        .values_list("metric", "date", "size", "user_ids", "values")
+    )
+    for metric, date, size, user_ids, values in snapshots:
+        rank = value = None
+        ids = unpack(user_ids)
+        try:
+            index = ids.index(user_id)
+        except ValueError:
+            pass
+        else:
+            rank = index + 1
+            value = unpack(values)[index]
+        history[metric].append(
+            {"date": date, "rank": rank, "value": value, "size": size}
+        )
+    return history
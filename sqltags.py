@@ -0,0 +1,116 @@
+"""sqlcommenter-style tags on the SQL issued by tally code paths.
+
+Views and manager aggregates push tags such as the view, the manager method,
+the session and the kind of caller. Every query run while they are active
+gets them appended as a comment, e.g.
+``/*app='tally',caller='agent',method='get_dashboard_stats',session='12'*/``,
+so slow-query logs can be attributed to features and callers.
+"""
+
+import contextlib
+import contextvars
+import json
+import re
+import threading
+import time
+from urllib.parse import quote, unquote
+
+from django.conf import settings
+from django.db import connection
+
+_tags = contextvars.ContextVar("tally_sql_tags", default=None)
+_capture_lock = threading.Lock()
+
+COMMENT_RE = re.compile(r"/\*((?:\w+='[^']*',?)+)\*/\s*;?\s*$")
+
+
+def comments_enabled():
+    return getattr(settings, "TALLY_SQL_COMMENTS", True)
+
+
+def format_comment(tags):
+    """Serialize tags the sqlcommenter way: sorted, url-encoded, single-quoted."""
+    parts = []
+    for key, value in sorted(tags.items()):
+        if value is None:
+            continue
+        value = quote(str(value), safe="")
+        parts.append(f"{key}='{value}'")
+    return "/*" + ",".join(parts) + "*/"
+
+
+def parse_comment(sql):
+    """Tags of a sqlcommenter comment at the end of ``sql``, or an empty dict."""
+    match = COMMENT_RE.search(sql)
+    if not match:
+        return {}
+    tags = {}
+    for part in match.group(1).split(","):
+        if "=" not in part:
+            continue
+        key, value = part.split("=", 1)
+        tags[key] = unquote(value.strip("'"))
+    return tags
+
+
+def strip_comment(sql):
+    return COMMENT_RE.sub("", sql).strip()
+
+
+def capture(tags, sql, duration):
+    path = getattr(settings, "TALLY_SQL_CAPTURE_FILE", None)
+    if not path:
+        return
+    line = json.dumps(
+        {"tags": tags, "duration": duration, "sql": " ".join(sql.split())[:500]}
+    )
+    with _capture_lock, open(path, "a") as f:
+        f.write(line + "\n")
+
+
+def _comment_wrapper(execute, sql, params, many, context):
+    tags = _tags.get()
+    tagged_sql = sql
+    if tags and comments_enabled():
+        comment = format_comment(tags)
+        if params is not None:
+            # Url-encoded values contain % which the driver would read as
+            # placeholders
+            comment = comment.replace("%", "%%")
+        tagged_sql = f"{sql} {comment}"
+    start = time.perf_counter()
+    try:
+        return execute(tagged_sql, params, many, context)
+    finally:
+        if tags:
+            capture(tags, sql, time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def sql_tags(**tags):
+    """Tag every query run inside the block, merged with any enclosing tags.
+
+    The outermost block installs the execute wrapper on the connection.
+    """
+    current = _tags.get()
+    token = _tags.set({**(current or {}), "app": "tally", **tags})
+    try:
+        if current is None:
+            with connection.execute_wrapper(_comment_wrapper):
+                yield
+        else:
+            yield
+    finally:
+        _tags.reset(token)
+
+
+def get_caller(user):
+    if not user.is_authenticated:
+        return "anonymous"
+    if user.is_superuser or user.role in ["totschool_admin"]:
+        return "admin"
+    return "agent"
+
+
+def get_session_tag(session):
+    return getattr(session, "pk", None)
@@ -0,0 +1,171 @@
+"""Agent targets and their attainment, maintained as tallies change.
+
+Every target stores the achieved total of its metric. A tally write adds
+its delta to the matching targets of the open sessions containing its date
+in one UPDATE, so the attainment of a whole roster is a single read of the
+target rows. ``QuerySet.update()`` on tallies bypasses this, as it does the
+change log; ``rebuild_tally_targets`` recomputes everything.
+"""
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .changelog import diff
+from .metrics import build_aggregates, get_metric, get_metrics, safe_divide
+from .models import METRIC_FIELDS, SessionUserSummary, Tally, Target, TotSchoolSession
+
+
+def targets_enabled():
+    return getattr(settings, "TALLY_TARGETS", True)
+
+
+def apply_deltas(changes):
+    """Add each ``(user_id, date, {metric: change})`` to the matching targets.
+
+    Changes of a user whose dates fall in the same open sessions are summed
+    first, so a bulk write costs about one UPDATE per user. The sessions are
+    read in the writing transaction rather than from the per-process index,
+    which can be stale for a while after a session changes.
+    """
+    from .intervals import IntervalTree
+
+    if not changes:
+        return 0
+    dates = [date for _, date, _ in changes]
+    tree = IntervalTree(
+        (start, end, pk)
+        for pk, start, end in TotSchoolSession.objects.filter(
+            archived_at__isnull=True, start__lte=max(dates), end__gte=min(dates)
+        ).values_list("pk", "start", "end")
+    )
+
+    combined = {}
+    for user_id, date, delta in changes:
+        sessions = tuple(sorted(tree.at(date)))
+        if not sessions:
+            continue
+        total = combined.setdefault((user_id, sessions), {})
+        for field, change in delta.items():
+            total[field] = total.get(field, 0) + change
+
+    updated = 0
+    for (user_id, sessions), delta in combined.items():
+        delta = {field: change for field, change in delta.items() if change}
+        if not delta:
+            continue
+        updated += Target.objects.filter(
+            session__in=sessions, user=user_id, metric__in=list(delta)
+        ).update(
+            achieved=F("achieved")
+            + Case(
+                *[
+                    When(metric=field, then=Value(change))
+                    for field, change in delta.items()
+                ],
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+    return updated
+
+
+def apply_change(before, after):
+    """Apply a tally going from state ``before`` to ``after``, either may be None."""
+    changes = []
+    if before:
+        changes.append((before["user_id"], before["date"], diff(before, None)))
+    if after:
+        changes.append((after["user_id"], after["date"], diff(None, after)))
+    apply_deltas(changes)
+
+
+def compute_achieved(session, user_id, metric):
+    if getattr(session, "archived_at", None):
+        queryset = SessionUserSummary.objects.filter(session=session, user=user_id)
+    else:
+        queryset = Tally.objects.filter(
+            user=user_id, date__gte=session.start, date__lte=session.end
+        )
+    return queryset.aggregate(
+        total=Coalesce(Sum(metric), Value(0), output_field=IntegerField())
+    )["total"]
+
+
+def rebuild_targets(sessions):
+    """Recompute ``achieved`` of every target in ``sessions`` from the tallies."""
+    updated = 0
+    for session in sessions:
+        targets = list(Target.objects.filter(session=session))
+        if not targets:
+            continue
+        if getattr(session, "archived_at", None):
+            queryset = SessionUserSummary.objects.filter(session=session)
+        else:
+            queryset = Tally.objects.filter(
+                date__gte=session.start, date__lte=session.end
+            )
+        metrics = get_metrics(sorted({target.metric for target in targets}))
+        # Read the tally table directly, cached aggregates may be stale
+        totals = {
+            row["user_id"]: row
+            for row in queryset.order_by()
+            .values("user_id")
+            .annotate(**build_aggregates(metrics))
+        }
+        for target in targets:
+            row = totals.get(target.user_id, {})
+            target.achieved = row.get(f"total_{target.metric}", 0)
+        Target.objects.bulk_update(targets, ["achieved"], batch_size=1000)
+        updated += len(targets)
+    return updated
+
+
+def get_session_progress(session, today=None):
+    """``(elapsed, total)`` days of the session, for run-rate projections."""
+    today = today or timezone.now().date()
+    total = (session.end - session.start).days + 1
+    elapsed = min(max((today - session.start).days + 1, 0), total)
+    return elapsed, total
+
+
+def with_attainment(queryset):
+    """Annotate targets with ``attainment``, their achieved percentage of goal."""
+    return queryset.annotate(attainment=safe_divide("achieved", "goal", scale=100))
+
+
+def project(achieved, elapsed, total):
+    """Total by the end of the session at the run rate so far."""
+    if not elapsed:
+        return 0
+    return round(achieved * total / elapsed)
+
+
+def get_user_targets(session, user_id, today=None):
+    """The user's targets in ``session`` with attainment and projections."""
+    elapsed, total = get_session_progress(session, today)
+    order = {field: index for index, field in enumerate(METRIC_FIELDS)}
+    targets = sorted(
+        with_attainment(Target.objects.filter(session=session, user=user_id)),
+        key=lambda target: order.get(target.metric, len(order)),
+    )
+    rows = []
+    for target in targets:
+        metric = get_metric(target.metric)
+        projected = project(target.achieved, elapsed, total)
+        rows.append(
+            {
+                "metric": target.metric,
+                "label": metric.label,
+                "goal": metric.format(target.goal),
+                "achieved": metric.format(target.achieved),
+                "projected": metric.format(projected),
+                "attainment": round(target.attainment, 1),
+                "projected_attainment": round(projected * 100 / target.goal, 1)
+                if target.goal
+                else 0,
+            }
+        )
+    return rows
@@ -0,0 +1,537 @@
+import datetime
+import io
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from users.models import User
+
+from . import live, singleflight
+from .anomalies import detect, detect_session, get_config, numpy_available
+from .archive import archive_session
+from .changelog import export_changes
+from .intervals import IntervalTree, SessionIndex
+from .ingest import (
+    IngestError,
+    ingest_tallies,
+    request_fingerprint,
+    run_idempotent,
+)
+from .live import InProcessBroker, LiveStream, session_channel, set_broker
+from .metrics import get_leaderboard_metrics
+from .models import (
+    METRIC_FIELDS,
+    Tally,
+    TallyChange,
+    TallyFlag,
+    TallyIngestRequest,
+    TotSchoolSession,
+)
+from .signals import tallies_bulk_saved
+
+
+def create_agent(name="Ana", email="ana@example.invalid"):
+    return User.objects.create(
+        email=email, name=name, phone="9000000000", role="agent"
+    )
+
+
+class LiveStreamTests(SimpleTestCase):
+    """Publish -> LiveStream.apply -> patch, through the in-process broker."""
+
+    def setUp(self):
+        self.broker = InProcessBroker()
+        set_broker(self.broker)
+        self.addCleanup(set_broker, None)
+        self.session = TotSchoolSession(
+            pk=1,
+            name="Q1 2025",
+            start=datetime.date(2025, 1, 1),
+            end=datetime.date(2025, 3, 31),
+        )
+
+    def open_stream(self, user_id=2, user_name="Bea"):
+        stream = LiveStream(self.session, "leaderboard", user_id, user_name)
+        stream.subscribe()
+        self.addCleanup(stream.close)
+        stream.rankings = {metric.field: [] for metric in get_leaderboard_metrics()}
+        stream.initial_patches = stream.render_patches()
+        return stream
+
+    def change_message(self, user_id, name, value):
+        totals = {metric.key: value for metric in get_leaderboard_metrics()}
+        return {
+            "session": self.session.pk,
+            "user": {
+                "id": user_id,
+                "name": name,
+                "totals": {**totals, "forms_filled": 1},
+            },
+            "totals": {},
+        }
+
+    def test_published_change_patches_leaderboard_cards(self):
+        stream = self.open_stream()
+        self.assertTrue(stream.initial_patches)
+        self.assertNotIn("Zed", "".join(p["html"] for p in stream.initial_patches))
+
+        self.broker.publish(
+            session_channel(self.session.pk), self.change_message(3, "Zed", 5)
+        )
+        patches = stream.apply(stream.subscription.get(timeout=1))
+
+        self.assertEqual(
+            {patch["id"] for patch in patches},
+            {f"ldb-{metric.slug}" for metric in get_leaderboard_metrics()},
+        )
+        self.assertTrue(all("Zed" in patch["html"] for patch in patches))
+
+    def test_unchanged_cards_are_not_patched_again(self):
+        stream = self.open_stream()
+        message = self.change_message(3, "Zed", 5)
+        stream.apply(message)
+        self.assertEqual(stream.apply(message), [])
+
+    def test_change_is_fanned_out_once_per_viewer(self):
+        first, second = self.open_stream(), self.open_stream(4, "Dev")
+        delivered = self.broker.publish(
+            session_channel(self.session.pk), self.change_message(3, "Zed", 5)
+        )
+        self.assertEqual(delivered, 2)
+        for stream in (first, second):
+            self.assertEqual(stream.subscription.get(timeout=1)["user"]["id"], 3)
+
+    def test_close_unsubscribes(self):
+        stream = self.open_stream()
+        stream.close()
+        delivered = self.broker.publish(
+            session_channel(self.session.pk), self.change_message(3, "Zed", 5)
+        )
+        self.assertEqual(delivered, 0)
+
+    @override_settings(TALLY_LIVE_MAX_STREAMS=1)
+    def test_stream_slots_are_capped_and_freed_on_close(self):
+        live._stream_slots = None
+        self.addCleanup(setattr, live, "_stream_slots", None)
+
+        self.assertTrue(live.acquire_stream_slot())
+        self.assertFalse(live.acquire_stream_slot())
+        stream = self.open_stream()
+        stream.holds_slot = True
+        stream.close()
+        self.assertTrue(live.acquire_stream_slot())
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        self.user = create_agent()
+        self.today = timezone.now().date()
+        self.calls = 0
+
+    def handler(self):
+        self.calls += 1
+        return 200, {"run": self.calls}
+
+    def run_keyed(self, payload, key="batch-1"):
+        return run_idempotent(
+            self.user.pk, key, self.handler, request_fingerprint(payload)
+        )
+
+    def test_same_key_and_payload_replays_the_stored_response(self):
+        payload = {"items": [{"date": "2025-01-02", "calls": 1}]}
+        self.assertEqual(self.run_keyed(payload), (200, {"run": 1}, False))
+        # Key order does not change the fingerprint
+        replay = {"items": [{"calls": 1, "date": "2025-01-02"}]}
+        self.assertEqual(self.run_keyed(replay), (200, {"run": 1}, True))
+        self.assertEqual(self.calls, 1)
+
+    def test_key_reused_for_another_payload_is_refused(self):
+        self.run_keyed({"items": [{"date": "2025-01-02", "calls": 1}]})
+        with self.assertRaises(IngestError) as raised:
+            self.run_keyed({"items": [{"date": "2025-01-02", "calls": 2}]})
+        self.assertEqual(raised.exception.status, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_key_without_a_stored_response_is_in_progress(self):
+        payload = {"items": []}
+        TallyIngestRequest.objects.create(
+            user=self.user, key="batch-1", request_hash=request_fingerprint(payload)
+        )
+        with self.assertRaises(IngestError) as raised:
+            self.run_keyed(payload)
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(self.calls, 0)
+
+    @override_settings(TALLY_INGEST_KEY_HOURS=24)
+    def test_expired_key_starts_a_new_request(self):
+        payload = {"items": []}
+        self.run_keyed(payload)
+        TallyIngestRequest.objects.update(
+            created_at=timezone.now() - datetime.timedelta(hours=25)
+        )
+        self.assertEqual(self.run_keyed(payload), (200, {"run": 2}, False))
+        self.assertEqual(TallyIngestRequest.objects.count(), 1)
+
+    def test_archived_dates_are_rejected_per_item(self):
+        archived = self.today - datetime.timedelta(days=2)
+        TotSchoolSession.objects.create(
+            name="Archived contest",
+            kind=TotSchoolSession.CONTEST,
+            start=archived,
+            end=archived,
+            archived_at=timezone.now(),
+        )
+        results = ingest_tallies(
+            self.user.pk,
+            [
+                {"date": archived.isoformat(), "calls": 1},
+                {"date": self.today.isoformat(), "calls": 2},
+            ],
+        )
+        self.assertEqual(results[0]["status"], "error")
+        self.assertIn("date", results[0]["errors"])
+        self.assertEqual(results[1]["status"], "created")
+        self.assertEqual(
+            list(Tally.objects.filter(user=self.user).values_list("date", "calls")),
+            [(self.today, 2)],
+        )
+
+    def test_unchanged_rows_are_not_written(self):
+        items = [{"date": self.today.isoformat(), "calls": 3}]
+        ingest_tallies(self.user.pk, items)
+
+        written = []
+
+        def receiver(sender, instances, **kwargs):
+            written.extend(instances)
+
+        tallies_bulk_saved.connect(receiver, sender=Tally)
+        self.addCleanup(tallies_bulk_saved.disconnect, receiver, sender=Tally)
+
+        results = ingest_tallies(self.user.pk, items)
+        self.assertEqual(results[0]["status"], "unchanged")
+        self.assertEqual(written, [])
+
+
+@override_settings(TALLY_CHANGE_LOG=True)
+class ChangeLogTests(TestCase):
+    def setUp(self):
+        self.user = create_agent()
+        self.date = datetime.date(2024, 1, 10)
+
+    def test_create_update_and_delete_are_logged(self):
+        tally = Tally.objects.create(user=self.user, date=self.date, calls=2)
+        tally.calls = 5
+        tally.save()
+        tally.save()  # Unchanged, not logged
+        tally_id = tally.pk
+        tally.delete()
+
+        changes = list(TallyChange.objects.all())
+        self.assertEqual(
+            [change.op for change in changes],
+            [TallyChange.INSERT, TallyChange.UPDATE, TallyChange.DELETE],
+        )
+        self.assertTrue(all(change.tally_id == tally_id for change in changes))
+        self.assertEqual(
+            [change.delta for change in changes],
+            [{"calls": 2}, {"calls": 3}, {"calls": -5}],
+        )
+        self.assertIsNone(changes[0].before)
+        self.assertEqual(changes[1].before["calls"], 2)
+        self.assertIsNone(changes[2].after)
+
+    def test_rows_pruned_from_an_archived_session_are_not_logged(self):
+        Tally.objects.create(user=self.user, date=self.date, calls=2)
+        session = TotSchoolSession.objects.get(
+            kind=TotSchoolSession.QUARTER, start__lte=self.date, end__gte=self.date
+        )
+        logged = TallyChange.objects.count()
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive_session(session, prune=True, archive_dir=archive_dir, force=True)
+
+        self.assertFalse(Tally.objects.filter(date=self.date).exists())
+        self.assertEqual(TallyChange.objects.count(), logged)
+
+    def test_export_resumes_from_the_cursor(self):
+        for day in range(3):
+            Tally.objects.create(
+                user=self.user, date=self.date + datetime.timedelta(days=day)
+            )
+
+        def export(limit):
+            stream = io.StringIO()
+            count, position = export_changes("warehouse", stream, limit=limit, lag=0)
+            seqs = [json.loads(line)["seq"] for line in stream.getvalue().splitlines()]
+            self.assertEqual(len(seqs), count)
+            return seqs, position
+
+        first, position = export(2)
+        self.assertEqual(position, first[-1])
+        Tally.objects.create(
+            user=self.user, date=self.date + datetime.timedelta(days=3)
+        )
+        second, _ = export(10)
+        third, _ = export(10)
+
+        self.assertEqual(
+            first + second,
+            list(TallyChange.objects.order_by("id").values_list("id", flat=True)),
+        )
+        self.assertEqual(len(first + second), 4)
+        self.assertEqual(third, [])
+
+
+@unittest.skipUnless(numpy_available(), "the anomaly detector needs numpy")
+class AnomalyRuleTests(SimpleTestCase):
+    """Each rule of ``detect`` against a small fixed dataset."""
+
+    def detect(self, rows):
+        import numpy as np
+
+        user_ids = np.array([user_id for user_id, _ in rows])
+        values = np.array(
+            [[metrics.get(field, 0) for field in METRIC_FIELDS] for _, metrics in rows]
+        ).reshape(-1, len(METRIC_FIELDS))
+        return {
+            (int(row), reason, field)
+            for row, reason, field, _, _ in detect(user_ids, values, get_config())
+        }
+
+    def test_outlier_against_the_agents_other_entries(self):
+        usual = {"visits": 10, "appointments": 5, "demos": 2, "policies": 1}
+        rows = [(1, usual)] * 6 + [(1, {**usual, "visits": 50})]
+        self.assertEqual(self.detect(rows), {(6, TallyFlag.ZSCORE, "visits")})
+
+    def test_outliers_need_enough_other_entries(self):
+        rows = [(1, {"visits": 10})] * 3 + [(1, {"visits": 50})]
+        self.assertEqual(self.detect(rows), set())
+
+    def test_funnel_stage_above_the_stage_before_it(self):
+        stages = {"visits": 2, "appointments": 2, "demos": 2, "policies": 3}
+        rows = [(1, stages), (2, {"premium": 500})]
+        self.assertEqual(
+            self.detect(rows),
+            {(0, TallyFlag.FUNNEL, "policies"), (1, TallyFlag.FUNNEL, "premium")},
+        )
+
+    def test_jump_against_the_previous_entry_of_the_same_agent(self):
+        rows = [(1, {"calls": 5}), (1, {"calls": 50}), (2, {"calls": 500})]
+        self.assertEqual(self.detect(rows), {(1, TallyFlag.JUMP, "calls")})
+
+
+@unittest.skipUnless(numpy_available(), "the anomaly detector needs numpy")
+class AnomalyReviewTests(TestCase):
+    def setUp(self):
+        self.tally = Tally.objects.create(
+            user=create_agent(), date=datetime.date(2024, 1, 10), policies=3
+        )
+        self.session = TotSchoolSession.objects.get(kind=TotSchoolSession.QUARTER)
+
+    def get_flag(self):
+        return TallyFlag.objects.get(tally=self.tally)
+
+    def test_editing_a_flagged_metric_resolves_and_a_rerun_reopens(self):
+        self.assertEqual(detect_session(self.session)[2], 1)
+        self.assertEqual(self.get_flag().status, TallyFlag.OPEN)
+
+        self.tally.policies = 0
+        self.tally.save()
+        self.assertEqual(self.get_flag().status, TallyFlag.RESOLVED)
+        self.assertEqual(detect_session(self.session)[3:], (0, 0))
+
+        self.tally.policies = 3
+        self.tally.save()
+        self.assertEqual(detect_session(self.session)[3:], (1, 0))
+        self.assertEqual(self.get_flag().status, TallyFlag.OPEN)
+
+    def test_rerun_resolves_findings_that_no_longer_hold(self):
+        detect_session(self.session)
+        # Bypasses the signals, so only the rerun can notice
+        Tally.objects.filter(pk=self.tally.pk).update(policies=0)
+        self.assertEqual(detect_session(self.session)[3:], (0, 1))
+        self.assertEqual(self.get_flag().status, TallyFlag.RESOLVED)
+
+    def test_rerun_keeps_dismissed_flags(self):
+        detect_session(self.session)
+        TallyFlag.objects.update(status=TallyFlag.DISMISSED)
+        self.assertEqual(detect_session(self.session)[2:], (0, 0, 0))
+        self.assertEqual(self.get_flag().status, TallyFlag.DISMISSED)
+
+
+class SessionIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.quarter = TotSchoolSession(
+            pk=1,
+            name="2025 Quarter 1",
+            start=datetime.date(2025, 1, 1),
+            end=datetime.date(2025, 3, 31),
+        )
+        self.contest = TotSchoolSession(
+            pk=2,
+            name="March contest",
+            kind=TotSchoolSession.CONTEST,
+            start=datetime.date(2025, 3, 15),
+            end=datetime.date(2025, 4, 15),
+        )
+        self.archived = TotSchoolSession(
+            pk=3,
+            name="2024 Quarter 4",
+            start=datetime.date(2024, 10, 1),
+            end=datetime.date(2024, 12, 31),
+            archived_at=timezone.now(),
+        )
+        self.index = SessionIndex([self.contest, self.archived, self.quarter])
+
+    def test_overlapping_sessions_are_all_found(self):
+        self.assertEqual(
+            self.index.for_date(datetime.date(2025, 3, 20)),
+            [self.quarter, self.contest],
+        )
+        self.assertEqual(
+            self.index.for_date(datetime.date(2025, 3, 20), kind="contest"),
+            [self.contest],
+        )
+
+    def test_start_and_end_dates_are_included(self):
+        for date, sessions in [
+            (datetime.date(2024, 12, 31), [self.archived]),
+            (datetime.date(2025, 1, 1), [self.quarter]),
+            (datetime.date(2025, 3, 14), [self.quarter]),
+            (datetime.date(2025, 3, 15), [self.quarter, self.contest]),
+            (datetime.date(2025, 3, 31), [self.quarter, self.contest]),
+            (datetime.date(2025, 4, 1), [self.contest]),
+            (datetime.date(2025, 4, 15), [self.contest]),
+            (datetime.date(2025, 4, 16), []),
+        ]:
+            with self.subTest(date=date):
+                self.assertEqual(self.index.for_date(date), sessions)
+
+    def test_archived_filter(self):
+        start, end = datetime.date(2024, 12, 1), datetime.date(2025, 3, 31)
+        self.assertEqual(
+            self.index.overlapping(start, end, archived=True), [self.archived]
+        )
+        self.assertEqual(
+            self.index.overlapping(start, end, archived=False),
+            [self.quarter, self.contest],
+        )
+        self.assertEqual(len(self.index.overlapping(start, end)), 3)
+
+    def test_tree_matches_a_linear_scan(self):
+        intervals = [
+            (start, start + length, (start, length))
+            for start in range(0, 60, 3)
+            for length in (0, 1, 7, 20)
+        ]
+        tree = IntervalTree(intervals)
+        for point in range(-2, 85):
+            with self.subTest(point=point):
+                self.assertCountEqual(
+                    tree.at(point),
+                    [item for s, e, item in intervals if s <= point <= e],
+                )
+        for start, end in [(-5, -1), (10, 12), (30, 30), (50, 90)]:
+            self.assertCountEqual(
+                tree.overlapping(start, end),
+                [item for s, e, item in intervals if s <= end and e >= start],
+            )
+
+
+SINGLEFLIGHT_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "tally": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tally-tests",
+    },
+}
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_computation(self):
+        flight = singleflight.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "total"
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flight.do("key", compute, timeout=5))
+        )
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(
+            target=lambda: results.append(flight.do("key", compute, timeout=5))
+        )
+        follower.start()
+        # Let the follower reach the wait before the leader finishes
+        time.sleep(0.1)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertCountEqual(results, [("total", False), ("total", True)])
+
+
+@override_settings(
+    CACHES=SINGLEFLIGHT_CACHES,
+    TALLY_SINGLEFLIGHT={"cache": "tally", "fresh": 5, "stale": 30},
+)
+class SharedCacheTests(TestCase):
+    def setUp(self):
+        self.cache = caches["tally"]
+        self.cache.clear()
+        self.config = singleflight.get_config()
+        self.now = time.time()
+        clock = mock.patch.object(
+            singleflight, "time", mock.Mock(time=lambda: self.now, sleep=time.sleep)
+        )
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def call(self):
+        return singleflight._cached_call("key", self.compute, self.config)
+
+    def test_fresh_entries_are_served_from_the_cache(self):
+        self.assertEqual(self.call(), (1, False))
+        self.now += 4
+        self.assertEqual(self.call(), (1, True))
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_entries_are_served_while_another_caller_revalidates(self):
+        self.call()
+        self.now += 6
+        generation = singleflight.get_generation(self.cache)
+        self.cache.add(f"tally:sf:{generation}:key:lock", 1)
+        self.assertEqual(self.call(), (1, True))
+
+        self.cache.delete(f"tally:sf:{generation}:key:lock")
+        self.assertEqual(self.call(), (2, False))
+
+    def test_commit_bumps_the_generation(self):
+        self.call()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            singleflight.schedule_invalidation()
+            self.assertEqual(singleflight.get_generation(self.cache), 0)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(singleflight.get_generation(self.cache), 1)
+        # The new generation misses the entry cached before the change
+        self.assertEqual(self.call(), (2, False))
@@ -1,8 +1,12 @@
+import functools
+import threading
+from django.conf import settings
 from django.urls import reverse_lazy, reverse
 from lariv.registry import UIRegistry, EnvironmentRegistry
 from lariv.environment import Environment as LarivEnvironment, EnvironmentField
 from users.models import User
 from django.utils import timezone
+from .metrics import get_metrics
 from .models import TotSchoolSession
 from components import *  # noqa
 from components.base import Component
@@ -39,9 +43,62 @@ class TallyEnvironment(LarivEnvironment):
         return data
 
 
+_frozen_trees = {}
+_frozen_lock = threading.Lock()
+
+
+def frozen(build):
+    """Build a component tree once and reuse it for every request.
+
+    Frozen trees must not hold request data; data-dependent values are bound
+    at render time through keys and callables.
+    """
+
+    @functools.wraps(build)
+    def wrapper(self):
+        if not getattr(settings, "TALLY_FREEZE_UI", True):
+            return build(self)
+        cls = type(self)
+        tree = _frozen_trees.get(cls)
+        if tree is None:
+            with _frozen_lock:
+                tree = _frozen_trees.get(cls)
+                if tree is None:
+                    tree = _frozen_trees[cls] = build(self)
+        return tree
+
+    return wrapper
+
+
+FROZEN_COMPONENTS = [
+    "tally.TallyMenu",
+    "tally.TallyDetailMenu",
+    "tally.TallyFilter",
+    "tally.TallyFormFields",
+    "tally.TallyCreateForm",
+    "tally.TallyUpdateForm",
+    "tally.TallyDailyForm",
+    "tally.TallyTable",
+    "tally.TallyDetail",
+    "tally.TallyDeleteForm",
+    "tally.TallyDashboard",
+    "tally.TallyLeaderboard",
+    "tally.TallyProfiles",
+    "tally.TallyRankHistory",
+    "tally.TallyFunnel",
+]
+
+
+def freeze_components():
+    """Prebuild the static tally component trees, called from AppConfig.ready()."""
+    for name in FROZEN_COMPONENTS:
+        UIRegistry.get(name)().build()
+
+
 # Menus
 @UIRegistry.register("tally.TallyMenu")
 class TallyMenu(Component):
+    @frozen
     def build(self):
         return Menu(
             uid="tally-menu",
@@ -62,6 +119,17 @@ class TallyMenu(Component):
                     title="Leaderboard",
                     url=reverse_lazy("tally:leaderboard"),
                 ),
+                MenuItem(
+                    uid="tally-menu-rank-history",
+                    title="Rank History",
+                    url=reverse_lazy("tally:rank_history"),
+                ),
+                MenuItem(
+                    uid="tally-menu-funnel",
+                    title="Conversion Funnel",
+                    role=["totschool_admin"],
+                    url=reverse_lazy("tally:funnel"),
+                ),
                 MenuItem(
                     uid="tally-menu-list",
                     title="All Reports",
@@ -84,6 +152,7 @@ class TallyMenu(Component):
 
 @UIRegistry.register("tally.TallyDetailMenu")
 class TallyDetailMenu(Component):
+    @frozen
     def build(self):
         return Menu(
             uid="tally-detail-menu",
@@ -120,6 +189,7 @@ class TallyDetailMenu(Component):
 # Filters for Tally
 @UIRegistry.register("tally.TallyFilter")
 class TallyFilter(Component):
+    @frozen
     def build(self):
         return Form(
             uid="tally-filter",
@@ -133,7 +203,7 @@ class TallyFilter(Component):
                     key="user",
                     label="User",
                     model=User,
-                    url=reverse_lazy("users:select"),
+                    url=reverse_lazy("tally:agent_select"),
                     placeholder="Select User",
                 ),
                 DateInput(uid="tally-filter-date", key="date", label="Date"),
@@ -159,96 +229,28 @@ class DynamicDate:
 
 
 def get_tally_common_fields(prefix):
+    metrics = get_metrics()
     return [
         Row(
-            uid=f"{prefix}-visits-appts",
-            classes="grid grid-cols-1 gap-1 @md:grid-cols-2",
-            children=[
-                TextInput(
-                    uid=f"{prefix}-visits", key="visits", label="Visits", required=True
-                ),
-                TextInput(
-                    uid=f"{prefix}-appointments",
-                    key="appointments",
-                    label="Appointments",
-                    required=True,
-                ),
-            ],
-        ),
-        Row(
-            uid=f"{prefix}-leads-calls",
-            classes="grid grid-cols-1 gap-1 @md:grid-cols-2",
-            children=[
-                TextInput(
-                    uid=f"{prefix}-leads", key="leads", label="Leads", required=True
-                ),
-                TextInput(
-                    uid=f"{prefix}-calls",
-                    key="calls",
-                    label="Calls",
-                    required=True,
-                ),
-            ],
-        ),
-        Row(
-            uid=f"{prefix}-demos-letters",
-            classes="grid grid-cols-1 gap-1 @md:grid-cols-2",
-            children=[
-                TextInput(
-                    uid=f"{prefix}-demos",
-                    key="demos",
-                    label="Demonstrations",
-                    required=True,
-                ),
-                TextInput(
-                    uid=f"{prefix}-letters",
-                    key="letters",
-                    label="Follow Up Letters Sent",
-                    required=True,
-                ),
-            ],
-        ),
-        Row(
-            uid=f"{prefix}-followups-proposals",
-            classes="grid grid-cols-1 gap-1 @md:grid-cols-2",
-            children=[
-                TextInput(
-                    uid=f"{prefix}-followups",
-                    key="follow_ups",
-                    label="Follow Ups",
-                    required=True,
-                ),
-                TextInput(
-                    uid=f"{prefix}-proposals",
-                    key="proposals",
-                    label="Proposals Given",
-                    required=True,
-                ),
-            ],
-        ),
-        Row(
-            uid=f"{prefix}-policies-premium",
+            uid=f"{prefix}-{'-'.join(metric.short_slug for metric in pair)}",
             classes="grid grid-cols-1 gap-1 @md:grid-cols-2",
             children=[
                 TextInput(
-                    uid=f"{prefix}-policies",
-                    key="policies",
-                    label="Policies Sold",
-                    required=True,
-                ),
-                TextInput(
-                    uid=f"{prefix}-premium",
-                    key="premium",
-                    label="Premium",
+                    uid=f"{prefix}-{metric.slug}",
+                    key=metric.field,
+                    label=metric.input_label,
                     required=True,
-                ),
+                )
+                for metric in pair
             ],
-        ),
+        )
+        for pair in (metrics[i : i + 2] for i in range(0, len(metrics), 2))
     ]
 
 
 @UIRegistry.register("tally.TallyFormFields")
 class TallyFormFields(Component):
+    @frozen
     def build(self):
         return Column(
             uid="tally-form-fields",
@@ -283,6 +285,7 @@ class TallyFormFields(Component):
 
 @UIRegistry.register("tally.TallyCreateForm")
 class TallyCreateForm(Component):
+    @frozen
     def build(self):
         return ScaffoldLayout(
             uid="tally-create-scaffold",
@@ -304,6 +307,7 @@ class TallyCreateForm(Component):
 
 @UIRegistry.register("tally.TallyUpdateForm")
 class TallyUpdateForm(Component):
+    @frozen
     def build(self):
         return ScaffoldLayout(
             uid="tally-update-scaffold",
@@ -325,6 +329,7 @@ class TallyUpdateForm(Component):
 
 @UIRegistry.register("tally.TallyDailyForm")
 class TallyDailyForm(Component):
+    @frozen
     def build(self):
         return ScaffoldLayout(
             uid="tally-daily-scaffold",
@@ -350,11 +355,18 @@ class TallyDailyForm(Component):
 # Tally Table
 @UIRegistry.register("tally.TallyTable")
 class TallyTable(Component):
+    @frozen
     def build(self):
         return ScaffoldLayout(
             uid="tally-table-scaffold",
             sidebar_children=[UIRegistry.get("tally.TallyMenu")().build()],
             children=[
+                FacetsLoader(
+                    uid="tally-facets-loader",
+                    role=["totschool_admin"],
+                    url=reverse_lazy("tally:list_facets"),
+                    form="tally-filter",
+                ),
                 Table(
                     uid="tally-table",
                     classes="w-full",
@@ -401,6 +413,7 @@ class TallyTable(Component):
 # Detail View
 @UIRegistry.register("tally.TallyDetail")
 class TallyDetail(Component):
+    @frozen
     def build(self):
         return ScaffoldLayout(
             uid="tally-detail-scaffold",
@@ -420,78 +433,14 @@ class TallyDetail(Component):
                                     classes="grid grid-cols-2 md:grid-cols-3 lg:grid-cols-4 gap-4 mt-4",
                                     children=[
                                         InlineLabel(
-                                            uid="tally-visits-label",
-                                            title="Visits",
-                                            children=[TextField(
-                                                uid="tally-visits-val", key="visits"
-                                            )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-appts-label",
-                                            title="Appointments",
-                                            children=[TextField(
-                                                uid="tally-appts-val",
-                                                key="appointments",
-                                            )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-leads-label",
-                                            title="Leads",
-                                            children=[TextField(
-                                                uid="tally-leads-val", key="leads"
-                                            )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-calls-label",
-                                            title="Calls",
-                                            children=[TextField(
-                                                uid="tally-calls-val", key="calls"
-                                            )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-demos-label",
-                                            title="Demonstrations",
-                                            children=[TextField(
-                                                uid="tally-demos-val", key="demos"
-                                            )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-letters-label",
-                                            title="Letters",
-                                            children=[TextField(
-                                                uid="tally-letters-val", key="letters"
-                                            )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-followups-label",
-                                            title="Follow Ups",
+                                            uid=f"tally-{metric.short_slug}-label",
+                                            title=metric.short_label,
                                             children=[TextField(
-                                                uid="tally-followups-val",
-                                                key="follow_ups",
+                                                uid=f"tally-{metric.short_slug}-val",
+                                                key=metric.field,
                                             )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-proposals-label",
-                                            title="Proposals Given",
-                                            children=[TextField(
-                                                uid="tally-proposals-val",
-                                                key="proposals",
-                                            )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-policies-label",
-                                            title="Policies Sold",
-                                            children=[TextField(
-                                                uid="tally-policies-val", key="policies"
-                                            )],
-                                        ),
-                                        InlineLabel(
-                                            uid="tally-premium-label",
-                                            title="Premium",
-                                            children=[TextField(
-                                                uid="tally-premium-val", key="premium"
-                                            )],
-                                        ),
+                                        )
+                                        for metric in get_metrics()
                                     ],
                                 ),
                             ],
@@ -504,6 +453,7 @@ class TallyDetail(Component):
 
 @UIRegistry.register("tally.TallyDeleteForm")
 class TallyDeleteForm(Component):
+    @frozen
     def build(self):
         return ScaffoldLayout(
             uid="tally-delete-scaffold",
@@ -523,6 +473,7 @@ class TallyDeleteForm(Component):
 # Dashboard
 @UIRegistry.register("tally.TallyDashboard")
 class TallyDashboard(Component):
+    @frozen
     def build(self):
         return ScaffoldLayout(
             uid="tally-dashboard-scaffold",
@@ -542,7 +493,7 @@ class TallyDashboard(Component):
                             key="user_id",
                             label="Agent",
                             model=User,
-                            url=reverse_lazy("users:select"),
+                            url=reverse_lazy("tally:agent_select"),
                             placeholder="All Agents",
                             display_attr="name",
                         ),
@@ -569,6 +520,7 @@ class TallyDashboard(Component):
 # Leaderboard
 @UIRegistry.register("tally.TallyLeaderboard")
 class TallyLeaderboard(Component):
+    @frozen
     def build(self):
         return ScaffoldLayout(
             uid="tally-leaderboard-scaffold",
@@ -589,7 +541,7 @@ class TallyLeaderboard(Component):
                             key="user_id",
                             label="Highlight Agent",
                             model=User,
-                            url=reverse_lazy("users:select"),
+                            url=reverse_lazy("tally:agent_select"),
                             placeholder="Select Agent to highlight",
                             display_attr="name",
                         ),
@@ -613,3 +565,117 @@ class TallyLeaderboard(Component):
                 ),
             ],
         )
+
+
+@UIRegistry.register("tally.TallyRankHistory")
+class TallyRankHistory(Component):
+    @frozen
+    def build(self):
+        return ScaffoldLayout(
+            uid="tally-rank-history-scaffold",
+            sidebar_children=[UIRegistry.get("tally.TallyMenu")().build()],
+            children=[
+                TitleField(uid="tally-rank-history-title", key="title", classes="mb-4"),
+                Form(
+                    uid="tally-rank-history-filter",
+                    role=["totschool_admin"],
+                    url=reverse_lazy("tally:rank_history"),
+                    target="#tally-rank-history-chart",
+                    method="get",
+                    swap="morph",
+                    classes="mb-4 border-b border-base-300 pb-4",
+                    children=[
+                        ForeignKeyInput(
+                            uid="tally-rank-history-user",
+                            key="user_id",
+                            label="Agent",
+                            model=User,
+                            url=reverse_lazy("tally:agent_select"),
+                            placeholder="Select Agent",
+                            display_attr="name",
+                        ),
+                        Row(
+                            uid="tally-rank-history-actions",
+                            classes="flex gap-2",
+                            children=[
+                                SubmitInput(
+                                    uid="tally-rank-history-submit",
+                                    label="Apply",
+                                ),
+                                ClearInput(
+                                    uid="tally-rank-history-clear", label="Clear"
+                                ),
+                            ],
+                        ),
+                    ],
+                ),
+                RankHistoryChart(uid="tally-rank-history-chart"),
+            ],
+        )
+
+
+@UIRegistry.register("tally.TallyFunnel")
+class TallyFunnel(Component):
+    @frozen
+    def build(self):
+        return ScaffoldLayout(
+            uid="tally-funnel-scaffold",
+            sidebar_children=[UIRegistry.get("tally.TallyMenu")().build()],
+            children=[
+                TitleField(uid="tally-funnel-title", key="title", classes="mb-4"),
+                Form(
+                    uid="tally-funnel-filter",
+                    url=reverse_lazy("tally:funnel"),
+                    target="#tally-funnel-table",
+                    method="get",
+                    swap="morph",
+                    classes="mb-4 border-b border-base-300 pb-4",
+                    children=[
+                        Row(
+                            uid="tally-funnel-minimums",
+                            classes="grid grid-cols-1 gap-1 @md:grid-cols-2",
+                            children=[
+                                TextInput(
+                                    uid="tally-funnel-min-visits",
+                                    key="min_visits",
+                                    label="Minimum Visits",
+                                ),
+                                TextInput(
+                                    uid="tally-funnel-min-demos",
+                                    key="min_demos",
+                                    label="Minimum Demonstrations",
+                                ),
+                            ],
+                        ),
+                        Row(
+                            uid="tally-funnel-actions",
+                            classes="flex gap-2",
+                            children=[
+                                SubmitInput(uid="tally-funnel-submit", label="Apply"),
+                                ClearInput(uid="tally-funnel-clear", label="Clear"),
+                            ],
+                        ),
+                    ],
+                ),
+                FunnelTable(uid="tally-funnel-table"),
+            ],
+        )
+
+
+# Request profiles
+@UIRegistry.register("tally.TallyProfiles")
+class TallyProfiles(Component):
+    @frozen
+    def build(self):
+        return ScaffoldLayout(
+            uid="tally-profiles-scaffold",
+            sidebar_children=[UIRegistry.get("tally.TallyMenu")().build()],
+            children=[
+                TitleField(
+                    uid="tally-profiles-title",
+                    static_value="Request Profiles",
+                    classes="mb-4",
+                ),
+                ProfileList(uid="tally-profiles-list"),
+            ],
+        )
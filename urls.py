@@ -1,6 +1,7 @@
 from django.urls import path
 from lariv.registry import ViewRegistry
 from . import views  # noqa: F401
+from .instrumentation import metrics_view
 
 TallyList = ViewRegistry.get("tally.TallyList")
 TallyDailyForm = ViewRegistry.get("tally.TallyDailyForm")
@@ -11,17 +12,44 @@ TallyDelete = ViewRegistry.get("tally.TallyDelete")
 TallyDashboard = ViewRegistry.get("tally.TallyDashboard")
 
 TallyLeaderboard = ViewRegistry.get("tally.TallyLeaderboard")
+TallyProfiles = ViewRegistry.get("tally.TallyProfiles")
+TallyLive = ViewRegistry.get("tally.TallyLive")
+TallyIngest = ViewRegistry.get("tally.TallyIngest")
+TallyBootstrap = ViewRegistry.get("tally.TallyBootstrap")
+TallyRankHistory = ViewRegistry.get("tally.TallyRankHistory")
+TallyFunnel = ViewRegistry.get("tally.TallyFunnel")
 
 app_name = "tally"
 
 urlpatterns = [
     path("", TallyDashboard.as_view(), name="default"),
     path("list/", TallyList.as_view(), name="list"),
+    path("list/facets/", views.tally_list_facets, name="list_facets"),
     path("dashboard/", TallyDashboard.as_view(), name="dashboard"),
     path("leaderboard/", TallyLeaderboard.as_view(), name="leaderboard"),
+    path("rank-history/", TallyRankHistory.as_view(), name="rank_history"),
+    path("funnel/", TallyFunnel.as_view(), name="funnel"),
+    path("live/", TallyLive.as_view(), name="live"),
+    path("bootstrap/", TallyBootstrap.as_view(), name="bootstrap"),
     path("daily/", TallyDailyForm.as_view(), name="daily"),
     path("create/", TallyCreate.as_view(), name="create"),
     path("<int:pk>/", TallyView.as_view(), name="detail"),
     path("<int:pk>/update/", TallyUpdate.as_view(), name="update"),
     path("<int:pk>/delete/", TallyDelete.as_view(), name="delete"),
+    path("api/ingest/", TallyIngest.as_view(), name="ingest"),
+    path("api/changes/", views.tally_changes_api, name="changes_api"),
+    path("agents/select/", views.tally_agent_select, name="agent_select"),
+    path("api/agents/", views.tally_agents_api, name="agents_api"),
+    path(
+        "api/rank-history/",
+        views.tally_rank_history_api,
+        name="rank_history_api",
+    ),
+    path("metrics/", metrics_view, name="metrics"),
+    path("profiles/", TallyProfiles.as_view(), name="profiles"),
+    path(
+        "profiles/<str:profile_id>/download/",
+        views.tally_profile_download,
+        name="profile_download",
+    ),
 ]
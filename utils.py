@@ -1,4 +1,5 @@
 import datetime
+
 from .models import TotSchoolSession
 
 
@@ -24,8 +25,31 @@ def get_quarter_details_for_date(date):
     return name, start_date, end_date
 
 
+def get_next_quarter_start(date):
+    _, _, end_date = get_quarter_details_for_date(date)
+    return end_date + datetime.timedelta(days=1)
+
+
+def get_session_weeks(start, end):
+    """Weeks from Monday covering ``start`` to ``end``, clipped to that range."""
+    weeks = []
+    week_start = start - datetime.timedelta(days=start.weekday())
+    while week_start <= end:
+        week_end = week_start + datetime.timedelta(days=6)
+        weeks.append((max(week_start, start), min(week_end, end)))
+        week_start += datetime.timedelta(days=7)
+    return weeks
+
+
 def ensure_session_for_date(date):
+    """Return the quarter session covering ``date``, creating it if missing."""
+    from .intervals import sessions_for_date
+
     name, start_date, end_date = get_quarter_details_for_date(date)
+    for session in sessions_for_date(date, kind=TotSchoolSession.QUARTER):
+        if session.name == name:
+            return session
+
     session, created = TotSchoolSession.objects.get_or_create(
         name=name, defaults={"start": start_date, "end": end_date}
     )
@@ -7,13 +7,37 @@ from lariv.mixins import (
     BaseView,
 )
 from lariv.registry import ViewRegistry, EnvironmentRegistry
-from .models import Tally
+from .instrumentation import instrument_view
+from .metrics import get_dashboard_metric_names
+from .models import Tally, TotSchoolSession
 from django.utils import timezone
 from django.urls import reverse, reverse_lazy
 from django.core.exceptions import PermissionDenied
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.views import View
+from urllib.parse import urlencode
+import datetime
+import json
+
+
+def get_selected_session(request):
+    env = EnvironmentRegistry.get("tally")(request)
+    session = env.get_field_values().get("session")
+    if not session:
+        from .utils import ensure_session_for_date
+
+        session = ensure_session_for_date(timezone.now().date())
+    return session
 
 
 @ViewRegistry.register("tally.TallyList")
+@instrument_view
 class TallyList(ListViewMixin):
     model = Tally
     component = "tally.TallyTable"
@@ -22,16 +46,17 @@ class TallyList(ListViewMixin):
     def get_queryset(self):
         queryset = super().get_queryset()
 
-        env = EnvironmentRegistry.get("tally")(self.request)
-        session = env.get_field_values().get("session")
-        if not session:
-            from .utils import ensure_session_for_date
-
-            session = ensure_session_for_date(timezone.now().date())
+        session = get_selected_session(self.request)
 
         if session:
             queryset = queryset.filter(date__gte=session.start, date__lte=session.end)
 
+        # Set by the week facet, whose weeks are clipped to the session
+        week_start = parse_date_param(self.request.GET.get("week_start"))
+        week_end = parse_date_param(self.request.GET.get("week_end"))
+        if week_start and week_end:
+            queryset = queryset.filter(date__gte=week_start, date__lte=week_end)
+
         if not (
             self.request.user.is_superuser
             or self.request.user.role in ["totschool_admin"]
@@ -40,7 +65,61 @@ class TallyList(ListViewMixin):
         return queryset
 
 
+def parse_date_param(value):
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def tally_list_facets(request):
+    """Facet counts of the tally list for the selected session as HTML.
+
+    Loaded by the list page next to the table; the counts come from one
+    cached grouped query, missing agents from the session roster.
+    """
+    from .agents import get_roster, get_roster_queryset
+    from .components.tally_components import TallyFacets
+
+    if not request.user.is_authenticated or not (
+        request.user.is_superuser or request.user.role in ["totschool_admin"]
+    ):
+        raise PermissionDenied("Only admins can view list facets.")
+
+    session = get_selected_session(request)
+    date = parse_date_param(request.GET.get("date"))
+    if date is None:
+        date = min(max(timezone.now().date(), session.start), session.end)
+    facets = Tally.objects.get_list_facets(session=session, date=date)
+
+    submitted = {a["user_id"] for a in facets["agents"] if a["submitted"]}
+    roster = get_roster(session)
+    if roster is not None:
+        missing = [name for pk, name, _ in roster if pk not in submitted]
+        missing_count = len(missing)
+    else:
+        missing = []
+        missing_count = (
+            get_roster_queryset(session)
+            .exclude(id__in=Tally.objects.filter(date=date).values("user"))
+            .count()
+        )
+
+    html = TallyFacets(uid="tally-facets").render_html(
+        facets={
+            **facets,
+            "date": date,
+            "submitted": len(submitted),
+            "missing": missing,
+            "missing_count": missing_count,
+        },
+        list_url=reverse("tally:list"),
+    )
+    return HttpResponse(html)
+
+
 @ViewRegistry.register("tally.TallyDailyForm")
+@instrument_view
 class TallyDailyForm(PostFormViewMixin):
     model = Tally
     component = "tally.TallyDailyForm"
@@ -63,6 +142,7 @@ class TallyDailyForm(PostFormViewMixin):
 
 
 @ViewRegistry.register("tally.TallyCreate")
+@instrument_view
 class TallyCreate(PostFormViewMixin):
     model = Tally
     component = "tally.TallyCreateForm"
@@ -76,6 +156,7 @@ class TallyCreate(PostFormViewMixin):
 
 
 @ViewRegistry.register("tally.TallyView")
+@instrument_view
 class TallyView(DetailViewMixin):
     model = Tally
     component = "tally.TallyDetail"
@@ -83,6 +164,7 @@ class TallyView(DetailViewMixin):
 
 
 @ViewRegistry.register("tally.TallyUpdate")
+@instrument_view
 class TallyUpdate(PostFormViewMixin):
     model = Tally
     component = "tally.TallyUpdateForm"
@@ -98,6 +180,7 @@ class TallyUpdate(PostFormViewMixin):
 
 
 @ViewRegistry.register("tally.TallyDelete")
+@instrument_view
 class TallyDelete(DeleteViewMixin):
     model = Tally
     component = "tally.TallyDeleteForm"
@@ -111,6 +194,7 @@ class TallyDelete(DeleteViewMixin):
 
 
 @ViewRegistry.register("tally.TallyDashboard")
+@instrument_view
 class TallyDashboard(LarivHtmxMixin, BaseView):
     model = Tally
     component = "tally.TallyDashboard"
@@ -121,14 +205,11 @@ class TallyDashboard(LarivHtmxMixin, BaseView):
         if not (request.user.is_superuser or request.user.role in ["totschool_admin"]):
             user_id = request.user.id
 
-        env = EnvironmentRegistry.get("tally")(request)
-        session = env.get_field_values().get("session")
-        if not session:
-            from .utils import ensure_session_for_date
-
-            session = ensure_session_for_date(timezone.now().date())
+        session = get_selected_session(request)
 
-        totals = Tally.objects.get_dashboard_stats(user_id=user_id, session=session)
+        totals = Tally.objects.get_dashboard_stats(
+            user_id=user_id, session=session, metrics=get_dashboard_metric_names()
+        )
 
         whatsapp_report = None
         if user_id and not (
@@ -136,10 +217,26 @@ class TallyDashboard(LarivHtmxMixin, BaseView):
         ):
             whatsapp_report = Tally.objects.get_whatsapp_report_data(user_id=user_id)
 
-        return {"dashboard": totals, "whatsapp_report": whatsapp_report}
+        records = targets = None
+        if user_id:
+            from .records import get_user_records
+            from .targets import get_user_targets
+
+            records = get_user_records(user_id)
+            targets = get_user_targets(session, user_id)
+
+        live_url = get_live_url("dashboard", user_id)
+        return {
+            "dashboard": totals,
+            "whatsapp_report": whatsapp_report,
+            "records": records,
+            "targets": targets,
+            "live_url": live_url,
+        }
 
 
 @ViewRegistry.register("tally.TallyLeaderboard")
+@instrument_view
 class TallyLeaderboard(LarivHtmxMixin, BaseView):
     model = Tally
     component = "tally.TallyLeaderboard"
@@ -150,15 +247,475 @@ class TallyLeaderboard(LarivHtmxMixin, BaseView):
         if not user_id:
             user_id = request.user.id
 
-        env = EnvironmentRegistry.get("tally")(request)
-        session = env.get_field_values().get("session")
-        if not session:
-            from .utils import ensure_session_for_date
+        session = get_selected_session(request)
 
-            session = ensure_session_for_date(timezone.now().date())
+        from .models import get_score_formulas
+        from .records import get_org_records
 
         leaderboards = Tally.objects.get_leaderboards(user_id=user_id, session=session)
+        formulas = get_score_formulas()
+        leaderboards.update(
+            Tally.objects.get_score_leaderboards(formulas, user_id, session)
+        )
         return {
             "leaderboards": leaderboards,
+            "score_formulas": serialize_score_formulas(formulas),
+            "org_records": get_org_records(),
+            "title": f"Leaderboard for {session.name}",
+            "live_url": get_live_url("leaderboard", user_id),
+        }
+
+
+@ViewRegistry.register("tally.TallyFunnel")
+@instrument_view
+class TallyFunnel(LarivHtmxMixin, BaseView):
+    model = Tally
+    component = "tally.TallyFunnel"
+    key = "funnel"
+    paginate_by = 25
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated or not (
+            request.user.is_superuser or request.user.role in ["totschool_admin"]
+        ):
+            raise PermissionDenied("Only admins can view the funnel.")
+        return super().dispatch(request, *args, **kwargs)
+
+    def prepare_data(self, request, **kwargs):
+        from django.core.paginator import Paginator
+        from .models import FUNNEL_FIELDS, get_funnel_sort_keys
+
+        session = get_selected_session(request)
+
+        sort = request.GET.get("sort") or "-policy_demo_ratio"
+        if sort.lstrip("-") not in get_funnel_sort_keys():
+            sort = "-policy_demo_ratio"
+        minimums = {}
+        for field in FUNNEL_FIELDS:
+            try:
+                minimums[field] = max(int(request.GET.get(f"min_{field}") or 0), 0)
+            except ValueError:
+                minimums[field] = 0
+
+        rows = Tally.objects.get_funnel(
+            session=session, order_by=sort, minimums=minimums
+        )
+        page = Paginator(rows, self.paginate_by).get_page(request.GET.get("page"))
+        return {
+            "funnel_page": page,
+            "funnel_params": {
+                "sort": sort,
+                **{f"min_{field}": value for field, value in minimums.items()},
+            },
+            "title": f"Conversion Funnel for {session.name}",
+        }
+
+
+def get_rank_history_data(request):
+    from .snapshots import get_rank_history
+
+    if not request.user.is_authenticated:
+        raise PermissionDenied("Login required.")
+    user_id = request.GET.get("user_id", None)
+    is_admin = request.user.is_superuser or request.user.role in ["totschool_admin"]
+    if not (is_admin and user_id):
+        user_id = request.user.id
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        raise Http404("Unknown agent.")
+
+    session = get_selected_session(request)
+
+    return session, user_id, get_rank_history(session, user_id)
+
+
+@ViewRegistry.register("tally.TallyRankHistory")
+@instrument_view
+class TallyRankHistory(LarivHtmxMixin, BaseView):
+    model = Tally
+    component = "tally.TallyRankHistory"
+    key = "history"
+
+    def prepare_data(self, request, **kwargs):
+        session, user_id, history = get_rank_history_data(request)
+        return {
+            "history": history,
+            "title": f"Rank History for {session.name}",
+        }
+
+
+def tally_rank_history_api(request):
+    """Daily rank and cumulative value per leaderboard metric as JSON."""
+    session, user_id, history = get_rank_history_data(request)
+    return JsonResponse(
+        {
+            "session": {"id": session.pk, "name": session.name},
+            "user_id": user_id,
+            "history": history,
+        }
+    )
+
+
+_agent_select_view = None
+
+
+def tally_agent_select(request, *args, **kwargs):
+    """``users:select`` limited to the agents of the selected session.
+
+    Subclasses the users app's picker view so ``ForeignKeyInput`` gets the
+    markup, search and pagination it expects; only the queryset is narrowed
+    to the cached session roster.
+    """
+    global _agent_select_view
+    if _agent_select_view is None:
+        from django.core.exceptions import ImproperlyConfigured
+        from django.urls import resolve
+
+        base = getattr(resolve(reverse("users:select")).func, "view_class", None)
+        if base is None or not hasattr(base, "get_queryset"):
+            raise ImproperlyConfigured("users:select must be a class-based list view.")
+
+        class TallyAgentSelect(base):
+            def get_queryset(self):
+                from .agents import restrict_to_roster
+
+                return restrict_to_roster(
+                    super().get_queryset(), get_selected_session(self.request)
+                )
+
+        _agent_select_view = TallyAgentSelect.as_view()
+    return _agent_select_view(request, *args, **kwargs)
+
+
+def tally_agents_api(request):
+    """Paginated search of the selected session's agents as JSON.
+
+    Word prefixes rank first. Meant to be called debounced while typing.
+    """
+    from .agents import search_agents
+
+    if not request.user.is_authenticated or not (
+        request.user.is_superuser or request.user.role in ["totschool_admin"]
+    ):
+        raise PermissionDenied("Only admins can search agents.")
+    try:
+        page = max(int(request.GET.get("page") or 1), 1)
+        per_page = min(max(int(request.GET.get("per_page") or 20), 1), 100)
+    except ValueError:
+        return JsonResponse(
+            {"error": "page and per_page must be integers."}, status=400
+        )
+
+    session = get_selected_session(request)
+    results, has_more = search_agents(
+        session, request.GET.get("q", "")[:100], page, per_page
+    )
+    return JsonResponse(
+        {
+            "session": {"id": session.pk, "name": session.name},
+            "results": results,
+            "page": page,
+            "has_more": has_more,
+        }
+    )
+
+
+def tally_changes_api(request):
+    """Delta feed of the tally change log past the ``after`` sequence."""
+    from .changelog import get_changes, serialize_change
+
+    if not request.user.is_authenticated or not (
+        request.user.is_superuser or request.user.role in ["totschool_admin"]
+    ):
+        raise PermissionDenied("Only admins can read the change log.")
+    try:
+        after = int(request.GET.get("after") or 0)
+        limit = min(int(request.GET.get("limit") or 1000), 5000)
+    except ValueError:
+        return JsonResponse({"error": "after and limit must be integers."}, status=400)
+
+    changes = get_changes(after, limit)
+    return JsonResponse(
+        {
+            "changes": [serialize_change(change) for change in changes],
+            "next": changes[-1].id if changes else after,
+        }
+    )
+
+
+def get_live_url(scope, user_id=None):
+    from .live import live_updates_enabled
+
+    if not live_updates_enabled():
+        return None
+    params = {"scope": scope}
+    if user_id:
+        params["user_id"] = user_id
+    return f"{reverse('tally:live')}?{urlencode(params)}"
+
+
+@ViewRegistry.register("tally.TallyLive")
+@instrument_view
+class TallyLive(View):
+    """Server-sent events stream of leaderboard and dashboard patches."""
+
+    def get(self, request):
+        from .live import LiveStream, acquire_stream_slot
+
+        if not request.user.is_authenticated:
+            raise PermissionDenied("Login required.")
+
+        scope = request.GET.get("scope", "leaderboard")
+        user_id = request.GET.get("user_id", None)
+        is_admin = request.user.is_superuser or request.user.role in [
+            "totschool_admin"
+        ]
+        if scope == "dashboard" and not is_admin:
+            user_id = request.user.id
+        if scope == "leaderboard" and not user_id:
+            user_id = request.user.id
+
+        session = get_selected_session(request)
+
+        user_name = None
+        if user_id and str(user_id) == str(request.user.id):
+            user_name = request.user.name
+        elif user_id:
+            from users.models import User
+
+            user_name = (
+                User.objects.filter(id=user_id).values_list("name", flat=True).first()
+            )
+
+        stream = LiveStream(session, scope, user_id=user_id, user_name=user_name)
+        if request.GET.get("poll"):
+            # Fallback for viewers turned away below
+            return JsonResponse({"patches": stream.load_initial_state()})
+
+        # 204 tells EventSource not to reconnect, and the page polls instead
+        if not acquire_stream_slot():
+            return HttpResponse(status=204)
+        stream.holds_slot = True
+        try:
+            stream.start()
+        except Exception:
+            stream.close()
+            raise
+
+        # The response closes the stream, freeing its slot, when it ends
+        response = StreamingHttpResponse(stream, content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+@ViewRegistry.register("tally.TallyProfiles")
+@instrument_view
+class TallyProfiles(LarivHtmxMixin, BaseView):
+    model = Tally
+    component = "tally.TallyProfiles"
+    key = "profiles"
+
+    def dispatch(self, request, *args, **kwargs):
+        from .profiling import can_view_profiles
+
+        if not can_view_profiles(request.user):
+            raise PermissionDenied("Only admins can view request profiles.")
+        return super().dispatch(request, *args, **kwargs)
+
+    def prepare_data(self, request, **kwargs):
+        from .profiling import list_profiles
+
+        return {"profiles": list_profiles()}
+
+
+def tally_profile_download(request, profile_id):
+    from .profiling import can_view_profiles, get_profile_path
+
+    if not can_view_profiles(request.user):
+        raise PermissionDenied("Only admins can download request profiles.")
+
+    kind = request.GET.get("kind", "prof")
+    path = get_profile_path(profile_id, kind)
+    if not path:
+        raise Http404("Profile not found.")
+    return FileResponse(
+        open(path, "rb"), as_attachment=True, filename=f"{profile_id}.{kind}"
+    )
+
+
+@ViewRegistry.register("tally.TallyIngest")
+@instrument_view
+class TallyIngest(View):
+    """Bulk JSON upsert of daily tallies with idempotency keys."""
+
+    def post(self, request):
+        from users.models import User
+        from .ingest import (
+            IngestError,
+            ingest_tallies,
+            request_fingerprint,
+            run_idempotent,
+            summarize_results,
+        )
+
+        if not request.user.is_authenticated:
+            return JsonResponse({"error": "Login required."}, status=401)
+
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON."}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({"error": "Expected a JSON object."}, status=400)
+
+        is_admin = request.user.is_superuser or request.user.role in [
+            "totschool_admin"
+        ]
+        user_id = request.user.id
+        if payload.get("user_id") not in (None, "") and str(
+            payload["user_id"]
+        ) != str(user_id):
+            if not is_admin:
+                return JsonResponse(
+                    {"error": "Only administrators can submit for other agents."},
+                    status=403,
+                )
+            try:
+                user_id = int(payload["user_id"])
+            except (TypeError, ValueError):
+                return JsonResponse({"error": "Invalid user_id."}, status=400)
+            if not User.objects.filter(id=user_id).exists():
+                return JsonResponse({"error": "Unknown user_id."}, status=400)
+
+        def handler():
+            results = ingest_tallies(
+                user_id, payload.get("items"), restrict_dates=not is_admin
+            )
+            return 200, {"results": results, **summarize_results(results)}
+
+        key = request.headers.get("Idempotency-Key") or payload.get(
+            "idempotency_key"
+        )
+        try:
+            status, body, replayed = run_idempotent(
+                request.user.id, key, handler, request_fingerprint(payload)
+            )
+        except IngestError as e:
+            return JsonResponse({"error": e.message}, status=e.status)
+
+        response = JsonResponse(body, status=status)
+        if replayed:
+            response["Idempotent-Replayed"] = "true"
+        return response
+
+
+@ViewRegistry.register("tally.TallyBootstrap")
+@instrument_view
+class TallyBootstrap(View):
+    """First-screen data: dashboard, WhatsApp report and leaderboards at once.
+
+    Returns JSON, or out-of-band fragments for the dashboard and leaderboard
+    content when requested by HTMX.
+    """
+
+    def get(self, request):
+        from .components.tally_components import DashboardContent, LeaderboardContent
+
+        if not request.user.is_authenticated:
+            raise PermissionDenied("Login required.")
+
+        is_admin = request.user.is_superuser or request.user.role in [
+            "totschool_admin"
+        ]
+        user_id = request.GET.get("user_id", None)
+        if not is_admin:
+            user_id = request.user.id
+
+        session = get_selected_session(request)
+
+        # Admin dashboards default to every agent, leaderboards to the viewer
+        overview = Tally.objects.get_session_overview(
+            session=session,
+            dashboard_user_id=user_id,
+            leaderboard_user_id=user_id or request.user.id,
+        )
+
+        whatsapp_report = None
+        if not is_admin:
+            whatsapp_report = Tally.objects.get_whatsapp_report_data(user_id=user_id)
+
+        from .models import get_score_formulas
+        from .records import get_org_records, get_user_records
+        from .targets import get_user_targets
+
+        formulas = get_score_formulas()
+        overview["leaderboards"].update(
+            Tally.objects.get_score_leaderboards(
+                formulas, user_id or request.user.id, session
+            )
+        )
+
+        data = {
+            "dashboard": overview["dashboard"],
+            "whatsapp_report": whatsapp_report,
+            "leaderboards": overview["leaderboards"],
+            "score_formulas": serialize_score_formulas(formulas),
+            "records": get_user_records(user_id) if user_id else None,
+            "targets": get_user_targets(session, user_id) if user_id else None,
+            "org_records": get_org_records(),
             "title": f"Leaderboard for {session.name}",
         }
+
+        if not request.headers.get("HX-Request"):
+            from .intervals import sessions_for_date
+            from .records import serialize_records
+
+            contests = [
+                s
+                for s in sessions_for_date(timezone.now().date(), archived=False)
+                if s.kind != TotSchoolSession.QUARTER
+            ]
+            contest_stats = Tally.objects.get_sessions_stats(
+                contests, user_id=user_id, metrics=get_dashboard_metric_names()
+            )
+            return JsonResponse(
+                {
+                    "session": {"id": session.pk, "name": session.name},
+                    **data,
+                    "records": data["records"] and serialize_records(data["records"]),
+                    "org_records": serialize_records(data["org_records"]),
+                    "contests": [
+                        {
+                            "id": s.pk,
+                            "name": s.name,
+                            "kind": s.kind,
+                            "start": s.start,
+                            "end": s.end,
+                            "dashboard": contest_stats[s.pk],
+                        }
+                        for s in contests
+                    ],
+                }
+            )
+
+        dashboard_html = DashboardContent(uid="tally-dashboard-content").render_html(
+            **data, live_url=get_live_url("dashboard", user_id)
+        )
+        leaderboard_html = LeaderboardContent(
+            uid="tally-leaderboard-content"
+        ).render_html(**data, live_url=get_live_url("leaderboard", user_id))
+        return HttpResponse(
+            with_oob(dashboard_html, "tally-dashboard-content")
+            + with_oob(leaderboard_html, "tally-leaderboard-content")
+        )
+
+
+def serialize_score_formulas(formulas):
+    return [{"key": formula.key, "title": formula.name} for formula in formulas]
+
+
+def with_oob(html, uid):
+    """Mark the root element of a rendered component for an out-of-band swap."""
+    return html.replace(f'id="{uid}"', f'id="{uid}" hx-swap-oob="true"', 1)
@@ -0,0 +1,78 @@
+import logging
+import threading
+
+from django.core.signals import request_started
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .metrics import get_dashboard_metric_names
+from .models import Tally, get_score_formulas
+from .singleflight import get_config
+from .utils import ensure_session_for_date, get_next_quarter_start
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_upcoming_sessions(quarters_ahead=1, today=None):
+    """Create the current session and the next ``quarters_ahead`` ones."""
+    date = today or timezone.now().date()
+    sessions = [ensure_session_for_date(date)]
+    for _ in range(quarters_ahead):
+        date = get_next_quarter_start(date)
+        sessions.append(ensure_session_for_date(date))
+    return sessions
+
+
+def warm_aggregates(session):
+    """Prefill the session-wide aggregates every dashboard and leaderboard shares.
+
+    Only useful with a shared single-flight cache, per-process coalescing
+    keeps nothing between requests.
+    """
+    config = get_config()
+    if not config["enabled"] or not config["cache"]:
+        return False
+    # Same metrics as the dashboard, so the cached entry is the one it reads
+    Tally.objects.get_dashboard_stats(
+        user_id=None, session=session, metrics=get_dashboard_metric_names()
+    )
+    Tally.objects.get_leaderboard_rankings(session=session)
+    Tally.objects.get_session_user_totals(session=session)
+    for formula in get_score_formulas():
+        Tally.objects.get_score_ranking(
+            session=session, weights=formula.weights, normalize=formula.normalize
+        )
+    return True
+
+
+def warm_up(quarters_ahead=1, aggregates=True):
+    """Resolve upcoming sessions and fill the caches for the active one.
+
+    Returns ``(sessions, warmed)``.
+    """
+    sessions = ensure_upcoming_sessions(quarters_ahead)
+    warmed = aggregates and warm_aggregates(sessions[0])
+    return sessions, warmed
+
+
+def _warm_up_in_background():
+    try:
+        warm_up()
+    except DatabaseError:
+        logger.warning("Skipping tally cache warm-up", exc_info=True)
+    finally:
+        connection.close()
+
+
+def _warm_up_on_first_request(sender, **kwargs):
+    request_started.disconnect(_warm_up_on_first_request)
+    threading.Thread(target=_warm_up_in_background, daemon=True).start()
+
+
+def schedule_warm_up_on_start():
+    """Warm caches when this process serves its first request.
+
+    Called from AppConfig.ready(). Querying there directly would also run for
+    every management command, including migrate on an empty database.
+    """
+    request_started.connect(_warm_up_on_first_request)
@@ -0,0 +1,303 @@
+"""Quarter-close report workbooks, built in parallel.
+
+The session's data is loaded in a few grouped queries in the calling
+process and split into one job per workbook: a summary of the session, one
+per agent group and one per agent. Jobs carry plain rows, so the worker
+processes only format and write files and never touch the database.
+
+Each workbook is written under a temporary name and renamed once complete,
+so an interrupted run leaves no partial outputs and a rerun skips the
+workbooks already on disk.
+"""
+
+import csv
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.utils.text import slugify
+
+FORMATS = ("csv", "xlsx")
+
+
+def xlsx_available():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_report_dir():
+    report_dir = getattr(settings, "TALLY_REPORT_DIR", None)
+    if report_dir:
+        return str(report_dir)
+    return os.path.join(str(settings.BASE_DIR), "tally_reports")
+
+
+def load_session_data(session, group_by=None):
+    """Everything the workbooks of ``session`` show, in four bulk queries.
+
+    ``group_by`` names a user field (e.g. a branch) to group agents by.
+    Daily rows are only included while the session's rows are in the tally
+    table; archived sessions fall back to their monthly rollups.
+    """
+    from django.db.models import Count, Sum
+    from django.db.models.functions import TruncMonth
+    from users.models import User
+
+    from .metrics import compute_ratios, get_metrics, get_ratios
+    from .models import SessionMonthlyRollup, Tally, rank_user_totals
+
+    metrics = get_metrics()
+    ratios = get_ratios()
+    fields = [metric.field for metric in metrics]
+
+    totals = [
+        {**row, **compute_ratios(row, ratios)}
+        for row in Tally.objects.get_session_user_totals(session=session)
+    ]
+    ranks = {
+        field: {entry["user_id"]: entry["rank"] for entry in ranking}
+        for field, ranking in rank_user_totals(totals, metrics).items()
+    }
+
+    archived = bool(getattr(session, "archived_at", None))
+    if archived:
+        monthly_rows = (
+            SessionMonthlyRollup.objects.filter(session=session)
+            .order_by("user_id", "month")
+            .values_list("user_id", "month", "forms_filled", *fields)
+        )
+    else:
+        monthly_rows = (
+            Tally.objects.filter(date__gte=session.start, date__lte=session.end)
+            .annotate(month=TruncMonth("date"))
+            .values("user_id", "month")
+            .annotate(forms_filled=Count("id"), **{f: Sum(f) for f in fields})
+            .order_by("user_id", "month")
+            .values_list("user_id", "month", "forms_filled", *fields)
+        )
+    monthly = {}
+    for user_id, *row in monthly_rows:
+        monthly.setdefault(user_id, []).append(row)
+
+    daily = {}
+    if not archived:
+        daily_rows = (
+            Tally.objects.filter(date__gte=session.start, date__lte=session.end)
+            .order_by("user_id", "date")
+            .values_list("user_id", "date", *fields)
+        )
+        for user_id, *row in daily_rows.iterator(chunk_size=2000):
+            daily.setdefault(user_id, []).append(row)
+
+    groups = {}
+    if group_by:
+        groups = dict(
+            User.objects.filter(id__in=[row["user__id"] for row in totals])
+            .values_list("id", group_by)
+        )
+
+    return {
+        "metrics": [(metric.key, metric.label) for metric in metrics],
+        "ratios": [(ratio.key, ratio.label) for ratio in ratios],
+        "totals": totals,
+        "ranks": ranks,
+        "monthly": monthly,
+        "daily": daily,
+        "groups": groups,
+    }
+
+
+def agents_sheet(data, rows, title="Agents"):
+    header = [
+        "Agent",
+        "Forms Filled",
+        *(label for _, label in data["metrics"]),
+        *(label for _, label in data["ratios"]),
+    ]
+    body = [
+        [
+            row["user__name"],
+            row["forms_filled"],
+            *(row[key] for key, _ in data["metrics"]),
+            *(row[key] for key, _ in data["ratios"]),
+        ]
+        for row in sorted(rows, key=lambda r: r["user__name"])
+    ]
+    body.append(
+        [
+            "Total",
+            sum(row["forms_filled"] for row in rows),
+            *(sum(row[key] for row in rows) for key, _ in data["metrics"]),
+            *("" for _ in data["ratios"]),
+        ]
+    )
+    return title, header, body
+
+
+def build_jobs(session, data, output_dir, fmt):
+    """One job per workbook: the session, each agent group and each agent."""
+    extension = ".xlsx" if fmt == "xlsx" else ""
+    root = os.path.join(output_dir, slugify(session.name))
+    metric_labels = [label for _, label in data["metrics"]]
+
+    def job(path, title, sheets):
+        return {
+            "path": f"{path}{extension}",
+            "format": fmt,
+            "title": title,
+            "sheets": sheets,
+        }
+
+    by_group = {}
+    for row in data["totals"]:
+        group = data["groups"].get(row["user__id"])
+        by_group.setdefault(group or "Unassigned", []).append(row)
+
+    session_sheets = [agents_sheet(data, data["totals"])]
+    if data["groups"]:
+        session_sheets.append(
+            (
+                "Groups",
+                ["Group", "Agents", "Forms Filled", *metric_labels],
+                [
+                    [
+                        group,
+                        len(rows),
+                        sum(row["forms_filled"] for row in rows),
+                        *(sum(row[key] for row in rows) for key, _ in data["metrics"]),
+                    ]
+                    for group, rows in sorted(by_group.items(), key=lambda i: str(i[0]))
+                ],
+            )
+        )
+    jobs = [job(os.path.join(root, "session-summary"), session.name, session_sheets)]
+
+    if data["groups"]:
+        for group, rows in by_group.items():
+            jobs.append(
+                job(
+                    os.path.join(root, "groups", slugify(str(group)) or "group"),
+                    f"{session.name} - {group}",
+                    [agents_sheet(data, rows)],
+                )
+            )
+
+    for row in data["totals"]:
+        user_id = row["user__id"]
+        summary = [
+            [label, row[key], data["ranks"][key.removeprefix("total_")][user_id]]
+            for key, label in data["metrics"]
+        ]
+        summary.append(["Forms Filled", row["forms_filled"], ""])
+        summary.extend([label, row[key], ""] for key, label in data["ratios"])
+        sheets = [
+            ("Summary", ["Metric", "Total", "Rank"], summary),
+            (
+                "Monthly",
+                ["Month", "Forms Filled", *metric_labels],
+                [list(r) for r in data["monthly"].get(user_id, [])],
+            ),
+        ]
+        if user_id in data["daily"]:
+            sheets.append(
+                (
+                    "Daily",
+                    ["Date", *metric_labels],
+                    [list(r) for r in data["daily"][user_id]],
+                )
+            )
+        name = slugify(row["user__name"]) or "agent"
+        jobs.append(
+            job(
+                os.path.join(root, "agents", f"{user_id}-{name}"),
+                f"{session.name} - {row['user__name']}",
+                sheets,
+            )
+        )
+    return jobs
+
+
+def write_csv(job, path):
+    """A directory with one CSV file per sheet."""
+    os.makedirs(path)
+    for index, (title, header, rows) in enumerate(job["sheets"], 1):
+        filename = f"{index:02d}-{slugify(title)}.csv"
+        with open(os.path.join(path, filename), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+
+def write_xlsx(job, path):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    workbook.properties.title = job["title"]
+    for title, header, rows in job["sheets"]:
+        sheet = workbook.create_sheet(title=title[:31])
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
+
+
+def write_workbook(job):
+    """Write one workbook, run in a worker process. Returns its path."""
+    path = job["path"]
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Left behind by an interrupted run
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    elif os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    if job["format"] == "xlsx":
+        write_xlsx(job, tmp_path)
+    else:
+        write_csv(job, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def remove_output(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def generate_workbooks(jobs, workers=None, force=False, progress=None):
+    """Write the jobs' workbooks across ``workers`` processes.
+
+    Existing workbooks are skipped unless ``force``. ``progress`` is called
+    with ``(done, total, path, error)`` as each workbook finishes. Returns
+    ``(written, skipped, failed)`` where ``failed`` lists ``(path, error)``.
+    """
+    if force:
+        for job in jobs:
+            remove_output(job["path"])
+    pending = [job for job in jobs if not os.path.exists(job["path"])]
+    skipped = len(jobs) - len(pending)
+    written, failed = 0, []
+    if not pending:
+        return written, skipped, failed
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+        futures = {pool.submit(write_workbook, job): job for job in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            path, error = futures[future]["path"], None
+            try:
+                future.result()
+                written += 1
+            except Exception as e:
+                error = str(e)
+                failed.append((path, error))
+            if progress:
+                progress(done, len(pending), path, error)
+    return written, skipped, failed